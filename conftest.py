@@ -0,0 +1,21 @@
+import os
+import sys
+
+# vesicle and synthase are flat collections of modules, which import each other by name (vesicle.py imports from
+# synthase), so both directories need to be on the path for their tests.
+_ROOT = os.path.dirname(os.path.abspath(__file__))
+for _directory in ("synthase", "vesicle"):
+    if os.path.join(_ROOT, _directory) not in sys.path:
+        sys.path.insert(0, os.path.join(_ROOT, _directory))
+
+import pytest  # noqa: E402
+import cache  # noqa: E402
+
+
+@pytest.fixture(autouse=True, scope="session")
+def _cache_directory(tmp_path_factory):
+    # keeps generated sources and shared objects out of the user's own cache
+    original = cache.default.directory
+    cache.default.directory = str(tmp_path_factory.mktemp("synthase-cache"))
+    yield cache.default.directory
+    cache.default.directory = original
@@ -0,0 +1,235 @@
+import collections
+import hashlib
+import os
+import sys
+import sysconfig
+import types
+
+
+# Content-addressed cache for generated code.  Keys are hashes of everything that can change the output: the traced
+# function's code (recursively including the functions and classes it refers to, directly or as attributes of
+# modules, and closure values and defaults), the concrete argument and return types, any compile options, and the
+# synthase version.  Entries are kept in memory and on disk, and each store is trimmed back under its byte budget,
+# dropping the least recently used entries.  The disk budget also covers the shared objects that native.py builds,
+# which are kept in the NATIVE subdirectory.
+
+_IMMUTABLE = (type(None), bool, int, float, complex, str, bytes)
+NATIVE = "native"
+
+
+def _feed(h, obj, seen, top_level=False):
+    if isinstance(obj, _IMMUTABLE):
+        h.update(b"%s:%s;" % (type(obj).__name__.encode(), repr(obj).encode()))
+        return
+    if id(obj) in seen:
+        h.update(b"<seen %d>;" % seen[id(obj)])
+        return
+    seen[id(obj)] = len(seen)
+    if isinstance(obj, (tuple, list)):
+        h.update(b"%s[" % type(obj).__name__.encode())
+        for item in obj:
+            _feed(h, item, seen)
+        h.update(b"]")
+    elif isinstance(obj, (set, frozenset)):
+        h.update(b"set[")
+        for item in sorted(obj, key=repr):
+            _feed(h, item, seen)
+        h.update(b"]")
+    elif isinstance(obj, dict):
+        h.update(b"dict[")
+        for k, v in sorted(obj.items(), key=lambda item: repr(item[0])):
+            _feed(h, k, seen)
+            _feed(h, v, seen)
+        h.update(b"]")
+    elif isinstance(obj, types.CodeType):
+        h.update(b"code:")
+        h.update(obj.co_code)
+        _feed(h, obj.co_consts, seen)
+        _feed(h, obj.co_names, seen)
+        _feed(h, obj.co_varnames, seen)
+        _feed(h, obj.co_freevars, seen)
+    elif isinstance(obj, (types.FunctionType, type)) and _fixed_module(sys.modules.get(obj.__module__)):
+        h.update(b"fixed:%s.%s;" % (obj.__module__.encode(), obj.__qualname__.encode()))
+    elif isinstance(obj, types.FunctionType):
+        h.update(b"function:")
+        _feed(h, obj.__code__, seen)
+        _feed(h, obj.__defaults__, seen)
+        _feed(h, obj.__kwdefaults__, seen)
+        names = _global_names(obj.__code__)
+        for cell in obj.__closure__ or ():
+            h.update(b"cell=")
+            _feed_global(h, cell.cell_contents, names, seen)
+        for name in sorted(names):
+            if name in obj.__globals__:
+                h.update(b"global %s=" % name.encode())
+                _feed_global(h, obj.__globals__[name], names, seen, top_level=True)
+    elif isinstance(obj, (staticmethod, classmethod)):
+        _feed(h, obj.__func__, seen)
+    elif isinstance(obj, property):
+        _feed(h, (obj.fget, obj.fset, obj.fdel), seen)
+    elif isinstance(obj, types.ModuleType):
+        h.update(b"module:%s;" % obj.__name__.encode())
+    elif isinstance(obj, type):
+        h.update(b"class:%s.%s(" % (obj.__module__.encode(), obj.__qualname__.encode()))
+        if obj.__module__ != "builtins":
+            for base in obj.__bases__:
+                _feed(h, base, seen)
+            for name, value in sorted(vars(obj).items()):
+                if name not in ("__dict__", "__weakref__", "__doc__", "__module__", "__qualname__"):
+                    h.update(b"%s=" % name.encode())
+                    _feed(h, value, seen)
+        h.update(b")")
+    elif top_level or type(obj).__module__ == "builtins":
+        # module-level mutable state (caches and the like) and builtin objects are identified by type alone
+        h.update(b"object:%s;" % type(obj).__qualname__.encode())
+    else:
+        h.update(b"instance:")
+        _feed(h, type(obj), seen)
+        _feed(h, vars(obj) if hasattr(obj, "__dict__") else repr(obj), seen)
+
+
+def _feed_global(h, value, names, seen, top_level=False, within=()):
+    # Modules are followed through whichever of their attributes the code might use (attribute names are among its
+    # names, as for mod.func), so that changing a function called as mod.func changes the key.  The module itself is
+    # not marked as seen, since other functions may use other attributes of it; within holds the modules already
+    # being followed, as modules can refer to each other (such as os and os.path).
+    if not isinstance(value, types.ModuleType):
+        _feed(h, value, seen, top_level=top_level)
+        return
+    h.update(b"module:%s(" % value.__name__.encode())
+    if value not in within and not _fixed_module(value):
+        attributes = vars(value)
+        for name in sorted(names):
+            if name in attributes:
+                h.update(b"%s=" % name.encode())
+                _feed_global(h, attributes[name], names, seen, True, within + (value,))
+    h.update(b")")
+
+
+_STDLIB, _SITE = (tuple(os.path.normcase(os.path.abspath(sysconfig.get_paths()[kind])) + os.sep for kind in kinds)
+                  for kinds in (("stdlib", "platstdlib"), ("purelib", "platlib")))
+_SYNTHASE = {"cache", "concrete_function", "concrete_operator", "concrete_types", "intrange", "ir", "native", "ranges",
+             "synthase"}
+
+
+def _fixed_module(module):
+    # builtin and standard library modules, and synthase's own (which the version in every key covers), whose
+    # contents (functions and classes included) are identified by name alone
+    if module is None:
+        return False
+    path = getattr(module, "__file__", None)
+    if path is None or module.__name__ in _SYNTHASE:
+        return True
+    path = os.path.normcase(os.path.abspath(path))
+    return path.startswith(_STDLIB) and not path.startswith(_SITE)
+
+
+def _global_names(code):
+    names = set(code.co_names)
+    for const in code.co_consts:
+        if isinstance(const, types.CodeType):
+            names |= _global_names(const)
+    return names
+
+
+def key(target, args, rettype, version, **options):
+    h = hashlib.sha256()
+    _feed(h, (version, [arg.to_c() for arg in args], rettype.to_c(), options), {})
+    _feed(h, target, {})
+    return h.hexdigest()
+
+
+class Cache:
+    def __init__(self, directory=None, max_memory_bytes=16 * 1024 * 1024, max_disk_bytes=256 * 1024 * 1024):
+        if directory is None:
+            directory = os.environ.get("SYNTHASE_CACHE", os.path.join(os.path.expanduser("~"), ".cache", "synthase"))
+        self.directory = directory
+        self.max_memory_bytes, self.max_disk_bytes = max_memory_bytes, max_disk_bytes
+        self.memory = collections.OrderedDict()
+        self.memory_bytes = 0
+        self.hits = self.misses = 0
+
+    def _path(self, key):
+        return os.path.join(self.directory, key + ".c")
+
+    def get(self, key):
+        if key in self.memory:
+            self.memory.move_to_end(key)
+            self.hits += 1
+            return self.memory[key]
+        if self.directory is not None:
+            try:
+                with open(self._path(key), "r") as f:
+                    source = f.read()
+                os.utime(self._path(key))
+            except OSError:
+                pass
+            else:
+                self._remember(key, source)
+                self.hits += 1
+                return source
+        self.misses += 1
+        return None
+
+    def put(self, key, source):
+        self._remember(key, source)
+        if self.directory is not None:
+            try:
+                os.makedirs(self.directory, exist_ok=True)
+                temporary = self._path(key) + ".%d.tmp" % os.getpid()
+                with open(temporary, "w") as f:
+                    f.write(source)
+                os.replace(temporary, self._path(key))
+                self.trim_disk()
+            except OSError:
+                pass  # the disk cache is only an optimization
+
+    def _remember(self, key, source):
+        if key in self.memory:
+            self.memory_bytes -= len(self.memory.pop(key))
+        self.memory[key] = source
+        self.memory_bytes += len(source)
+        while self.memory_bytes > self.max_memory_bytes and len(self.memory) > 1:
+            self.memory_bytes -= len(self.memory.popitem(last=False)[1])
+
+    def _files(self):
+        # the paths of everything on disk under the byte budget: generated sources, and shared objects built from them
+        for directory, suffix in ((self.directory, ".c"), (os.path.join(self.directory, NATIVE), ".so")):
+            try:
+                names = os.listdir(directory)
+            except OSError:
+                continue
+            yield from (os.path.join(directory, name) for name in names if name.endswith(suffix))
+
+    def trim_disk(self, keep=None):
+        # removes the least recently used files (other than keep) until the rest fit in max_disk_bytes
+        if self.directory is None:
+            return
+        entries = []
+        for path in self._files():
+            if path == keep:
+                continue
+            try:
+                stat = os.stat(path)
+            except OSError:
+                continue  # removed by another process meanwhile
+            entries.append((stat.st_mtime, stat.st_size, path))
+        total = sum(size for _, size, _ in entries) + (os.path.getsize(keep) if keep is not None else 0)
+        for _, size, path in sorted(entries):
+            if total <= self.max_disk_bytes:
+                break
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+            total -= size
+
+    def clear(self):
+        self.memory.clear()
+        self.memory_bytes = 0
+        if self.directory is not None:
+            for path in list(self._files()):
+                os.remove(path)
+
+
+default = Cache()
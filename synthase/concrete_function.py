@@ -1,4 +1,5 @@
-import concrete_types, concrete_operator
+import re
+import concrete_types, concrete_operator, ir, ranges
 
 
 def synth(x):
@@ -24,6 +25,9 @@ class Argument:
     def synth(self):
         return self.name
 
+    def lower(self, graph):
+        return graph.argument(self)
+
     def synth_as_argument(self):
         return self.concrete_type.to_c() + self.synth()
 
@@ -58,7 +62,9 @@ class IntegerArgument(Argument):
         these = []
         plow, phigh = possible.low(), possible.high()
         for low, high in self.asserted_range.elems:
-            if low != plow:
+            if high - low == 1:
+                these.append(concrete_operator.eq.to_c(self.synth(), low))
+            elif low != plow:
                 if high != phigh:
                     these.append(
                             concrete_operator.logical_and.to_c(
@@ -72,6 +78,23 @@ class IntegerArgument(Argument):
         assert these
         return concrete_operator.logical_or.join_c(these)
 
+    def synth_py_assertions(self):
+        possible = self.concrete_type.get_range()
+        if self.asserted_range == possible:
+            return None
+        these = []
+        plow, phigh = possible.low(), possible.high()
+        for low, high in self.asserted_range.elems:
+            if high - low == 1:
+                these.append("%s == %d" % (self.synth(), low))
+            elif low != plow and high != phigh:
+                these.append("%d <= %s < %d" % (low, self.synth(), high))
+            elif low != plow:
+                these.append("%s >= %d" % (self.synth(), low))
+            else:
+                these.append("%s < %d" % (self.synth(), high))
+        return "(%s)" % " or ".join(these)
+
 
 C_FUNCTION_TEMPLATE = """
 %s {
@@ -81,22 +104,93 @@ C_FUNCTION_TEMPLATE = """
     %s
 }"""
 FUNC_PREFIX = "sya_"
+C_BATCH_TEMPLATE = """
+void %s(const uint8_t *restrict base, %sstride, %scount, %s*restrict out) {%s
+    for (%si = 0; i < count; i++) {
+        out[i] = %s((uint8_t *) base + (size_t) i * stride, %s);
+    }
+}"""
+C_BATCH_STRIDE_CHECK = """
+    if (stride < %d) {
+        abort_assert_fail();
+    }"""
+BATCH_SUFFIX = "_batch"
+PY_FUNCTION_TEMPLATE = """def %s(%s):
+    %s
+"""
+PY_ASSERTION_TEMPLATE = """if not (%s):
+        raise AssertionError("Runtime assertion failed in %s")"""
+C_STRUCT_TEMPLATE = """
+struct %s {
+    %s
+};"""
+DECODE_SUFFIX = "_decode"
+
+
+class Struct:
+    # C struct mirroring the attributes of a traced record object.  members are (name, kind, value) triples, where
+    # kind is "int" (value is a traced integer), "bytes" (value is (buffer, start, length), with a constant length),
+    # or "struct" (value is a nested Struct).  Integer member types are chosen by Function.synth_decoder.
+    def __init__(self, name, members):
+        self.name = FUNC_PREFIX + re.sub(r"\W", "_", name)
+        self.members = members
+        self.types = {}
+
+    def leaves(self, prefix=""):
+        # (struct, member name, C access path, kind, value) for every non-struct member, including nested ones
+        for name, kind, value in self.members:
+            if kind == "struct":
+                yield from value.leaves(prefix + name + ".")
+            else:
+                yield self, name, prefix + name, kind, value
+
+    def nested(self):
+        # every distinct struct type used, innermost first, so that each can be defined before it is used
+        out = []
+        for name, kind, value in self.members:
+            if kind == "struct":
+                out += [struct for struct in value.nested() if struct.name not in [other.name for other in out]]
+        return out + [self]
+
+    def synth_definition(self):
+        members = []
+        for name, kind, value in self.members:
+            if kind == "int":
+                members.append("%s%s;" % (self.types[name].to_c(), name))
+            elif kind == "bytes":
+                members.append("uint8_t %s[%d];" % (name, value[2]))
+            else:
+                members.append("struct %s %s;" % (value.name, name))
+        return C_STRUCT_TEMPLATE % (self.name, "\n    ".join(members))
 
 
 class Function:
     def __init__(self, function_name, return_type):
         assert isinstance(return_type, concrete_types.Type)
-        self.function_name = FUNC_PREFIX + function_name
+        self.function_name = FUNC_PREFIX + re.sub(r"\W", "_", function_name)  # lambdas are named <lambda>
         self._arguments = []
         self.complex_assertions = []
         self.return_type = return_type
+        self.helpers = []
 
     def synth_arguments(self):
         return ", ".join(arg.synth_as_argument() for arg in self._arguments)
 
+    def _runtime_checks(self):
+        # the assertions left to check at run time, as (lhs node, operator, rhs node) triples in a fresh graph
+        graph = ir.Graph()
+        checks = ranges.resolve(graph, [(graph.lower(lhs), op, graph.lower(rhs))
+                                        for lhs, op, rhs in self.complex_assertions])
+        return graph, ranges.coalesce_byte_checks(graph, checks)
+
     def synth_assertions(self):
-        assert not self.complex_assertions, "Complex assertions not currently handled"
-        subasserts = filter(None, (arg.synth_assertions() for arg in self._arguments))
+        # Argument range checks (including minimum lengths of byte arrays) come first, so that the byte loads in the
+        # remaining checks are only evaluated once they are known to be in bounds.
+        graph, checks = self._runtime_checks()
+        subasserts = [assertion for assertion in (arg.synth_assertions() for arg in self._arguments) if assertion]
+        emitter = ir.CEmitter(graph, [])
+        subasserts += [op.to_c(emitter.expression(lhs), emitter.expression(rhs)) for lhs, op, rhs in checks]
+        self.helpers += [helper for helper in emitter.helpers if helper not in self.helpers]
         if subasserts:
             return concrete_operator.logical_and.join_c(subasserts)
         else:
@@ -109,10 +203,101 @@ class Function:
                 arguments=self.synth_arguments())
 
     def synth_body(self, value):
+        graph = ir.Graph()
+        root, = ir.combine_loads(graph, [graph.lower(value)])
+        emitter = ir.CEmitter(graph, [root])
+        statements = emitter.statements()
+        if self.return_type == concrete_types.void:
+            statements.append(emitter.expression(root) + ";")
+        else:
+            statements.append("return " + emitter.expression(root) + ";")
+        self.helpers += [helper for helper in emitter.helpers if helper not in self.helpers]
+        return "\n    ".join(statements)
+
+    def record_length(self):
+        # the length that the checks on a function of a single byte array require of it, if exactly one
+        assert len(self._arguments) == 2 and isinstance(self._arguments[0].concrete_type, concrete_types.ByteArrayType), \
+            "batch mode needs a function of a single byte array: %s" % self.function_name
+        lengths = self._arguments[1].asserted_range
+        return lengths.low() if lengths.size() == 1 else None
+
+    def synth_batch(self):
+        # Companion function that applies this one to count records, stride bytes apart, in a loop simple enough for
+        # the C compiler to inline the per-record function and vectorize across records.  Records are passed with the
+        # length the function requires (which may be less than the stride, for padded records), or else the stride.
+        # Must come after synth_implementation, which is where the length argument's range is narrowed.
+        length = self.record_length()
+        assert self.return_type != concrete_types.void, "batch mode needs a return value: %s" % self.function_name
+        length_type = self._arguments[1].concrete_type.to_c()
+        check = "" if length is None else C_BATCH_STRIDE_CHECK % length
+        return C_BATCH_TEMPLATE % (self.function_name + BATCH_SUFFIX, length_type, length_type, self.return_type.to_c(),
+                                   check, length_type, self.function_name, "stride" if length is None else length)
+
+    def synth_decoder(self, struct):
+        # A function that fills in every member of struct (nested structs included) in a single pass over the input.
+        # All members share one expression graph, so common subexpressions and bounds checks are emitted just once.
+        # Each integer member gets the narrowest type that range analysis says can hold it.
+        assert self.return_type == concrete_types.void
+        graph = ir.Graph()
+        leaves = list(struct.leaves())
+        roots = ir.combine_loads(graph, [graph.lower(value if kind == "int" else value[1])
+                                         for _, _, _, kind, value in leaves])
+        memo, widest = {}, {}
+        for (owner, name, _, kind, _), root in zip(leaves, roots):
+            if kind == "int":
+                values = ranges.node_range(root, memo)
+                key = owner.name, name
+                widest[key] = values if key not in widest or widest[key] is None or values is None \
+                    else widest[key] | values
+        emitter = ir.CEmitter(graph, roots)
+        statements = emitter.statements()
+        for (owner, name, _, kind, _), root in zip(leaves, roots):
+            if kind == "int":
+                try:
+                    owner.types[name] = concrete_types.fitting(widest[owner.name, name])
+                except ValueError:  # as for temporaries, members that no type can hold keep their expression's type
+                    owner.types[name] = emitter.c_type(root)
+        for (_, _, path, kind, value), root in zip(leaves, roots):
+            if kind == "int":
+                statements.append("out->%s = %s;" % (path, emitter.expression(root)))
+            else:
+                buffer, _, length = value
+                statements.append("memcpy(out->%s, %s + %s, %d);" % (path, synth(buffer), emitter.expression(root),
+                                                                     length))
+        self.helpers += [helper for helper in emitter.helpers if helper not in self.helpers]
+        body = "\n    ".join(statements)
+        assertions = self.synth_assertions()
+        declaration = "void {name}({arguments}, struct {struct} *out)".format(
+                name=self.function_name, arguments=self.synth_arguments(), struct=struct.name)
+        definitions = "".join(nested.synth_definition() for nested in struct.nested())
+        return "".join(self.helpers) + definitions + C_FUNCTION_TEMPLATE % (declaration, assertions, body)
+
+    def synth_python(self, value):
+        # The same function as Python source, for hosts without a C compiler.  Byte arrays are passed without their
+        # lengths, which are taken with len() instead; the source needs ir.py_globals() to run.
+        lengths = {arg.name + "_len" for arg in self._arguments
+                   if isinstance(arg.concrete_type, concrete_types.ByteArrayType)}
+        parameters = [arg.name for arg in self._arguments if arg.name not in lengths]
+        prologue = ["%s = len(%s)" % (name, name[:-len("_len")]) for name in sorted(lengths)]
+        graph = ir.Graph()
+        root, = ir.combine_loads(graph, [graph.lower(value)])
+        emitter = ir.PyEmitter(graph, [root])
+        statements = emitter.statements()
         if self.return_type == concrete_types.void:
-            return synth(value) + ";"
+            statements.append(emitter.expression(root))
         else:
-            return "return " + synth(value) + ";"
+            statements.append("return " + emitter.converted(root, self.return_type))
+        check_graph, checks = self._runtime_checks()
+        conditions = [assertion for assertion in (arg.synth_py_assertions() for arg in self._arguments
+                                                  if isinstance(arg, IntegerArgument)) if assertion]
+        check_emitter = ir.PyEmitter(check_graph, [])
+        conditions += [op.to_py_expr(check_emitter.expression(lhs), check_emitter.expression(rhs))
+                       for lhs, op, rhs in checks]
+        if conditions:
+            prologue.append(PY_ASSERTION_TEMPLATE % (" and ".join(conditions), self.function_name))
+        return PY_FUNCTION_TEMPLATE % (self.function_name, ", ".join(parameters), "\n    ".join(prologue + statements))
 
     def synth_implementation(self, value):
-        return C_FUNCTION_TEMPLATE % (self.synth_declaration(), self.synth_assertions(), self.synth_body(value))
+        body = self.synth_body(value)
+        assertions = self.synth_assertions()
+        return "".join(self.helpers) + C_FUNCTION_TEMPLATE % (self.synth_declaration(), assertions, body)
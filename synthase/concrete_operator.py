@@ -17,6 +17,9 @@ class Operator:
     def __eq__(self, other):
         return self is other
 
+    def __hash__(self):
+        return id(self)
+
     @property
     def reverse(self):
         assert self.py_reverse
@@ -44,6 +47,11 @@ class Operator:
     def to_c(self, a, b):
         return "(%s %s %s)" % (a, self.c_symbol, b)
 
+    def to_py_expr(self, a, b):
+        # The same operation as Python source, with Python's meaning: // rounds toward negative infinity, and
+        # and/or give one of their operands.  ir.PyEmitter adjusts for C where the difference matters.
+        return "(%s %s %s)" % (a, _PY_SYMBOLS.get(self.python_name, self.c_symbol), b)
+
     def join_c(self, args):
         args = list(args)
         assert args
@@ -55,6 +63,8 @@ class Operator:
         return "Operator(%s, %s)" % (self.python_name, self.c_symbol)
 
 
+_PY_SYMBOLS = {"floordiv": "//", "logical_and": "and", "logical_or": "or"}
+
 # Should Operator("truediv", "/") be included? floordiv would be // in python, but it's not so in C...
 operators = [Operator("add", "+"), Operator("sub", "-"), Operator("mul", "*"), Operator("floordiv", "/"),
              Operator("lshift", "<<"), Operator("rshift", ">>"),
@@ -66,5 +76,5 @@ operators = [Operator("add", "+"), Operator("sub", "-"), Operator("mul", "*"), O
              Operator("logical_and", "&&"), Operator("logical_or", "||")]
 operator_dict = {op.to_py(): op for op in operators}
 
-lt, gt, le, ge, eq, ne = [operator_dict[k] for k in ("lt", "le", "gt", "ge", "eq", "ne")]
+lt, gt, le, ge, eq, ne = [operator_dict[k] for k in ("lt", "gt", "le", "ge", "eq", "ne")]
 logical_and, logical_or = operator_dict["logical_and"], operator_dict["logical_or"]
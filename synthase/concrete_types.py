@@ -28,9 +28,9 @@ class IntegerType(Type):
 
     def get_range(self):
         if self.unsigned:
-            return intrange.range(0, 2 ** 32)
+            return intrange.range(0, 2 ** self.bits)
         else:
-            return intrange.range(-2 ** 31, 2 ** 32)
+            return intrange.range(-2 ** (self.bits - 1), 2 ** self.bits)
 
     def __hash__(self):
         return hash(self.bits if self.unsigned else -self.bits)
@@ -81,3 +81,20 @@ u64 = IntegerType(64, True)
 s64 = IntegerType(64, False)
 binary = ByteArrayType(u32)
 void = VoidType()
+
+
+def fitting(values):
+    # The smallest of the types above able to hold every value in values (an intrange.IntegerSet, or None if unknown,
+    # which gives s64).  Non-negative values too large for any type get u64, whose arithmetic wraps around without
+    # undefined behavior; values of both signs that no type can hold raise ValueError.
+    if values is None or not values:
+        return s64
+    low, high = values.low(), values.high()
+    for bits in (8, 16, 32, 64):
+        if low >= 0 and high <= 2 ** bits:
+            return IntegerType(bits, True)
+        elif low >= -2 ** (bits - 1) and high <= 2 ** (bits - 1):
+            return IntegerType(bits, False)
+    if low >= 0:
+        return u64
+    raise ValueError("no integer type can hold %s" % values)
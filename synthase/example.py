@@ -12,4 +12,4 @@ def example2(x, y):
 def min_func(a, b):
     return synthase.ifelse(a < b, a, b)
 
-print(synthase.compile(min_func, concrete_types.binary, rettype=concrete_types.u32))
+print(synthase.compile(min_func, concrete_types.u32, concrete_types.u32, rettype=concrete_types.u32))
@@ -1,63 +1,142 @@
+import bisect
+
+
 class IntegerSet:
+    # A set of integers, stored as sorted, disjoint and non-adjacent half-open intervals [starts[i], ends[i]).  Set
+    # operations merge the two interval lists in a single pass (O(n + m)), and membership is a binary search.
+    __slots__ = ("starts", "ends")
+
     def __init__(self, elems):
-        for elem in elems:
-            assert elem[0] < elem[1]
-        self.elems = sorted(elems, key=lambda x: x[0])
-        i = 0
-        while i < len(self.elems) - 1:
-            a = self.elems[i]
-            b = self.elems[i + 1]
-            if a[1] >= b[0]:
-                del self.elems[i + 1]
-                self.elems[i] = (a[0], b[1])
+        # elems is any iterable of (start, end) pairs, in any order and possibly overlapping
+        elems = sorted(elems)
+        starts, ends = [], []
+        for start, end in elems:
+            assert start < end, "empty or reversed interval: %s" % ((start, end),)
+            if ends and start <= ends[-1]:
+                if end > ends[-1]:
+                    ends[-1] = end
             else:
-                i += 1
+                starts.append(start)
+                ends.append(end)
+        self.starts, self.ends = starts, ends
+
+    @classmethod
+    def _normalized(cls, starts, ends):
+        out = cls.__new__(cls)
+        out.starts, out.ends = starts, ends
+        return out
+
+    @property
+    def elems(self):
+        return list(zip(self.starts, self.ends))
 
     def __eq__(self, other):
-        return isinstance(other, IntegerSet) and self.elems == other.elems
+        return isinstance(other, IntegerSet) and self.starts == other.starts and self.ends == other.ends
+
+    def __hash__(self):
+        return hash((tuple(self.starts), tuple(self.ends)))
 
     def __or__(self, other):
-        if isinstance(other, IntegerSet):
-            return IntegerSet(self.elems + other.elems)
-        else:
+        if not isinstance(other, IntegerSet):
             return NotImplemented
+        a_starts, a_ends, b_starts, b_ends = self.starts, self.ends, other.starts, other.ends
+        starts, ends = [], []
+        i = j = 0
+        while i < len(a_starts) or j < len(b_starts):
+            if j == len(b_starts) or (i < len(a_starts) and a_starts[i] <= b_starts[j]):
+                start, end = a_starts[i], a_ends[i]
+                i += 1
+            else:
+                start, end = b_starts[j], b_ends[j]
+                j += 1
+            if ends and start <= ends[-1]:
+                if end > ends[-1]:
+                    ends[-1] = end
+            else:
+                starts.append(start)
+                ends.append(end)
+        return IntegerSet._normalized(starts, ends)
 
     def __and__(self, other):
-        if isinstance(other, IntegerSet):
-            remain = other.elems
-            out = []
-            for elem in self.elems:
-                while remain and remain[0][1] <= elem[0]:  # next remain can be skipped
-                    remain = remain[1:]
-                if not remain: break
-                if elem[1] <= remain[0][0]:  # next elem can be skipped
-                    continue
-                # remain end > elem start; remain start > elem end
-                out.append((max(elem[0], remain[0][0]), min(elem[1], remain[0][1])))
-            return IntegerSet(out)
-        else:
+        if not isinstance(other, IntegerSet):
+            return NotImplemented
+        a_starts, a_ends, b_starts, b_ends = self.starts, self.ends, other.starts, other.ends
+        starts, ends = [], []
+        i = j = 0
+        while i < len(a_starts) and j < len(b_starts):
+            start, end = max(a_starts[i], b_starts[j]), min(a_ends[i], b_ends[j])
+            if start < end:
+                starts.append(start)
+                ends.append(end)
+            if a_ends[i] < b_ends[j]:
+                i += 1
+            else:
+                j += 1
+        return IntegerSet._normalized(starts, ends)
+
+    def __sub__(self, other):
+        if not isinstance(other, IntegerSet):
             return NotImplemented
+        b_starts, b_ends = other.starts, other.ends
+        starts, ends = [], []
+        j = 0
+        for start, end in zip(self.starts, self.ends):
+            while j < len(b_starts) and b_ends[j] <= start:
+                j += 1
+            k = j
+            while k < len(b_starts) and b_starts[k] < end:
+                if b_starts[k] > start:
+                    starts.append(start)
+                    ends.append(b_starts[k])
+                start = max(start, b_ends[k])
+                k += 1
+            if start < end:
+                starts.append(start)
+                ends.append(end)
+        return IntegerSet._normalized(starts, ends)
+
+    def complement(self, low, high):
+        # the integers in [low, high) that are not in this set
+        return range_to(low, high) - self
+
+    def __contains__(self, n):
+        i = bisect.bisect_right(self.starts, n) - 1
+        return i >= 0 and n < self.ends[i]
+
+    def size(self):
+        # number of integers in the set
+        return sum(self.ends) - sum(self.starts)
+
+    def shift(self, offset):
+        return IntegerSet._normalized([start + offset for start in self.starts], [end + offset for end in self.ends])
 
     def __bool__(self):
-        return bool(self.elems)
+        return bool(self.starts)
 
     def __repr__(self):
         return repr(self.elems)
 
     def low(self):
-        return self.elems[0][0]
+        return self.starts[0]
 
     def high(self):
-        return self.elems[-1][1]
+        return self.ends[-1]
 
     def is_contiguous(self):
-        return len(self.elems) <= 1
+        return len(self.starts) <= 1
+
+
+def from_ranges(elems):
+    # bulk construction from many (start, end) pairs: a single sort and merge
+    return IntegerSet(elems)
 
 
 def range(start, len):
     assert type(start) == int and type(len) == int
     assert len >= 0
-    return IntegerSet([(start, start + len)])
+    if len == 0:
+        return empty
+    return IntegerSet._normalized([start], [start + len])
 
 
 def range_to(start, end):  # end not included
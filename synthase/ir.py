@@ -0,0 +1,422 @@
+import functools
+import operator
+import struct
+import intrange, concrete_operator, concrete_types, ranges
+
+
+# Expression DAG used for code generation.  Traced values are lowered into a Graph, which hash-conses nodes so that
+# structurally identical subexpressions become the same node no matter how many times they were traced.  Nodes used
+# more than once are then emitted a single time, into a temporary.
+
+_COMMUTATIVE = {concrete_operator.operator_dict[name] for name in ("add", "mul", "or", "xor", "and", "eq", "ne")}
+
+
+class Node:
+    __slots__ = ("kind", "op", "args", "value", "index")
+
+    def __init__(self, kind, op, args, value, index):
+        # kind is one of "const" (value), "arg" (value is the Argument), "load" (args: buffer, index),
+        # "wideload" (args: buffer, index; value: (bytes, "little" or "big")), "binop" (op, args: a, b),
+        # or "select" (args: condition, value if nonzero, value if zero)
+        self.kind, self.op, self.args, self.value, self.index = kind, op, args, value, index
+
+    def is_leaf(self):
+        return self.kind in ("const", "arg")
+
+    def __repr__(self):
+        if self.kind == "const":
+            return repr(self.value)
+        elif self.kind == "arg":
+            return self.value.name
+        return "%s%d(%s)" % (self.kind, self.index, ", ".join(map(repr, self.args)))
+
+
+class Graph:
+    def __init__(self):
+        self.nodes = {}
+        self.order = []  # creation order, which is always a topological order
+        self._lowered = {}
+
+    def _intern(self, kind, op, args, value, identity=None):
+        key = (kind, op, tuple(arg.index for arg in args), value if identity is None else identity)
+        node = self.nodes.get(key)
+        if node is None:
+            node = Node(kind, op, tuple(args), value, len(self.order))
+            self.nodes[key] = node
+            self.order.append(node)
+        return node
+
+    def const(self, value):
+        assert type(value) == int, "only integer constants are supported: %r" % (value,)
+        return self._intern("const", None, (), value)
+
+    def argument(self, argument):
+        return self._intern("arg", None, (), argument, argument.name)
+
+    def load(self, buffer, index):
+        return self._intern("load", None, (buffer, index), None)
+
+    def wideload(self, buffer, index, width, byteorder):
+        return self._intern("wideload", None, (buffer, index), (width, byteorder))
+
+    def binop(self, op, a, b):
+        if op in _COMMUTATIVE and a.index > b.index:
+            a, b = b, a
+        return self._intern("binop", op, (a, b), None)
+
+    def select(self, condition, if_true, if_false):
+        if condition.kind == "const":
+            return if_true if condition.value else if_false
+        if if_true is if_false:
+            return if_true
+        return self._intern("select", None, (condition, if_true, if_false), None)
+
+    def rebuild(self, node, args):
+        # the same operation as node, applied to new operands
+        if node.kind == "binop":
+            return self.binop(node.op, *args)
+        elif node.kind == "select":
+            return self.select(*args)
+        return self._intern(node.kind, node.op, args, node.value)
+
+    def lower(self, value):
+        # converts a traced value (anything with a lower(graph) method, or an int) into a node
+        if type(value) == int:
+            return self.const(value)
+        if id(value) not in self._lowered:
+            assert hasattr(value, "lower"), "cannot lower %r into the expression graph" % (value,)
+            # value is kept alive alongside its node, so that its id cannot be reused
+            self._lowered[id(value)] = (value.lower(self), value)
+        return self._lowered[id(value)][0]
+
+
+# Wide loads: Parsable.uint16l and friends (like any hand-written from_bytes_little) assemble integers from single
+# byte loads, shifts and ORs.  combine_loads finds OR trees whose leaves are shifted loads of consecutive bytes of one
+# buffer, in little- or big-endian order, and replaces each with one wide load (shifted, if the whole group was).
+
+_OR = concrete_operator.operator_dict["or"]
+_LSHIFT = concrete_operator.operator_dict["lshift"]
+_ADD = concrete_operator.operator_dict["add"]
+_WIDTHS = (2, 4, 8)
+
+
+def _byte_terms(node):
+    # returns [(load node, shift)] if node is an OR of shifted byte loads, or None otherwise
+    if node.kind == "load":
+        return [(node, 0)]
+    elif node.kind == "binop" and node.op == _OR:
+        a, b = _byte_terms(node.args[0]), _byte_terms(node.args[1])
+        return a + b if a is not None and b is not None else None
+    elif node.kind == "binop" and node.op == _LSHIFT and node.args[1].kind == "const":
+        terms = _byte_terms(node.args[0])
+        return [(load, shift + node.args[1].value) for load, shift in terms] if terms is not None else None
+    return None
+
+
+def _split_index(index):
+    # splits an index node into (base node or None, constant offset)
+    if index.kind == "const":
+        return None, index.value
+    elif index.kind == "binop" and index.op == _ADD:
+        if index.args[1].kind == "const":
+            return index.args[0], index.args[1].value
+        elif index.args[0].kind == "const":
+            return index.args[1], index.args[0].value
+    return index, 0
+
+
+def _match_wideload(graph, node):
+    terms = _byte_terms(node)
+    if terms is None or len(terms) not in _WIDTHS:
+        return None
+    buffer = terms[0][0].args[0]
+    located = []
+    for load, shift in terms:
+        base, offset = _split_index(load.args[1])
+        if load.args[0] is not buffer or base is not _split_index(terms[0][0].args[1])[0]:
+            return None
+        located.append((offset, shift))
+    located.sort()
+    width, (first, base_shift) = len(located), located[0]
+    if [offset for offset, _ in located] != list(range(first, first + width)):
+        return None
+    if all(shift == base_shift + 8 * i for i, (_, shift) in enumerate(located)):
+        byteorder = "little"
+    elif all(shift == located[-1][1] + 8 * (width - 1 - i) for i, (_, shift) in enumerate(located)):
+        byteorder, base_shift = "big", located[-1][1]
+    else:
+        return None
+    base = _split_index(terms[0][0].args[1])[0]
+    index = graph.const(first) if base is None else base if first == 0 else graph.binop(_ADD, base, graph.const(first))
+    wide = graph.wideload(buffer, index, width, byteorder)
+    return wide if base_shift == 0 else graph.binop(_LSHIFT, wide, graph.const(base_shift))
+
+
+def combine_loads(graph, roots):
+    rewritten = {}
+
+    def rewrite(node):
+        if node.index not in rewritten:
+            out = _match_wideload(graph, node) if node.kind == "binop" and node.op == _OR else None
+            if out is None and not node.is_leaf():
+                out = graph.rebuild(node, tuple(rewrite(arg) for arg in node.args))
+            rewritten[node.index] = node if out is None else out
+        return rewritten[node.index]
+
+    return [rewrite(root) for root in roots]
+
+
+_WIDELOAD_HELPER = """
+#ifndef SYA_LOAD_{name_upper}
+#define SYA_LOAD_{name_upper}
+#include <stdint.h>
+#include <string.h>
+static inline uint{bits}_t sya_load_{name}(const uint8_t *p) {{
+    uint{bits}_t v;
+    memcpy(&v, p, sizeof(v));
+#if __BYTE_ORDER__ {compare} __ORDER_LITTLE_ENDIAN__
+    v = __builtin_bswap{bits}(v);
+#endif
+    return v;
+}}
+#endif"""
+
+
+def wideload_helper(width, byteorder):
+    name = "u%d%s" % (width * 8, "le" if byteorder == "little" else "be")
+    return "sya_load_" + name, _WIDELOAD_HELPER.format(
+        name=name, name_upper=name.upper(), bits=width * 8, compare="!=" if byteorder == "little" else "==")
+
+
+def use_counts(roots):
+    counts = {}
+    stack = list(roots)
+    for root in roots:
+        counts[root.index] = counts.get(root.index, 0)
+    visited = set()
+    while stack:
+        node = stack.pop()
+        counts[node.index] = counts.get(node.index, 0) + 1
+        if node.index in visited:
+            continue
+        visited.add(node.index)
+        stack.extend(node.args)
+    return counts
+
+
+# Type inference: C evaluates each operation in the type of its (promoted) operands, which is usually int, whatever
+# width the result needs.  Range analysis tells us the values every node can take, so each temporary is declared with
+# the narrowest type holding its values, and operands are cast wherever C's own choice of type could not represent
+# the operation exactly (such as a byte shifted left by 56, or the difference of two unsigned values going negative).
+
+_INT = concrete_types.s32
+_SHIFTS = {concrete_operator.operator_dict[name] for name in ("lshift", "rshift")}
+_LOGICAL = {concrete_operator.logical_and, concrete_operator.logical_or}
+
+
+def _promote(concrete_type):
+    return _INT if concrete_type.bits < _INT.bits else concrete_type
+
+
+def _common(a, b):
+    # the usual arithmetic conversions, for the LP64 model that the generated code is built for
+    a, b = _promote(a), _promote(b)
+    if a.bits != b.bits:
+        return a if a.bits > b.bits else b
+    return a if a.unsigned else b
+
+
+def _holds(concrete_type, values):
+    possible = concrete_type.get_range()
+    return values.low() >= possible.low() and values.high() <= possible.high()
+
+
+class CEmitter:
+    # Renders nodes as C expressions, hoisting every shared non-leaf node into a temporary.
+
+    def __init__(self, graph, roots, prefix="t"):
+        self.graph, self.roots, self.prefix = graph, roots, prefix
+        self.helpers = []  # C definitions that the emitted code relies upon
+        counts = use_counts(roots)
+        self.shared = {index for index, count in counts.items()
+                       if count > 1 and not graph.order[index].is_leaf()}
+        self.reachable = set(counts)
+        self.names = {}
+        self.ranges = {}  # memo for ranges.node_range
+        self.casts = {}
+
+    def temporary_type(self, node):
+        # Wide enough for every value of node; nodes of unknown range get the widest signed type.  Where no type is
+        # wide enough (such as for the difference of two u64 values), the temporary keeps the type of its expression.
+        try:
+            return concrete_types.fitting(ranges.node_range(node, self.ranges))
+        except ValueError:
+            return self.expression_type(node)
+
+    def c_type(self, node):
+        # the type that C gives to node where it is used: that of its temporary, if it has one
+        if node.index in self.names:
+            return self.temporary_type(node)
+        return self.expression_type(node)
+
+    def expression_type(self, node):
+        # the type that C gives to the expression emitted for node
+        if node.kind == "const":
+            return next(t for t in (_INT, concrete_types.s64, concrete_types.u64)
+                        if _holds(t, intrange.singular(node.value)))
+        elif node.kind == "arg":
+            return node.value.concrete_type
+        elif node.kind == "load":
+            return concrete_types.u8
+        elif node.kind == "wideload":
+            return concrete_types.IntegerType(8 * node.value[0], True)
+        elif node.kind == "select":
+            return _common(self.c_type(node.args[1]), self.c_type(node.args[2]))
+        elif node.op.is_comparison or node.op in _LOGICAL:
+            return _INT
+        return self.operation_type(node)
+
+    def operation_type(self, node):
+        # the type in which C carries out binop node, after any operand casts
+        a, b = (self.operand_cast(node) or self.c_type(arg) for arg in node.args)
+        return _promote(a) if node.op in _SHIFTS else _common(a, b)
+
+    def operand_cast(self, node):
+        # the type that the operands of binop node must be cast to, or None if C's own choice is already exact
+        if node.index not in self.casts:
+            self.casts[node.index] = None
+            values = [ranges.node_range(arg, self.ranges) for arg in node.args]
+            if not node.op.is_comparison:
+                values.append(ranges.node_range(node, self.ranges))
+            if node.op not in _LOGICAL and all(value is not None and value for value in values):
+                a, b = (self.c_type(arg) for arg in node.args)
+                natural = _promote(a) if node.op in _SHIFTS else _common(a, b)
+                if not all(_holds(natural, value) for value in values):
+                    try:
+                        wanted = concrete_types.fitting(functools.reduce(operator.or_, values))
+                    except ValueError:
+                        # no type holds the operands and the result together, so settle for holding the operands:
+                        # for non-negative operands, that means u64, and a result that wraps around as C defines
+                        wanted = concrete_types.fitting(functools.reduce(operator.or_, values[:2]))
+                    if wanted != natural:
+                        self.casts[node.index] = wanted if wanted.bits >= _INT.bits else _INT
+        return self.casts[node.index]
+
+    def expression(self, node):
+        if node.index in self.names:
+            return self.names[node.index]
+        return self.render(node)
+
+    def render(self, node):
+        if node.kind == "const":
+            return str(node.value)
+        elif node.kind == "arg":
+            return node.value.name
+        elif node.kind == "load":
+            return "(%s[%s])" % (self.expression(node.args[0]), self.expression(node.args[1]))
+        elif node.kind == "wideload":
+            name, helper = wideload_helper(*node.value)
+            if helper not in self.helpers:
+                self.helpers.append(helper)
+            return "%s(%s + %s)" % (name, self.expression(node.args[0]), self.expression(node.args[1]))
+        elif node.kind == "binop":
+            a, b = (self.expression(arg) for arg in node.args)
+            cast = self.operand_cast(node)
+            if cast is not None:  # for shifts, only the left operand determines the type
+                a = "((%s) %s)" % (cast.to_c().strip(), a)
+                b = b if node.op in _SHIFTS else "((%s) %s)" % (cast.to_c().strip(), b)
+            return node.op.to_c(a, b)
+        elif node.kind == "select":
+            # compilers turn a ternary between two side-effect-free values into a conditional move
+            return "(%s ? %s : %s)" % tuple(self.expression(arg) for arg in node.args)
+        raise Exception("Cannot emit node of kind %s" % node.kind)
+
+    def declare(self, node, name):
+        return "const %s%s = %s;" % (self.temporary_type(node).to_c(), name, self.render(node))
+
+    def statements(self):
+        out = []
+        for node in self.graph.order:
+            if node.index in self.shared and node.index in self.reachable:
+                name = "%s%d" % (self.prefix, len(self.names))
+                out.append(self.declare(node, name))
+                self.names[node.index] = name
+        return out
+
+
+_FLOORDIV = concrete_operator.operator_dict["floordiv"]
+
+
+def _py_wrap(text, concrete_type):
+    # Python source converting the value of text to concrete_type, as C does: modulo 2 ** bits
+    mask = (1 << concrete_type.bits) - 1
+    if concrete_type.unsigned:
+        return "((%s) & %#x)" % (text, mask)
+    half = 1 << (concrete_type.bits - 1)
+    return "((((%s) + %#x) & %#x) - %#x)" % (text, half, mask, half)
+
+
+class PyEmitter(CEmitter):
+    # Renders nodes as Python expressions instead, for hosts that cannot build the C.  Wide loads become struct
+    # unpacks through the functions in py_globals().  Python integers never overflow, so wherever range analysis
+    # cannot show that a value fits the C type it would have, it is reduced to that type, and division truncates
+    # toward zero, as in C.
+    def __init__(self, graph, roots, prefix="t"):
+        CEmitter.__init__(self, graph, roots, prefix)
+        self.reduced = {}  # node index -> the type that the value of node was reduced to, where it was
+
+    def _fits(self, node, concrete_type):
+        values = ranges.node_range(node, self.ranges)
+        if node.index in self.reduced:
+            values = self.reduced[node.index].get_range()
+        return values and _holds(concrete_type, values)
+
+    def converted(self, node, concrete_type):
+        # the expression for node, as C would convert it to concrete_type
+        text = self.expression(node)
+        return text if self._fits(node, concrete_type) else _py_wrap(text, concrete_type)
+
+    def render(self, node):
+        if node.kind == "wideload":
+            name, _ = wideload_helper(*node.value)
+            return "%s(%s, %s)[0]" % (name, self.expression(node.args[0]), self.expression(node.args[1]))
+        elif node.kind == "binop" and node.op in _LOGICAL:
+            return "(1 if %s else 0)" % node.op.to_py_expr(*(self.expression(arg) for arg in node.args))
+        elif node.kind == "binop":
+            operation_type = self.operation_type(node)
+            left, right = node.args
+            a = self.converted(left, operation_type)
+            b = self.expression(right) if node.op in _SHIFTS else self.converted(right, operation_type)
+            if node.op == _FLOORDIV and not all(values and values.low() >= 0 for values in
+                                                (ranges.node_range(arg, self.ranges) for arg in node.args)):
+                out = "sya_div(%s, %s)" % (a, b)
+            else:
+                out = node.op.to_py_expr(a, b)
+            if node.op.is_comparison or self._fits(node, operation_type):
+                return out
+            self.reduced[node.index] = operation_type
+            return _py_wrap(out, operation_type)
+        elif node.kind == "select":
+            result_type = self.expression_type(node)
+            condition = self.expression(node.args[0])
+            if_true, if_false = (self.converted(arg, result_type) for arg in node.args[1:])
+            return "(%s if %s else %s)" % (if_true, condition, if_false)
+        return CEmitter.render(self, node)
+
+    def declare(self, node, name):
+        return "%s = %s" % (name, self.render(node))
+
+
+def _truncating_div(a, b):
+    quotient = abs(a) // abs(b)
+    return -quotient if (a < 0) != (b < 0) else quotient
+
+
+def py_globals():
+    # the names that code from PyEmitter relies upon
+    out = {"sya_div": _truncating_div}
+    for width in _WIDTHS:
+        for byteorder, prefix in (("little", "<"), ("big", ">")):
+            code = {2: "H", 4: "I", 8: "Q"}[width]
+            out[wideload_helper(width, byteorder)[0]] = struct.Struct(prefix + code).unpack_from
+    return out
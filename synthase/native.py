@@ -0,0 +1,284 @@
+import array
+import ctypes
+import hashlib
+import os
+import shutil
+import subprocess
+import concrete_types, concrete_function, cache
+
+
+# Builds generated C into a shared object with the system compiler, caches the result by a hash of its source, and
+# wraps the entry point with ctypes.  Assertion failures in the generated code longjmp back to a wrapper, which
+# reports them to Python as AssertionError instead of aborting the process.
+
+class Unavailable(Exception):
+    pass
+
+
+PRELUDE = """#include <setjmp.h>
+#include <stdint.h>
+#include <string.h>
+static __thread jmp_buf sya_assert_jump;
+static void abort_assert_fail(void) {
+    longjmp(sya_assert_jump, 1);
+}
+"""
+
+WRAPPER = """
+int {name}_call({arguments}{result}) {{
+    if (setjmp(sya_assert_jump)) {{
+        return 1;
+    }}
+    {store}{name}({names});
+    return 0;
+}}
+"""
+
+_CTYPES = {(8, True): ctypes.c_uint8, (8, False): ctypes.c_int8, (16, True): ctypes.c_uint16,
+           (16, False): ctypes.c_int16, (32, True): ctypes.c_uint32, (32, False): ctypes.c_int32,
+           (64, True): ctypes.c_uint64, (64, False): ctypes.c_int64}
+
+
+BATCH_WRAPPER = """
+int {name}_call(const uint8_t *base, {length}stride, {length}count, {rettype}*out) {{
+    if (setjmp(sya_assert_jump)) {{
+        return 1;
+    }}
+    {name}(base, stride, count, out);
+    return 0;
+}}
+"""
+
+_TYPECODES = {(8, True): "B", (8, False): "b", (16, True): "H", (16, False): "h", (32, True): "I", (32, False): "i",
+              (64, True): "Q", (64, False): "q"}
+
+
+def _typecode(concrete_type):
+    code = _TYPECODES[concrete_type.bits, concrete_type.unsigned]
+    assert array.array(code).itemsize * 8 == concrete_type.bits, "no array typecode matches %s" % concrete_type
+    return code
+
+
+def _ctype(concrete_type):
+    return _CTYPES[concrete_type.bits, concrete_type.unsigned]
+
+
+def c_arguments(args):
+    # the C parameters that synthase.make_argument produces for these concrete types, as (type, name) pairs
+    out = []
+    for i, arg in enumerate(args):
+        if isinstance(arg, concrete_types.ByteArrayType):
+            out += [(arg.to_c(), "arg_%d" % i), (arg.length_type.to_c(), "arg_%d_len" % i)]
+        else:
+            out.append((arg.to_c(), "arg_%d" % i))
+    return out
+
+
+def function_name(target):
+    return concrete_function.Function(target.__name__, concrete_types.void).function_name
+
+
+def translation_unit(source, name, args, rettype):
+    parameters = c_arguments(args)
+    has_result = rettype != concrete_types.void
+    return PRELUDE + source + WRAPPER.format(
+        name=name, arguments=", ".join(ctype + pname for ctype, pname in parameters),
+        result=(", " if parameters else "") + rettype.to_c() + "*result" if has_result else "",
+        store="*result = " if has_result else "", names=", ".join(pname for _, pname in parameters))
+
+
+def compiler():
+    return shutil.which(os.environ.get("CC", "cc"))
+
+
+def build(unit):
+    # returns the path to a shared object built from unit, compiling it only if no cached copy exists
+    cc = compiler()
+    if cc is None:
+        raise Unavailable("no C compiler found")
+    flags = ["-O2", "-shared", "-fPIC"]
+    digest = hashlib.sha256("\0".join([unit, cc] + flags).encode()).hexdigest()
+    directory = os.path.join(cache.default.directory or ".", cache.NATIVE)
+    path = os.path.join(directory, digest + ".so")
+    try:
+        os.utime(path)  # marks it as recently used, for cache.Cache.trim_disk
+        return path
+    except OSError:
+        pass
+    os.makedirs(directory, exist_ok=True)
+    source_path = os.path.join(directory, digest + ".%d.c" % os.getpid())
+    temporary = path + ".%d.tmp" % os.getpid()
+    with open(source_path, "w") as f:
+        f.write(unit)
+    try:
+        result = subprocess.run([cc] + flags + ["-o", temporary, source_path], capture_output=True, text=True)
+        if result.returncode != 0:
+            raise Exception("C compiler failed on generated code:\n%s" % result.stderr)
+        os.replace(temporary, path)
+    finally:
+        os.remove(source_path)
+    cache.default.trim_disk(keep=path)
+    return path
+
+
+class _Py_buffer(ctypes.Structure):
+    _fields_ = [("buf", ctypes.c_void_p), ("obj", ctypes.py_object), ("len", ctypes.c_ssize_t),
+                ("itemsize", ctypes.c_ssize_t), ("readonly", ctypes.c_int), ("ndim", ctypes.c_int),
+                ("format", ctypes.c_char_p), ("shape", ctypes.c_void_p), ("strides", ctypes.c_void_p),
+                ("suboffsets", ctypes.c_void_p), ("internal", ctypes.c_void_p)]
+
+
+_get_buffer = ctypes.pythonapi.PyObject_GetBuffer
+_get_buffer.argtypes = [ctypes.py_object, ctypes.POINTER(_Py_buffer), ctypes.c_int]
+_release_buffer = ctypes.pythonapi.PyBuffer_Release
+_release_buffer.argtypes = [ctypes.POINTER(_Py_buffer)]
+_PyBUF_SIMPLE = 0
+
+
+class _BufferView:
+    # a pinned view of any object supporting the buffer protocol, for the duration of a with block
+    def __init__(self, obj):
+        self.obj, self.view = obj, _Py_buffer()
+
+    def __enter__(self):
+        _get_buffer(self.obj, ctypes.byref(self.view), _PyBUF_SIMPLE)
+        return self.view
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        _release_buffer(ctypes.byref(self.view))
+
+
+class NativeFunction:
+    # Calls a generated function.  Byte array arguments may be bytes, or anything else supporting the buffer
+    # protocol (bytearray, memoryview, mmap), which is passed without copying.
+    def __init__(self, library_path, name, args, rettype):
+        self.library = ctypes.CDLL(library_path)
+        self.name, self.args, self.rettype = name, args, rettype
+        self.entry = getattr(self.library, name + "_call")
+        self.entry.restype = ctypes.c_int
+        argtypes = []
+        for arg in args:
+            if isinstance(arg, concrete_types.ByteArrayType):
+                argtypes += [ctypes.c_void_p, _ctype(arg.length_type)]
+            else:
+                argtypes.append(_ctype(arg))
+        if rettype != concrete_types.void:
+            argtypes.append(ctypes.c_void_p)
+        self.entry.argtypes = argtypes
+
+    def __call__(self, *values):
+        assert len(values) == len(self.args), "%s takes %d arguments" % (self.name, len(self.args))
+        converted, views = [], []
+        try:
+            for arg, value in zip(self.args, values):
+                if isinstance(arg, concrete_types.ByteArrayType):
+                    views.append(_BufferView(value))
+                    view = views[-1].__enter__()
+                    converted += [view.buf, view.len]
+                else:
+                    converted.append(value)
+            if self.rettype != concrete_types.void:
+                result = _ctype(self.rettype)()
+                status = self.entry(*converted, ctypes.addressof(result))
+            else:
+                result = None
+                status = self.entry(*converted)
+        finally:
+            for view in views:
+                view.__exit__(None, None, None)
+        if status != 0:
+            raise AssertionError("Runtime assertion failed in %s" % self.name)
+        return None if result is None else result.value
+
+
+def load(source, name, args, rettype):
+    return NativeFunction(build(translation_unit(source, name, args, rettype)), name, args, rettype)
+
+
+class NativeBatch:
+    def __init__(self, library_path, name, record_type, rettype):
+        self.library = ctypes.CDLL(library_path)
+        self.name, self.rettype = name, rettype
+        self.length_ctype = _ctype(record_type.length_type)
+        self.entry = getattr(self.library, name + concrete_function.BATCH_SUFFIX + "_call")
+        self.entry.restype = ctypes.c_int
+        self.entry.argtypes = [ctypes.c_void_p, self.length_ctype, self.length_ctype, ctypes.c_void_p]
+
+    def __call__(self, buffer, stride, count, offset=0):
+        out = array.array(_typecode(self.rettype), bytes(count * self.rettype.bits // 8))
+        with _BufferView(buffer) as view:
+            assert 0 <= offset and offset + stride * count <= view.len, "records extend past the end of the buffer"
+            status = self.entry(view.buf + offset, stride, count, out.buffer_info()[0])
+        if status != 0:
+            raise AssertionError("Runtime assertion failed in %s, somewhere in the batch" % self.name)
+        return out
+
+
+class PythonBatch:
+    # fallback for hosts without a C compiler; length is that of each record, if not the whole stride
+    def __init__(self, target, rettype, length=None):
+        self.target, self.rettype, self.length = target, rettype, length
+
+    def __call__(self, buffer, stride, count, offset=0):
+        length = stride if self.length is None else self.length
+        if stride < length:
+            raise AssertionError("Runtime assertion failed in %s, somewhere in the batch" % self.target.__name__)
+        view = memoryview(buffer)
+        assert 0 <= offset and offset + stride * count <= len(view), "records extend past the end of the buffer"
+        return array.array(_typecode(self.rettype),
+                           [self.target(view[start:start + length]) for start in range(offset, offset + stride * count, stride)])
+
+
+STRUCT_WRAPPER = """
+int {name}_call(uint8_t *arg_0, {length}arg_0_len, void *out) {{
+    if (setjmp(sya_assert_jump)) {{
+        return 1;
+    }}
+    {name}(arg_0, arg_0_len, out);
+    return 0;
+}}
+"""
+
+
+def struct_ctype(struct, defined=None):
+    # a ctypes.Structure with the same layout as struct's C definition, after Function.synth_decoder has typed it
+    defined = {} if defined is None else defined
+    if struct.name not in defined:
+        fields = []
+        for name, kind, value in struct.members:
+            if kind == "int":
+                fields.append((name, _ctype(struct.types[name])))
+            elif kind == "bytes":
+                fields.append((name, ctypes.c_uint8 * value[2]))
+            else:
+                fields.append((name, struct_ctype(value, defined)))
+        defined[struct.name] = type(struct.name, (ctypes.Structure,), {"_fields_": fields})
+    return defined[struct.name]
+
+
+class NativeDecoder:
+    def __init__(self, library_path, name, record_type, struct):
+        self.library = ctypes.CDLL(library_path)
+        self.name, self.struct = name, struct_ctype(struct)
+        self.entry = getattr(self.library, name + "_call")
+        self.entry.restype = ctypes.c_int
+        self.entry.argtypes = [ctypes.c_void_p, _ctype(record_type.length_type), ctypes.c_void_p]
+
+    def __call__(self, data):
+        out = self.struct()
+        with _BufferView(data) as view:
+            status = self.entry(view.buf, view.len, ctypes.addressof(out))
+        if status != 0:
+            raise AssertionError("Runtime assertion failed in %s" % self.name)
+        return out
+
+
+def load_struct(source, name, record_type, struct):
+    unit = PRELUDE + source + STRUCT_WRAPPER.format(name=name, length=record_type.length_type.to_c())
+    return NativeDecoder(build(unit), name, record_type, struct)
+
+
+def load_batch(source, name, record_type, rettype):
+    unit = PRELUDE + source + BATCH_WRAPPER.format(name=name + concrete_function.BATCH_SUFFIX,
+                                                   length=record_type.length_type.to_c(), rettype=rettype.to_c())
+    return NativeBatch(build(unit), name, record_type, rettype)
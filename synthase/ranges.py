@@ -0,0 +1,152 @@
+import intrange, concrete_operator
+
+
+# Range analysis over the expression graph: every node is given the set of values it can take (or None, when
+# nothing useful is known), using the asserted ranges of integer arguments as inputs.  Assertions are then checked
+# against those ranges, so that most bounds checks are proven at compile time, and argument constraints are folded
+# into one range check per argument (for byte arrays: one minimum-length check on the length argument).
+
+def _hull(low, high):  # high is inclusive here
+    return intrange.range_to(low, high + 1)
+
+
+def _bits(n):
+    return n.bit_length()
+
+
+def node_range(node, memo):
+    if node.index in memo:
+        return memo[node.index]
+    if node.kind == "const":
+        out = intrange.singular(node.value)
+    elif node.kind == "arg":
+        out = getattr(node.value, "asserted_range", None)
+    elif node.kind == "load":
+        out = intrange.range(0, 256)
+    elif node.kind == "wideload":
+        out = intrange.range(0, 2 ** (8 * node.value[0]))
+    elif node.kind == "binop":
+        out = _binop_range(node.op, node_range(node.args[0], memo), node_range(node.args[1], memo))
+    elif node.kind == "select":
+        condition, if_true, if_false = (node_range(arg, memo) for arg in node.args)
+        if condition is not None and 0 not in condition:
+            out = if_true
+        elif condition is not None and condition == intrange.singular(0):
+            out = if_false
+        else:
+            out = if_true | if_false if if_true is not None and if_false is not None else None
+    else:
+        out = None
+    memo[node.index] = out
+    return out
+
+
+def _binop_range(op, a, b):
+    if op.is_comparison or op in (concrete_operator.logical_and, concrete_operator.logical_or):
+        return intrange.range(0, 2)
+    if not a or not b:
+        return None
+    alo, ahi, blo, bhi = a.low(), a.high() - 1, b.low(), b.high() - 1
+    name = op.to_py()
+    if name == "add":
+        return _hull(alo + blo, ahi + bhi)
+    elif name == "sub":
+        return _hull(alo - bhi, ahi - blo)
+    elif name == "mul":
+        products = [alo * blo, alo * bhi, ahi * blo, ahi * bhi]
+        return _hull(min(products), max(products))
+    elif alo < 0 or blo < 0:
+        return None  # the bitwise cases below only reason about non-negative values
+    elif name == "lshift":
+        return _hull(alo << blo, ahi << bhi)
+    elif name == "rshift":
+        return _hull(alo >> bhi, ahi >> blo)
+    elif name == "floordiv":
+        return _hull(alo // bhi, ahi // blo) if blo > 0 else None
+    elif name == "and":
+        return _hull(0, min(ahi, bhi))
+    elif name in ("or", "xor"):
+        return _hull(0, 2 ** max(_bits(ahi), _bits(bhi)) - 1)
+    return None
+
+
+def compare(op, a, b):
+    # True if op(x, y) holds for every x in a and y in b, False if it holds for none, and None otherwise
+    if not a or not b:
+        return None
+    if b.is_contiguous() and b.high() - b.low() == 1:
+        valid = op.valid_result_range(b.low(), min(a.low(), b.low()), max(a.high(), b.high()))
+        overlap = a & valid
+        return True if overlap == a else False if not overlap else None
+    alo, ahi, blo, bhi = a.low(), a.high() - 1, b.low(), b.high() - 1
+    name = op.to_py()
+    if name in ("lt", "le", "gt", "ge"):
+        strict = name in ("lt", "gt")
+        if name in ("gt", "ge"):
+            alo, ahi, blo, bhi = blo, bhi, alo, ahi
+        if ahi < bhi + (0 if strict else 1) and ahi < blo + (0 if strict else 1):
+            return True
+        if alo > bhi - (1 if strict else 0):
+            return False
+    elif name in ("eq", "ne") and not (a & b):
+        return name == "ne"
+    return None
+
+
+def _narrow(argument_node, op, value):
+    argument = argument_node.value
+    argument.asserted_range &= op.valid_result_range(value, argument.asserted_range.low(),
+                                                     argument.asserted_range.high())
+    assert argument.asserted_range, "No way to satisfy constraints on %s!" % argument
+
+
+def resolve(graph, assertions):
+    # assertions are (lhs node, operator, rhs node) triples.  Constraints between an integer argument and a value
+    # known at compile time are folded into the argument's asserted range; whatever is not proven afterwards is
+    # returned, to be checked at run time.
+    pending = []
+    for lhs, op, rhs in assertions:
+        if lhs.kind == "const" and rhs.kind != "const":
+            lhs, op, rhs = rhs, op.reverse, lhs
+        pending.append((lhs, op, rhs))
+    for lhs, op, rhs in pending:
+        if lhs.kind == "arg" and hasattr(lhs.value, "asserted_range"):
+            value_range = node_range(rhs, {})
+            if value_range and value_range.is_contiguous() and value_range.high() - value_range.low() == 1:
+                _narrow(lhs, op, value_range.low())
+    memo = {}  # only valid after all narrowing is done
+    remaining = []
+    for lhs, op, rhs in pending:
+        proven = compare(op, node_range(lhs, memo), node_range(rhs, memo))
+        assert proven is not False, "Runtime assertion known to be false at compile-time: %s %s %s" % (lhs, op, rhs)
+        if proven is None:
+            remaining.append((lhs, op, rhs))
+    return remaining
+
+
+_EQ = concrete_operator.operator_dict["eq"]
+
+
+def coalesce_byte_checks(graph, checks):
+    # turns runs of (buffer[k] == constant) checks on consecutive constant offsets into wide comparisons
+    singles, out = {}, []
+    for check in checks:
+        lhs, op, rhs = check
+        if op == _EQ and lhs.kind == "load" and lhs.args[1].kind == "const" and rhs.kind == "const":
+            singles.setdefault(lhs.args[0].index, {})[lhs.args[1].value] = (lhs.args[0], rhs.value)
+        else:
+            out.append(check)
+    for offsets in singles.values():
+        position = min(offsets)
+        while offsets:
+            if position not in offsets:
+                position = min(offsets)
+            width = next(w for w in (8, 4, 2, 1) if all(position + i in offsets for i in range(w)))
+            buffer = offsets[position][0]
+            value = sum(offsets.pop(position + i)[1] << (8 * i) for i in range(width))
+            if width == 1:
+                out.append((graph.load(buffer, graph.const(position)), _EQ, graph.const(value)))
+            else:
+                out.append((graph.wideload(buffer, graph.const(position), width, "little"), _EQ, graph.const(value)))
+            position += width
+    return out
@@ -1,4 +1,9 @@
-import intrange, concrete_operator, concrete_types, concrete_function
+import builtins
+import contextlib
+import time
+import intrange, concrete_operator, ir, concrete_types, concrete_function, cache, native
+
+VERSION = "0.11"  # part of every compile cache key; bump when generated code changes
 
 
 def _define_dynop(op, reverse):
@@ -14,6 +19,9 @@ def _define_dynop(op, reverse):
 class IntegerVirtual:
     locals().update(dict(_define_dynop(op, r) for op in concrete_operator.operators for r in [False, True]))
 
+    def assert_comparison(self, operator, other):
+        _tracing[-1].complex_assertions.append((self, operator, other))
+
     def __bool__(self):
         raise Exception("Attempting to convert a virtual to a bool is pointless!")
 
@@ -21,7 +29,7 @@ class IntegerVirtual:
 class BytesVirtual:
     def __init__(self, length):
         self.length = length
-        assert_that(length >= 0)
+        _assert_bound(length >= 0)
 
     def __len__(self):
         return self.length
@@ -31,14 +39,14 @@ class BytesVirtual:
             assert key.step is None or (type(key.step) == int and key.step == 1), \
                 "synthase cannot handle nontrivial slice steps (i.e. steps besides 1): %s" % key.step
             start, stop = key.start, key.stop
-            assert_that(start >= 0)
-            assert_that(stop >= start)
-            assert_that(stop <= self.length)
+            _assert_bound(start >= 0)
+            _assert_bound(stop >= start)
+            _assert_bound(stop <= self.length)
             return BytesSubsequence(self, start, stop - start)
         elif isinstance(key, IntegerVirtual) or isinstance(key, int):
             # Negative indicies are not currently supported by synthase because lengths are not always known.
-            assert_that(key >= 0)
-            assert_that(key < self.length)
+            _assert_bound(key >= 0)
+            _assert_bound(key < self.length)
             return IntegerFromBytes(self, key)
         else:
             raise TypeError("Unexpected type of index: %s" % key)
@@ -53,7 +61,7 @@ class BytesVirtual:
 class BytesSubsequence(BytesVirtual):
     def __init__(self, base, start, length):
         BytesVirtual.__init__(self, length)
-        assert_that(start >= 0)
+        _assert_bound(start >= 0)
         self.base, self.start = base, start
 
     def __getitem__(self, key):
@@ -61,14 +69,14 @@ class BytesSubsequence(BytesVirtual):
             assert key.step is None or (type(key.step) == int and key.step == 1), \
                 "synthase cannot handle nontrivial slice steps (i.e. steps besides 1): %s" % key.step
             start, stop = key.start, key.stop
-            assert_that(start >= 0)
-            assert_that(stop >= start)
-            assert_that(stop <= self.length)
+            _assert_bound(start >= 0)
+            _assert_bound(stop >= start)
+            _assert_bound(stop <= self.length)
             return self.base[self.start + start:self.start + stop]
         elif isinstance(key, IntegerVirtual) or isinstance(key, int):
             # Negative indicies are not currently supported by synthase because lengths are not always known.
-            assert_that(key >= 0)
-            assert_that(key < self.length)
+            _assert_bound(key >= 0)
+            _assert_bound(key < self.length)
             return self.base[key + self.start]
         else:
             raise TypeError("Unexpected type of index: %s" % key)
@@ -85,8 +93,8 @@ class BytesSubsequence(BytesVirtual):
             return False
 
     def assert_byte_comparison(self, key, op, other):
-        assert_that(key >= 0)
-        assert_that(key < self.length)
+        _assert_bound(key >= 0)
+        _assert_bound(key < self.length)
         self.base.assert_byte_comparison(key + self.start, op, other)
 
 
@@ -97,6 +105,9 @@ class IntegerFromBytes(IntegerVirtual):
     def synth(self):
         return "(%s[%s])" % (concrete_function.synth(self.source), concrete_function.synth(self.key))
 
+    def lower(self, graph):
+        return graph.load(graph.lower(self.source), graph.lower(self.key))
+
     def assert_comparison(self, operator, other):
         self.source.assert_byte_comparison(self.key, operator, other)
 
@@ -112,6 +123,9 @@ class IntegerResult(IntegerVirtual):
     def synth(self):
         return self.operator.to_c(concrete_function.synth(self.a), concrete_function.synth(self.b))
 
+    def lower(self, graph):
+        return graph.binop(self.operator, graph.lower(self.a), graph.lower(self.b))
+
     def assert_bool(self, b):
         if self.operator.is_comparison:
             if isinstance(self.a, IntegerVirtual):
@@ -122,10 +136,109 @@ class IntegerResult(IntegerVirtual):
             assert b, "Not implemented otherwise"  # TODO
             assert_that(self.a)
             assert_that(self.b)
+        elif self.operator == concrete_operator.operator_dict["or"] or self.operator == concrete_operator.logical_or:
+            assert b, "Not implemented otherwise"  # TODO
+            _tracing[-1].complex_assertions.append((self, concrete_operator.ne, 0))
         else:
             raise Exception("Not yet implemented: %s for %s" % (self.operator, self))
 
 
+class IntegerSelect(IntegerVirtual):
+    def __init__(self, condition, if_true, if_false):
+        self.condition, self.if_true, self.if_false = condition, if_true, if_false
+
+    def synth(self):
+        return "(%s ? %s : %s)" % (concrete_function.synth(self.condition), concrete_function.synth(self.if_true),
+                                   concrete_function.synth(self.if_false))
+
+    def lower(self, graph):
+        return graph.select(graph.lower(self.condition), graph.lower(self.if_true), graph.lower(self.if_false))
+
+
+def ifelse(condition, if_true, if_false):
+    # Data-dependent choice between two values, for use in traced code (where `if` cannot look at virtuals).  Both
+    # values are always traced, so any assertions made while computing either of them apply unconditionally.
+    if not isinstance(condition, IntegerVirtual):
+        return if_true if condition else if_false
+    return IntegerSelect(condition, if_true, if_false)
+
+
+def matches(value, key):
+    # whether value matches key, an int or an intrange.IntegerSet of ints (traced, if value is)
+    if not isinstance(key, intrange.IntegerSet):
+        return value == key
+    condition = False
+    for low, high in key.elems:
+        match = ((value >= low) & (value < high)) if high - low > 1 else value == low
+        condition = match if condition is False else condition | match
+    return condition
+
+
+def select(value, cases, default):
+    # ifelse chain choosing cases[key] where value matches key, such as for dispatching on a union tag
+    out = default
+    for key, result in reversed(list(cases.items())):
+        out = ifelse(matches(value, key), result, out)
+    return out
+
+
+def _select_merged(value, cases, default, complete):
+    # select, but without the chain when every case (and the default, unless complete says that it is never chosen)
+    # is the same value
+    first = next(iter(cases.values()))
+    same = lambda other: other is first or (type(other) == int and type(first) == int and other == first)
+    if all(same(case) for case in cases.values()) and (complete or same(default)):
+        return first
+    return select(value, cases, default)
+
+
+def merge_records(name, tag, records):
+    # One record standing for whichever of records (a dict mapping keys, as for select, to traced records) tag
+    # matches, named name.  Integer attributes select between the records' values, or 0 for records without them.
+    # Byte arrays select where they start, so they must have the same source and length in every record that has
+    # them, and nested records are merged in the same way.  Anything else (such as the None stored for fixed fields)
+    # is dropped, as _struct_of would drop it anyway.
+    merged = type(name, (), {})()
+    for attr in dict.fromkeys(attr for record in records.values() for attr in vars(record)):
+        values = {key: vars(record)[attr] for key, record in records.items() if attr in vars(record)}
+        present, complete = list(values.values()), len(values) == len(records)
+        if all(isinstance(value, IntegerVirtual) or type(value) == int for value in present):
+            setattr(merged, attr, _select_merged(tag, values, 0, complete))
+        elif all(isinstance(value, BytesVirtual) for value in present):
+            sources = {key: _byte_source(value) for key, value in values.items()}
+            buffer, start = next(iter(sources.values()))
+            assert all(source is buffer and value.length == present[0].length
+                       for (source, _), value in zip(sources.values(), present)), \
+                "byte array %s has a different source or length in some member of %s" % (attr, name)
+            starts = {key: offset for key, (_, offset) in sources.items()}
+            setattr(merged, attr, BytesSubsequence(buffer, _select_merged(tag, starts, start, complete),
+                                                   present[0].length))
+        elif all(hasattr(value, "__dict__") and not callable(value) for value in present):
+            setattr(merged, attr, merge_records(type(present[0]).__name__, tag, values))
+    return merged
+
+
+def dispatch(name, tag, cases, *args):
+    # Traces a choice between constructors made by tag, such as between the members of a union: tag must match one
+    # of the keys of cases (a dict mapping keys, as for select, to constructors), each constructor is traced on args
+    # with its checks guarded by tag matching its key, and the results are combined with merge_records.
+    valid = intrange.empty
+    for key in cases:
+        valid |= key if isinstance(key, intrange.IntegerSet) else intrange.singular(key)
+    assert_that(matches(tag, valid))
+    records = {}
+    for key, constructor in cases.items():
+        condition = matches(tag, key)
+        if condition is not False:
+            with guarded(condition):
+                records[key] = constructor(*args)
+    return merge_records(name, tag, records)
+
+
+def is_traced(x):
+    return isinstance(x, (IntegerVirtual, BytesVirtual))
+
+
 class IntegerArgument(concrete_function.IntegerArgument, IntegerVirtual):
     def __init__(self, name, concrete_type, function):
         assert isinstance(concrete_type, concrete_types.IntegerType)
@@ -174,15 +287,208 @@ def make_argument(type, index, function):
         raise Exception("Unhandled type: %s" % type)
 
 
-def assert_that(x):
+_tracing = []  # Functions currently being traced, innermost last
+
+
+_guards = []  # conditions under which the code being traced applies, innermost last (see guarded)
+
+
+@contextlib.contextmanager
+def guarded(condition):
+    # Traces code that only applies when condition holds, such as one member of a union.  Its assertions on the
+    # data are only checked when condition holds; bounds checks are still checked regardless, since every load is
+    # traced whether or not its guard holds (as for ifelse).
+    _guards.append(condition)
+    try:
+        yield
+    finally:
+        _guards.pop()
+
+
+def _reads_data(x):
+    if isinstance(x, IntegerFromBytes):
+        return True
+    if isinstance(x, IntegerResult):
+        return _reads_data(x.a) or _reads_data(x.b)
+    if isinstance(x, IntegerSelect):
+        return _reads_data(x.condition) or _reads_data(x.if_true) or _reads_data(x.if_false)
+    return False
+
+
+def _assert_under(guard, x):
+    if isinstance(x, IntegerResult) and x.operator in (concrete_operator.operator_dict["and"],
+                                                       concrete_operator.logical_and):
+        _assert_under(guard, x.a)
+        _assert_under(guard, x.b)
+    elif x is not True:
+        _tracing[-1].complex_assertions.append((IntegerSelect(guard, 0 if x is False else x, 1),
+                                                concrete_operator.ne, 0))
+
+
+def _assert_bound(x):
+    # bounds checks, which protect loads that are traced regardless of any guard, and so are never guarded
     assert x is not False, "Runtime assertion known to be false at compile-time"
     if x is not True:
         x.assert_bool(True)
 
 
-def compile(target, *args, rettype=concrete_types.void):
+def assert_that(x):
+    if _guards and _reads_data(x):
+        guard = _guards[0]
+        for condition in _guards[1:]:
+            guard = guard & condition
+        _assert_under(guard, x)
+    else:
+        _assert_bound(x)
+
+
+def compile(target, *args, rettype=concrete_types.void, use_cache=True, batch=False, stats=None):
+    # With batch=True, a companion <name>_batch function (see Function.synth_batch) is generated as well.  If stats is
+    # a dict, the seconds spent tracing and generating code are stored into it as "trace" and "synth".
+    if use_cache:
+        key = cache.key(target, args, rettype, VERSION, batch=batch)
+        source = cache.default.get(key)
+        if source is not None:
+            return source
+    func = concrete_function.Function(target.__name__, rettype)
+    _tracing.append(func)
+    try:
+        started = time.perf_counter()
+        value = target(*(make_argument(arg, i, func) for i, arg in enumerate(args)))
+        traced = time.perf_counter()
+        source = func.synth_implementation(value)
+        if batch:
+            source += func.synth_batch()
+        if stats is not None:
+            stats["trace"], stats["synth"] = traced - started, time.perf_counter() - traced
+    finally:
+        _tracing.pop()
+    if use_cache:
+        cache.default.put(key, source)
+    return source
+
+
+def compile_python(target, *args, rettype=concrete_types.void, use_cache=True):
+    # like compile, but producing Python source (see Function.synth_python) for hosts without a C compiler
+    if use_cache:
+        key = cache.key(target, args, rettype, VERSION, python=True)
+        source = cache.default.get(key)
+        if source is not None:
+            return source
+    func = concrete_function.Function(target.__name__, rettype)
+    _tracing.append(func)
+    try:
+        source = func.synth_python(target(*(make_argument(arg, i, func) for i, arg in enumerate(args))))
+    finally:
+        _tracing.pop()
+    if use_cache:
+        cache.default.put(key, source)
+    return source
+
+
+_python_code = {}  # compile_python output -> code object, so that each is only byte-compiled once per process
+
+
+def load_python(target, *args, rettype=concrete_types.void, use_cache=True):
+    # Returns a plain Python function specialized from the trace of target: wide loads are struct unpacks, offsets
+    # are constants, and the bounds checks are done once up front.
+    source = compile_python(target, *args, rettype=rettype, use_cache=use_cache)
+    if source not in _python_code:
+        _python_code[source] = builtins.compile(source, "<synthase %s>" % native.function_name(target), "exec")
+    namespace = ir.py_globals()
+    exec(_python_code[source], namespace)
+    return namespace[native.function_name(target)]
+
+
+def load(target, *args, rettype=concrete_types.void, use_cache=True):
+    # Compiles target to native code and returns a callable for it.  Without a C compiler, the Python backend is
+    # used instead (see load_python).
+    source = compile(target, *args, rettype=rettype, use_cache=use_cache)
+    try:
+        return native.load(source, native.function_name(target), args, rettype)
+    except native.Unavailable:
+        return load_python(target, *args, rettype=rettype, use_cache=use_cache)
+
+
+def load_batch(target, record_type=concrete_types.binary, rettype=concrete_types.u32, use_cache=True):
+    # Returns a callable(buffer, stride, count, offset=0) that applies target to count records of buffer, returning an
+    # array.array of results.  Records are as long as target requires, if it requires one length, and are otherwise
+    # the whole stride.  Without a C compiler, this loops over the Python backend's version of target instead.
+    source = compile(target, record_type, rettype=rettype, use_cache=use_cache, batch=True)
+    try:
+        return native.load_batch(source, native.function_name(target), record_type, rettype)
+    except native.Unavailable:
+        return native.PythonBatch(load_python(target, record_type, rettype=rettype, use_cache=use_cache), rettype,
+                                  _record_length(target, record_type, rettype))
+
+
+def _record_length(target, record_type, rettype):
+    # see Function.record_length; this means tracing target again, as the compiled source may have come from the cache
     func = concrete_function.Function(target.__name__, rettype)
-    return func.synth_implementation(target(*(make_argument(arg, i, func) for i, arg in enumerate(args))))
+    _tracing.append(func)
+    try:
+        func.synth_implementation(target(make_argument(record_type, 0, func)))
+        return func.record_length()
+    finally:
+        _tracing.pop()
+
+
+def _byte_source(value):
+    # the underlying argument of a traced byte array, and where in it the array starts
+    start = 0
+    while isinstance(value, BytesSubsequence):
+        start, value = start + value.start, value.base
+    return value, start
+
+
+def _struct_of(record):
+    members = []
+    for name, value in vars(record).items():
+        if isinstance(value, IntegerVirtual) or type(value) == int:
+            members.append((name, "int", value))
+        elif isinstance(value, BytesVirtual):
+            assert type(value.length) == int, "byte array %s must have a constant length to be stored in a struct" % name
+            buffer, start = _byte_source(value)
+            members.append((name, "bytes", (buffer, start, value.length)))
+        elif hasattr(value, "__dict__") and not callable(value):
+            members.append((name, "struct", _struct_of(value)))
+        # anything else (such as the None stored for fixed fields) has no value worth keeping
+    return concrete_function.Struct(type(record).__name__, members)
+
+
+def _trace_struct(record_class, record_type):
+    func = concrete_function.Function(record_class.__name__ + concrete_function.DECODE_SUFFIX, concrete_types.void)
+    _tracing.append(func)
+    try:
+        struct = _struct_of(record_class(make_argument(record_type, 0, func)))
+        return func.function_name, func.synth_decoder(struct), struct
+    finally:
+        _tracing.pop()
+
+
+def compile_struct(record_class, record_type=concrete_types.binary, use_cache=True):
+    # Traces record_class (such as a vesicle.Vesicle subclass) as a whole, producing a C struct with one member per
+    # attribute, plus a decode function (see Function.synth_decoder) that fills it in from one record.
+    if use_cache:
+        key = cache.key(record_class, [record_type], concrete_types.void, VERSION, struct=True)
+        source = cache.default.get(key)
+        if source is not None:
+            return source
+    source = _trace_struct(record_class, record_type)[1]
+    if use_cache:
+        cache.default.put(key, source)
+    return source
+
+
+def load_struct(record_class, record_type=concrete_types.binary):
+    # Returns a callable decoding one record into a ctypes mirror of the struct from compile_struct, with integer
+    # members as ints and byte arrays as ctypes arrays.  Without a C compiler, record_class itself is returned.
+    # The struct layout is needed here, so the record is always traced; the shared object build is still cached.
+    name, source, struct = _trace_struct(record_class, record_type)
+    try:
+        return native.load_struct(source, name, record_type, struct)
+    except native.Unavailable:
+        return record_class
 
 
 _old_len = len
@@ -0,0 +1,77 @@
+import random
+import pytest
+import concrete_types, native, synthase
+from concrete_types import u32, u64, s32
+
+# The Python backend must give the same results as the native one, overflow and negative operands included.
+
+pytestmark = pytest.mark.skipif(native.compiler() is None, reason="no C compiler")
+
+
+def difference(a, b):
+    return a - b
+
+
+def wrapped_sum(a, b):
+    return (a + b) * 2
+
+
+def quotient(a, b):
+    return (a - 100) // b
+
+
+def shifted(a, b):
+    return (a << 20) ^ (b >> 3)
+
+
+def chosen(a, b):
+    return synthase.ifelse(a < b, b - a, (a - b) * 3)
+
+
+CASES = [(difference, (u32, u32), u32), (difference, (u32, u32), u64), (wrapped_sum, (u64, u64), u64),
+         (wrapped_sum, (u32, u32), u64), (quotient, (s32, s32), s32), (shifted, (u32, u32), u32),
+         (shifted, (u64, u32), u64), (chosen, (u32, u32), u32)]
+
+
+def _sample(concrete_type, rng):
+    possible = concrete_type.get_range()
+    edges = [possible.low(), possible.high() - 1, 0, 1, -1]
+    return rng.choice([value for value in edges if value in possible] + [rng.randrange(possible.low(), possible.high())])
+
+
+@pytest.mark.parametrize("target, args, rettype", CASES)
+def test_python_matches_native(target, args, rettype):
+    compiled = synthase.load(target, *args, rettype=rettype, use_cache=False)
+    interpreted = synthase.load_python(target, *args, rettype=rettype, use_cache=False)
+    rng = random.Random(0)
+    for _ in range(500):
+        values = [_sample(arg, rng) for arg in args]
+        if target is quotient and values[1] == 0:
+            continue
+        assert interpreted(*values) == compiled(*values), values
+
+
+def test_overflow_cases():
+    compiled = synthase.load(difference, u32, u32, rettype=u32, use_cache=False)
+    interpreted = synthase.load_python(difference, u32, u32, rettype=u32, use_cache=False)
+    assert interpreted(1, 2) == compiled(1, 2) == 2 ** 32 - 1
+    interpreted = synthase.load_python(wrapped_sum, u64, u64, rettype=u64, use_cache=False)
+    assert interpreted(2 ** 63, 2 ** 31 - 1) == (2 ** 32 - 2)
+
+
+def record_sum(b):
+    synthase.assert_that(b.length == 6)
+    return b[0] + b[5] * 256
+
+
+@pytest.mark.parametrize("loader", [synthase.load_batch, None])
+def test_padded_batch(loader, monkeypatch):
+    if loader is None:  # the Python fallback
+        monkeypatch.setattr(native, "load_batch", lambda *args: (_ for _ in ()).throw(native.Unavailable()))
+        loader = synthase.load_batch
+    batch = loader(record_sum, use_cache=False)
+    buffer = b"".join(bytes([i, 0, 0, 0, 0, i + 1, 0xFF, 0xFF]) for i in range(20))
+    assert list(batch(buffer, 8, 20)) == [i + (i + 1) * 256 for i in range(20)]
+    assert list(batch(buffer, 8, 2, offset=8)) == [1 + 2 * 256, 2 + 3 * 256]
+    with pytest.raises(AssertionError):
+        batch(buffer, 4, 2)
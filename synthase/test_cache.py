@@ -0,0 +1,42 @@
+import importlib
+import os
+import sys
+import cache, concrete_types
+
+ARGS = [concrete_types.binary], concrete_types.u32, "1"
+
+
+def test_key_follows_functions_called_through_modules(tmp_path, monkeypatch):
+    monkeypatch.syspath_prepend(str(tmp_path))
+    dependency = tmp_path / "cache_dependency.py"
+    dependency.write_text("def get(x):\n    return x[0]\n")
+    (tmp_path / "cache_user.py").write_text("import cache_dependency\n\n\n"
+                                            "def target(x):\n    return cache_dependency.get(x) + 1\n")
+    try:
+        module = importlib.import_module("cache_dependency")
+        user = importlib.import_module("cache_user")
+        targets = [user.target, lambda x: module.get(x) + 1]  # through a global, and through a closure
+        first = [cache.key(target, *ARGS) for target in targets]
+        assert [cache.key(target, *ARGS) for target in targets] == first
+        dependency.write_text("def get(x):\n    return x[1] * 2\n")
+        importlib.reload(module)
+        assert all(cache.key(target, *ARGS) != key for target, key in zip(targets, first))
+    finally:
+        sys.modules.pop("cache_dependency", None)
+        sys.modules.pop("cache_user", None)
+
+
+def test_shared_objects_count_towards_the_disk_budget(tmp_path):
+    store = cache.Cache(str(tmp_path), max_disk_bytes=250)
+    native = tmp_path / cache.NATIVE
+    native.mkdir()
+    for age, name in enumerate(["old.so", "newer.so"]):
+        (native / name).write_bytes(bytes(100))
+        os.utime(native / name, (age, age))
+    store.put("k" * 8, "x" * 100)
+    assert sorted(p.name for p in tmp_path.rglob("*.*")) == ["kkkkkkkk.c", "newer.so"]
+    (native / "built.so").write_bytes(bytes(200))
+    store.trim_disk(keep=str(native / "built.so"))
+    assert sorted(p.name for p in tmp_path.rglob("*.*")) == ["built.so"]
+    store.clear()
+    assert list(tmp_path.rglob("*.*")) == []
@@ -0,0 +1,34 @@
+import pytest
+import concrete_types, intrange, synthase
+
+
+def _u64be(x, offset):
+    out = x[offset] << 56
+    for i in range(1, 8):
+        out = out | (x[offset + i] << (8 * (7 - i)))
+    return out
+
+
+def _u32le(x, offset):
+    return x[offset] | (x[offset + 1] << 8) | (x[offset + 2] << 16) | (x[offset + 3] << 24)
+
+
+def test_fitting():
+    assert concrete_types.fitting(intrange.range(0, 256)) == concrete_types.u8
+    assert concrete_types.fitting(intrange.range(-1, 2)) == concrete_types.s8
+    assert concrete_types.fitting(intrange.range(0, 2 ** 64 + 2 ** 32)) == concrete_types.u64
+    assert concrete_types.fitting(None) == concrete_types.s64
+    with pytest.raises(ValueError):
+        concrete_types.fitting(intrange.range(-2 ** 64, 2 ** 65))
+
+
+def test_u64_arithmetic_stays_unsigned():
+    def total(x):
+        return _u64be(x, 0) + _u32le(x, 8)
+
+    def difference(x):
+        return _u64be(x, 0) - _u64be(x, 8)
+
+    for target in (total, difference):
+        source = synthase.compile(target, concrete_types.binary, rettype=concrete_types.u64, use_cache=False)
+        assert "int64_t)" not in source.replace("uint64_t)", "")
@@ -0,0 +1,79 @@
+import pytest
+import concrete_operator, intrange, ranges, synthase
+from concrete_types import binary, u32
+
+
+def spread(b):
+    return b[7] + b[3] + b[0]
+
+
+def checked(b):
+    synthase.assert_that(b[0] < 256)  # always true of a byte
+    synthase.assert_that((b[1] & 15) < 16)
+    synthase.assert_that(b[2] < 10)
+    return b[2]
+
+
+def magic(b):
+    synthase.assert_that(b[0:4] == b"SFS\x10")
+    return b[4]
+
+
+def impossible(b):
+    synthase.assert_that(b[0] < 0)
+    return b[0]
+
+
+def _checks(target):
+    source = synthase.compile_python(target, binary, rettype=u32, use_cache=False)
+    condition = next(line for line in source.splitlines() if line.strip().startswith("if not"))
+    return condition.strip()[len("if not ("):-len("):")]
+
+
+def test_compare():
+    lt, eq = concrete_operator.lt, concrete_operator.eq
+    assert ranges.compare(lt, intrange.range(0, 8), intrange.singular(8)) is True
+    assert ranges.compare(lt, intrange.range(0, 9), intrange.singular(8)) is None
+    assert ranges.compare(lt, intrange.range(8, 4), intrange.singular(8)) is False
+    assert ranges.compare(lt, intrange.range(0, 4), intrange.range(4, 4)) is True
+    assert ranges.compare(eq, intrange.range(0, 4), intrange.range(4, 4)) is False
+    assert ranges.compare(lt, None, intrange.singular(8)) is None
+
+
+@pytest.mark.parametrize("loader", [synthase.load, synthase.load_python])
+def test_bounds_checks_implied_by_the_furthest(loader):
+    # the checks for b[0] and b[3] are implied by the one for b[7], so only a minimum length is left
+    assert _checks(spread) == "(arg_0_len >= 8)"
+    function = loader(spread, binary, rettype=u32, use_cache=False)
+    assert function(bytes([1, 0, 0, 2, 0, 0, 0, 3])) == 6
+    for short in (bytes(7), b""):
+        with pytest.raises(AssertionError):
+            function(short)
+
+
+@pytest.mark.parametrize("loader", [synthase.load, synthase.load_python])
+def test_proven_checks_are_eliminated(loader):
+    checks = _checks(checked)
+    assert "256" not in checks and "15" not in checks
+    assert checks == "(arg_0_len >= 3) and ((arg_0[2]) < 10)"
+    function = loader(checked, binary, rettype=u32, use_cache=False)
+    assert function(bytes([0xFF, 0xFF, 9])) == 9
+    for invalid in (bytes([0, 0, 10]), bytes([0, 0])):
+        with pytest.raises(AssertionError):
+            function(invalid)
+
+
+@pytest.mark.parametrize("loader", [synthase.load, synthase.load_python])
+def test_byte_checks_are_coalesced(loader):
+    expected = int.from_bytes(b"SFS\x10", "little")  # one wide comparison rather than four byte comparisons
+    assert _checks(magic) == "(arg_0_len >= 5) and (sya_load_u32le(arg_0, 0)[0] == %d)" % expected
+    function = loader(magic, binary, rettype=u32, use_cache=False)
+    assert function(b"SFS\x10\x07") == 7
+    for invalid in (b"SFS\x11\x07", b"SFT\x10\x07", b"SFS\x10"):
+        with pytest.raises(AssertionError):
+            function(invalid)
+
+
+def test_false_at_compile_time():
+    with pytest.raises(AssertionError):
+        synthase.compile(impossible, binary, rettype=u32, use_cache=False)
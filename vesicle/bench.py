@@ -0,0 +1,182 @@
+import argparse
+import json
+import os
+import platform
+import struct
+import sys
+import tempfile
+import time
+import tracemalloc
+import vesicle, image, lazy, synthetic, fat12, sfs
+import synthase, concrete_types, native
+
+try:
+    import resource
+except ImportError:  # not on Windows
+    resource = None
+
+
+# Benchmarks for record parsing and code generation, run against synthetic images (see synthetic.py).  Results are
+# written as JSON, so that runs against different versions can be compared mechanically:
+#
+#     python bench.py --records 20000 --output before.json
+#
+# Every measurement is the best of --repeat runs.  Peak memory is measured in a separate run under tracemalloc, so
+# that tracing allocations does not slow down the timed runs.
+
+FORMAT_VERSION = 1
+
+
+def _best(func, repeat):
+    best = None
+    for _ in range(repeat):
+        started = time.perf_counter()
+        func()
+        elapsed = time.perf_counter() - started
+        best = elapsed if best is None else min(best, elapsed)
+    return best
+
+
+def _peak_memory(func):
+    tracemalloc.start()
+    try:
+        func()
+        return tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+
+
+def _throughput(name, mode, count, record_length, seconds, peak):
+    return {"benchmark": name, "mode": mode, "records": count, "seconds": seconds,
+            "records_per_second": count / seconds, "bytes_per_second": count * record_length / seconds,
+            "peak_memory_bytes": peak}
+
+
+def _parse_all(decode, view, count, stride, offset=0):
+    def run():
+        for position in range(offset, offset + count * stride, stride):
+            decode(view[position:position + stride])
+    return run
+
+
+def _total_size(record):
+    return fat12.EBPB(record).bpb.total_size
+
+
+def bench_ebpb(view, count, repeat, native_available):
+    # view holds count copies of one boot sector
+    length = fat12.EBPB.expected_length
+    modes = {
+        "interpreted": lambda record: fat12.EBPB(vesicle.Parsable(record, length)),
+        "layout": fat12.EBPB,
+        "lazy_total_size": lambda record: lazy.parse(fat12.EBPB, record).bpb.total_size,
+        "python_backend_total_size": synthase.load_python(_total_size, concrete_types.binary,
+                                                          rettype=concrete_types.u32),
+    }
+    if native_available:
+        modes["native_total_size"] = synthase.load(_total_size, concrete_types.binary, rettype=concrete_types.u32)
+        modes["native_struct"] = synthase.load_struct(fat12.EBPB)
+    out = []
+    for mode, decode in modes.items():
+        run = _parse_all(decode, view, count, length)
+        out.append(_throughput("fat12.EBPB", mode, count, length, _best(run, repeat), _peak_memory(run)))
+    if native_available:
+        batch = synthase.load_batch(_total_size)
+        run = lambda: batch(view, length, count)
+        out.append(_throughput("fat12.EBPB", "native_batch_total_size", count, length, _best(run, repeat),
+                               _peak_memory(run)))
+    return out
+
+
+def bench_sfs_index(view, repeat):
+    index_length = struct.unpack_from("<Q", view, 0x1A4)[0]
+    count, start = index_length // 64, len(view) - index_length
+    modes = {
+        "interpreted": lambda record: sfs.SFS_entry(vesicle.Parsable(record, 64)),
+        "layout": sfs.SFS_entry,
+    }
+    out = []
+    for mode, decode in modes.items():
+        run = _parse_all(decode, view, count, 64, start)
+        out.append(_throughput("sfs.SFS_entry", mode, count, 64, _best(run, repeat), _peak_memory(run)))
+    return out
+
+
+def _weighted_sum(fields):
+    # a traceable function whose expression grows linearly with fields
+    def weighted_sum(x):
+        data = vesicle.Parsable(x, 4 * fields)
+        out = 0
+        for i in range(fields):
+            out = out + data.uint32l(4 * i) * (i + 1)
+        return out
+    return weighted_sum
+
+
+def bench_codegen(sizes, repeat):
+    out = []
+    for fields in sizes:
+        best = None
+        for _ in range(repeat):
+            stats = {}
+            source = synthase.compile(_weighted_sum(fields), concrete_types.binary, rettype=concrete_types.u64,
+                                      use_cache=False, stats=stats)
+            if best is None or stats["trace"] + stats["synth"] < best["trace"] + best["synth"]:
+                best = stats
+        out.append({"benchmark": "synthase.compile", "fields": fields, "trace_seconds": best["trace"],
+                    "synth_seconds": best["synth"], "source_bytes": len(source)})
+    return out
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark vesicle parsing and synthase code generation")
+    parser.add_argument("--fat12-sectors", type=int, default=2880)
+    parser.add_argument("--fat12-files", type=int, default=64)
+    parser.add_argument("--fat12-directories", type=int, default=4)
+    parser.add_argument("--sfs-blocks", type=int, default=4096, help="size of the SFS data area, in blocks")
+    parser.add_argument("--sfs-files", type=int, default=1024)
+    parser.add_argument("--sfs-directories", type=int, default=32)
+    parser.add_argument("--records", type=int, default=10000, help="boot sectors to parse for the EBPB benchmarks")
+    parser.add_argument("--expression-sizes", default="1,4,16,64",
+                        help="comma-separated field counts for the code generation benchmark")
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--output", default="-", help="file to write JSON results to (default: standard output)")
+    args = parser.parse_args(argv)
+
+    native_available = native.compiler() is not None
+    results = {"format": FORMAT_VERSION, "synthase_version": synthase.VERSION, "python": platform.python_version(),
+               "implementation": platform.python_implementation(), "platform": platform.platform(),
+               "compiler": native.compiler(), "config": vars(args), "results": []}
+    with tempfile.TemporaryDirectory() as directory:
+        fat_path, sfs_path, boot_path = (os.path.join(directory, name) for name in ("fat12.img", "sfs.img", "boot.img"))
+        started = time.perf_counter()
+        fat_image = synthetic.fat12(args.fat12_sectors, args.fat12_files, args.fat12_directories, seed=args.seed)
+        sfs_image = synthetic.sfs(args.sfs_blocks, args.sfs_files, args.sfs_directories, seed=args.seed)
+        results["generate_seconds"] = time.perf_counter() - started
+        for path, data in ((fat_path, fat_image), (sfs_path, sfs_image),
+                           (boot_path, fat_image[:fat12.EBPB.expected_length] * args.records)):
+            with open(path, "wb") as f:
+                f.write(data)
+        results["images"] = {"fat12_bytes": len(fat_image), "sfs_bytes": len(sfs_image)}
+        del fat_image, sfs_image
+
+        with image.Image(boot_path) as boot:
+            results["results"] += bench_ebpb(boot.view, args.records, args.repeat, native_available)
+        with image.Image(sfs_path) as img:
+            results["results"] += bench_sfs_index(img.view, args.repeat)
+    results["results"] += bench_codegen([int(size) for size in args.expression_sizes.split(",")], args.repeat)
+    if resource is not None:
+        scale = 1 if sys.platform == "darwin" else 1024  # ru_maxrss is in bytes on macOS, kilobytes elsewhere
+        results["max_rss_bytes"] = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * scale
+
+    text = json.dumps(results, indent=2, sort_keys=True)
+    if args.output == "-":
+        print(text)
+    else:
+        with open(args.output, "w") as f:
+            f.write(text + "\n")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,193 @@
+import collections
+import os
+
+
+# Cached sector reads, for images that are too slow to map or to read repeatedly (e.g. on network mounts).  Sectors
+# are read from the underlying file at most once while they stay in an LRU cache of at most cache_bytes, and misses
+# on consecutive sectors read ahead, in windows that double up to `readahead` sectors, so that sequential scans turn
+# into a few large reads.  Regions come back as bytes, so they can be passed to Vesicle classes (or to Parsable)
+# directly; slicing a BlockDevice also returns bytes, so it can stand in for a whole image in fat12.FAT,
+# fat12.DirectoryIndex and sfs.VolumeIndex.
+
+class BlockDevice:
+    def __init__(self, source, sector_size=512, cache_bytes=4 << 20, readahead=64):
+        # source is a path, which is opened (and closed along with the device), or a seekable binary file object
+        assert sector_size > 0 and readahead >= 0, "invalid sector size or readahead"
+        self.owned = not hasattr(source, "read")
+        self.file = open(source, "rb") if self.owned else source
+        try:
+            self.fd = self.file.fileno() if hasattr(os, "preadv") else None
+        except (AttributeError, OSError):
+            self.fd = None  # e.g. io.BytesIO
+        self.size = self.file.seek(0, os.SEEK_END)
+        self.sector_size = sector_size
+        self.capacity = max(1, cache_bytes // sector_size)  # in sectors
+        self.readahead = min(readahead, self.capacity - 1)
+        self.sectors = -(-self.size // sector_size)
+        self.cache = collections.OrderedDict()  # sector -> bytes, least recently used first
+        self._next = None  # the sector after the last read from the file, for spotting sequential misses
+        self._window = 0
+        self.reset_stats()
+
+    def reset_stats(self):
+        self.hits = self.misses = 0  # in sectors
+        self.reads = self.bytes_read = 0  # calls to the underlying file, and what they returned
+        self.readahead_sectors = self.evictions = 0
+
+    def stats(self):
+        return {"hits": self.hits, "misses": self.misses, "reads": self.reads, "bytes_read": self.bytes_read,
+                "readahead_sectors": self.readahead_sectors, "evictions": self.evictions,
+                "cached_sectors": len(self.cache), "hit_rate": self.hits / max(1, self.hits + self.misses)}
+
+    def __len__(self):
+        return self.size
+
+    def _read(self, view, position):
+        # fills view from the file at position, except for whatever lies past the end of the file
+        total = 0
+        while total < len(view):
+            if self.fd is not None:
+                count = os.preadv(self.fd, [view[total:]], position + total)
+            else:
+                self.file.seek(position + total)
+                count = self.file.readinto(view[total:])
+            if not count:
+                break
+            total += count
+        self.reads += 1
+        self.bytes_read += total
+        return total
+
+    def _store(self, sector, data):
+        self.cache[sector] = data
+        if len(self.cache) > self.capacity:
+            self.cache.popitem(last=False)
+            self.evictions += 1
+
+    def _fetch(self, first, count, into=None, ahead=True):
+        # Reads count sectors from first (plus readahead, if ahead and this continues the previous miss) and caches
+        # them.  With into (which must then be exactly count sectors long, or reach the end of the file), reads
+        # straight into it rather than into a new buffer, and without reading ahead.  Returns a view of the sectors.
+        self._window = min(max(1, 2 * self._window), self.readahead) if first == self._next else 0
+        extra = min(self._window, self.sectors - first - count) if ahead and into is None else 0
+        for sector in range(first + count, first + count + extra):
+            if sector in self.cache:
+                extra = sector - first - count  # stop short of what is already cached
+                break
+        view = memoryview(bytearray((count + extra) * self.sector_size)) if into is None else into
+        total = self._read(view, first * self.sector_size)
+        size = self.sector_size
+        for i in range(count + extra):
+            self._store(first + i, view[i * size:min((i + 1) * size, total)].tobytes())
+        self.misses += count
+        self.readahead_sectors += extra
+        self._next = first + count + extra
+        return view
+
+    def readinto(self, buffer, offset):
+        # fills buffer (any writable bytes-like object) with the bytes from offset, returning how many it filled
+        view = memoryview(buffer).cast("B")
+        assert 0 <= offset and offset + len(view) <= self.size, \
+            "region %d+%d is outside of image of length %d" % (offset, len(view), self.size)
+        size, end, position = self.sector_size, offset + len(view), offset
+        while position < end:
+            sector = position // size
+            cached = self.cache.get(sector)
+            if cached is not None:
+                self.cache.move_to_end(sector)
+                self.hits += 1
+                piece = cached[position - sector * size:min(end - sector * size, size)]
+                view[position - offset:position - offset + len(piece)] = piece
+                position += len(piece)
+                continue
+            last = (end - 1) // size
+            run = 1
+            while sector + run <= last and sector + run not in self.cache:
+                run += 1
+            start, stop = sector * size, min((sector + run) * size, self.size)
+            if start >= offset and stop <= end:
+                self._fetch(sector, run, view[start - offset:stop - offset])
+            else:
+                fetched = self._fetch(sector, run)
+                through = min(stop, end)
+                view[position - offset:through - offset] = fetched[position - start:through - start]
+            position = min(stop, end)
+        return len(view)
+
+    def read(self, offset, length):
+        size = self.sector_size
+        sector = offset // size
+        if offset + length <= min((sector + 1) * size, self.size):
+            cached = self.cache.get(sector)
+            if cached is not None:  # the usual case for records, which rarely straddle sectors
+                self.cache.move_to_end(sector)
+                self.hits += 1
+                return cached[offset - sector * size:offset - sector * size + length]
+        out = bytearray(length)
+        self.readinto(out, offset)
+        return bytes(out)
+
+    def prefetch(self, offset, length):
+        # makes sure the sectors holding offset through offset + length are cached, reading any missing runs at once
+        size = self.sector_size
+        first, last = offset // size, min(-(-(offset + length) // size), self.sectors)
+        sector = first
+        while sector < last:
+            if sector in self.cache:
+                sector += 1
+                continue
+            run = 1
+            while sector + run < last and sector + run not in self.cache:
+                run += 1
+            self._fetch(sector, run, ahead=False)
+            sector += run
+
+    def region(self, offset, length):
+        assert 0 <= offset and 0 <= length and offset + length <= self.size, \
+            "region %d+%d is outside of image of length %d" % (offset, length, self.size)
+        return self.read(offset, length)
+
+    def __getitem__(self, key):
+        if isinstance(key, slice):
+            start, stop, step = key.indices(self.size)
+            assert step == 1, "only contiguous slices of a block device are supported"
+            return self.read(start, max(0, stop - start))
+        if key < 0:
+            key += self.size
+        if not 0 <= key < self.size:
+            raise IndexError("offset %d is outside of image of length %d" % (key, self.size))
+        return self.read(key, 1)[0]
+
+    def parse(self, cls, offset=0, coverage=None):
+        region = self.region(offset, cls.expected_length)
+        if coverage is not None:
+            return coverage.parse(cls, region, offset)
+        return cls(region)
+
+    def records(self, cls, offset=0, count=None, stride=None, reverse=False):
+        # Yields count records (stride bytes apart) from offset, like stream.records, prefetching the sectors ahead of
+        # the scan in whichever direction it runs.  Reverse-ordered arrays, such as SFS_index, are read last first.
+        length = cls.expected_length
+        assert length is not None, "expected_length not specified on Vesicle subclass: %s" % cls
+        stride = length if stride is None else stride
+        if count is None:
+            count = max(0, (self.size - offset - length) // stride + 1)
+        # records per prefetch, leaving room in the cache for a chunk that straddles one more sector
+        chunk = max(1, (min(max(1, self.readahead), self.capacity - 1) * self.sector_size) // stride)
+        indices = range(count - 1, -1, -1) if reverse else range(count)
+        for n, i in enumerate(indices):
+            if n % chunk == 0:
+                low, high = (max(0, i - chunk + 1), i + 1) if reverse else (i, min(i + chunk, count))
+                self.prefetch(offset + low * stride, (high - low - 1) * stride + length)
+            yield cls(self.read(offset + i * stride, length))
+
+    def close(self):
+        self.cache.clear()
+        if self.owned:
+            self.file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
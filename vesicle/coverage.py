@@ -0,0 +1,65 @@
+import intset
+import vesicle
+
+
+class Coverage:
+    # Tracks which bytes of an input (usually a whole image) have been read by any parse.  A claim that touches the
+    # previous one is merged into it as it is made, which covers records parsed in order (forwards or backwards); whenever the unmerged
+    # claims pile up regardless (twice as many as last time, and at least _MERGE_AT), they are sorted and merged.
+    _MERGE_AT = 1024
+
+    def __init__(self, length):
+        self.length = length
+        self._claims = []
+        self._covered = None
+        self._limit = self._MERGE_AT
+
+    def claim(self, start, end):
+        if start >= end:
+            return
+        claims = self._claims
+        if claims:
+            last_start, last_end = claims[-1]
+            if start <= last_end and end >= last_start:
+                if start < last_start or end > last_end:
+                    claims[-1] = (min(start, last_start), max(end, last_end))
+                    self._covered = None
+                return
+        claims.append((start, end))
+        self._covered = None
+        if len(claims) > self._limit:
+            self.covered()
+            self._limit = max(self._MERGE_AT, 2 * len(self._claims))
+
+    def claim_set(self, claimed, base=0):
+        for start, end in claimed.elems:
+            self.claim(base + start, base + end)
+
+    def parse(self, cls, data, offset=0):
+        # parses data (found at offset in the tracked input) as cls, claiming the bytes the parse reads
+        if isinstance(data, vesicle._BUFFER_TYPES) and issubclass(cls, vesicle.Union):
+            # the tag, plus whatever the member it selects reads
+            layout = vesicle.compile_layout(cls.member_for(cls.read_tag(data)))
+            if layout is not None:
+                result = cls(data)
+                self.claim(offset + cls.union_tag_offset, offset + cls.union_tag_offset + cls._tag_struct.size)
+                self.claim_set(layout.coverage, offset)
+                return result
+        layout = vesicle.compile_layout(cls)
+        if layout is not None and isinstance(data, vesicle._BUFFER_TYPES):
+            result = cls(data)
+            self.claim_set(layout.coverage, offset)
+            return result
+        return cls(vesicle.Parsable(data, cls.expected_length, self, offset))
+
+    def covered(self):
+        if self._covered is None:
+            self._covered = intset.from_ranges(self._claims)
+            self._claims = list(self._covered.elems)  # a copy, since claims keep being merged into the last
+        return self._covered
+
+    def unclaimed(self):
+        return self.covered().complement(0, self.length)
+
+    def unclaimed_bytes(self):
+        return self.unclaimed().size()
@@ -1,4 +1,12 @@
-import vesicle, synthase, concrete_types
+import array
+import bisect
+import sys
+import vesicle, image, pathindex, synthase, concrete_types
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
 
 
 class BPB(vesicle.Vesicle):
@@ -39,6 +47,255 @@ class EBPB(vesicle.Vesicle):
         self.partition_signature = data.fixed(510, 0x55, 0xAA)
 
 
-with open("test", "rb") as f:
-    synthase.compile(lambda x: EBPB(x).bpb.total_size, concrete_types.binary, rettype=concrete_types.u32)
-    print(EBPB(f.read(512)))
+# The file allocation table.  Entries are 12 bits, packed two to every three bytes; the whole table is unpacked at once
+# (with numpy if available, otherwise by shifting and masking 16-bit lanes of one big integer), and never one entry at
+# a time in Python.  Cluster chains are indexed by their breaks: the clusters whose successor is not simply the next
+# cluster.  A chain's extents then come from one bisect per extent, rather than one hop per cluster.
+
+FREE, BAD, END = 0x000, 0xFF7, 0xFF8  # entries from END up are all end-of-chain markers
+_MARK_NONZERO = bytes([0] + [1] * 255)
+
+
+def _differing(a, b):
+    # indices at which two equally long arrays of uint16 differ
+    if numpy is not None:
+        return numpy.nonzero(numpy.asarray(a) != numpy.asarray(b))[0].tolist()
+    a, b = bytes(a), bytes(b)
+    diff = (int.from_bytes(a, "little") ^ int.from_bytes(b, "little")).to_bytes(len(a), "little")
+    out, marked = [], diff.translate(_MARK_NONZERO)
+    position = marked.find(1)
+    while position >= 0:
+        if not out or out[-1] != position // 2:
+            out.append(position // 2)
+        position = marked.find(1, position + 1)
+    return out
+
+
+def decode_table(raw, count):
+    # the first count entries of a packed FAT12 table, as an array of uint16 (a numpy array, if numpy is available)
+    triples = -(-count // 2)
+    raw = bytes(raw[:3 * triples]).ljust(3 * triples, b"\0")
+    if numpy is not None:
+        packed = numpy.frombuffer(raw, dtype=numpy.uint8).reshape(-1, 3).astype(numpy.uint16)
+        out = numpy.empty(2 * triples, dtype=numpy.uint16)
+        out[0::2] = packed[:, 0] | ((packed[:, 1] & 0x0F) << 8)
+        out[1::2] = (packed[:, 1] >> 4) | (packed[:, 2] << 4)
+        return out[:count]
+    even, odd = bytearray(2 * triples), bytearray(2 * triples)
+    even[0::2], even[1::2] = raw[0::3], raw[1::3]
+    odd[0::2], odd[1::2] = raw[1::3], raw[2::3]  # still four bits too high
+    mask = int.from_bytes(b"\xFF\x0F" * triples, "little")
+    even = (int.from_bytes(even, "little") & mask).to_bytes(2 * triples, "little")
+    odd = ((int.from_bytes(odd, "little") >> 4) & mask).to_bytes(2 * triples, "little")
+    lanes = bytearray(4 * triples)
+    lanes[0::4], lanes[1::4], lanes[2::4], lanes[3::4] = even[0::2], even[1::2], odd[0::2], odd[1::2]
+    out = array.array("H", lanes)
+    if sys.byteorder == "big":
+        out.byteswap()
+    del out[count:]
+    return out
+
+
+class FAT:
+    # The allocation table of the volume that ebpb describes, read from data (the whole image, or at least all of
+    # its FAT copies), along with the volume geometry needed to turn clusters into byte offsets.
+    def __init__(self, ebpb, data, copy=0):
+        bpb = ebpb.bpb
+        self.ebpb, self.data, self.sector_size, self.copies = ebpb, data, bpb.sector_size, bpb.fat_count
+        self.table_offset = bpb.reserved_sectors * bpb.sector_size
+        self.table_length = bpb.sectors_per_fat * bpb.sector_size
+        root_offset = self.table_offset + self.copies * self.table_length
+        self.root_offset, self.root_length = root_offset, bpb.directory_entries * 32
+        self.data_offset = root_offset + -(-self.root_length // bpb.sector_size) * bpb.sector_size
+        self.cluster_bytes = bpb.cluster_size * bpb.sector_size
+        total_bytes = (bpb.total_sectors or bpb.extended_sector_count) * bpb.sector_size
+        self.clusters = (total_bytes - self.data_offset) // self.cluster_bytes
+        self.count = min(self.clusters + 2, self.table_length * 2 // 3)
+        self.entries = decode_table(self.table(copy), self.count)
+        self.breaks = self._breaks()
+
+    def table(self, copy=0):
+        assert 0 <= copy < self.copies, "no FAT copy %d" % copy
+        start = self.table_offset + copy * self.table_length
+        return self.data[start:start + self.table_length]
+
+    def _breaks(self):
+        # every cluster from 2 up whose entry is not the next cluster, plus the last cluster as a sentinel
+        expected = range(3, self.count + 1)
+        if numpy is not None:
+            expected = numpy.arange(3, self.count + 1, dtype=numpy.uint16)
+        else:
+            expected = array.array("H", expected)
+        out = array.array("H", [2 + i for i in _differing(self.entries[2:], expected)])
+        if not out or out[-1] != self.count - 1:
+            out.append(self.count - 1)
+        return out
+
+    def copies_agree(self):
+        first = bytes(self.table(0))
+        return all(bytes(self.table(copy)) == first for copy in range(1, self.copies))
+
+    def mismatches(self, copy=1):
+        # clusters whose entries differ between copy and the copy that this table was decoded from
+        return _differing(self.entries, decode_table(self.table(copy), self.count))
+
+    def __len__(self):
+        return self.count
+
+    def __getitem__(self, cluster):
+        return int(self.entries[cluster])
+
+    def extents(self, start):
+        # [(first cluster, cluster count)] for the chain starting at start, in order; empty for start 0 (no clusters)
+        out, cluster, total = [], start, 0
+        while cluster != FREE:
+            if not 2 <= cluster < self.count:
+                raise ValueError("cluster chain from %d reaches invalid cluster %d" % (start, cluster))
+            last = self.breaks[bisect.bisect_left(self.breaks, cluster)]
+            out.append((cluster, last - cluster + 1))
+            total += last - cluster + 1
+            if total > self.count:
+                raise ValueError("cluster chain from %d loops" % start)
+            following = int(self.entries[last])
+            if following >= END:
+                break
+            if following in (FREE, BAD):
+                raise ValueError("cluster chain from %d runs into %s cluster %d" %
+                                 (start, "a free" if following == FREE else "a bad", last))
+            cluster = following
+        return out
+
+    def cluster_offset(self, cluster):
+        return self.data_offset + (cluster - 2) * self.cluster_bytes
+
+    def byte_extents(self, start, length=None):
+        # [(byte offset, byte count)] holding the chain starting at start, cut short at length bytes if given
+        out = []
+        for cluster, count in self.extents(start):
+            size = count * self.cluster_bytes
+            if length is not None:
+                size = min(size, length)
+                length -= size
+            if size:
+                out.append((self.cluster_offset(cluster), size))
+        return out
+
+
+ATTRIBUTE_READ_ONLY, ATTRIBUTE_HIDDEN, ATTRIBUTE_SYSTEM = 0x01, 0x02, 0x04
+ATTRIBUTE_VOLUME_LABEL, ATTRIBUTE_DIRECTORY, ATTRIBUTE_ARCHIVE = 0x08, 0x10, 0x20
+ATTRIBUTE_LONG_NAME = 0x0F  # this exact combination marks a long file name entry
+
+
+class DirEntry(vesicle.Vesicle):
+    expected_length = 32
+
+    def __init__(self, b):
+        data = self.begin(b)
+        self.name = data.ascii(0, length=8, padding=0x20)  # 0x00 here ends the directory, 0xE5 marks a deleted entry
+        self.extension = data.ascii(8, length=3, padding=0x20)
+        self.attributes = data.uint8(11)
+        self.reserved = data.uint8(12)
+        self.create_time_fine = data.uint8(13)  # tenths of a second
+        self.create_time = data.uint16l(14)
+        self.create_date = data.uint16l(16)
+        self.access_date = data.uint16l(18)
+        self.cluster_high = data.uint16l(20)  # always zero on FAT12
+        self.modify_time = data.uint16l(22)
+        self.modify_date = data.uint16l(24)
+        self.cluster = data.uint16l(26)
+        self.size = data.uint32l(28)
+
+
+def short_name(entry):
+    name = "\xE5" + entry.name[1:] if entry.name.startswith("\x05") else entry.name  # 0x05 stands in for 0xE5
+    return name + "." + entry.extension if entry.extension else name
+
+
+class DirectoryIndex:
+    # Every file and directory on the volume by path (such as "DIR00001/F0000001.DAT", in any case), from one pass over
+    # the root directory and every directory beneath it.  Only short names are indexed; long name entries are skipped.
+    def __init__(self, fat, data):
+        self.fat, self.data = fat, data
+        self.index = pathindex.PathIndex(fold_case=True)
+        self._children = {}  # directory path -> paths directly within it
+        self._sectors = {}  # directory path -> sectors holding its entries
+        self._owners = {}  # sector -> directory path
+        # start cluster (0 for the root) -> the directory path listed from it, so that a directory whose entries lead
+        # back to it (as on corrupted volumes) is only listed once
+        self._listed = {}
+        self._scan("", [(fat.root_offset, fat.root_length)], 0)
+
+    def _scan(self, path, regions, cluster):
+        data, sector_size = self.data, self.fat.sector_size
+        self._listed[cluster] = path
+        sectors = [sector for offset, length in regions
+                   for sector in range(offset // sector_size, (offset + length) // sector_size)]
+        self._sectors[path] = sectors
+        for sector in sectors:
+            self._owners[sector] = path
+        children = self._children[path] = []
+        for offset, length in regions:
+            for position in range(offset, offset + length, DirEntry.expected_length):
+                first, attributes = data[position], data[position + 11]
+                if first == 0x00:
+                    return
+                if first == 0xE5 or attributes == ATTRIBUTE_LONG_NAME or attributes & ATTRIBUTE_VOLUME_LABEL:
+                    continue
+                entry = DirEntry(data[position:position + DirEntry.expected_length])
+                name = short_name(entry)
+                if name in (".", ".."):
+                    continue
+                child = path + "/" + name if path else name
+                if entry.attributes & ATTRIBUTE_DIRECTORY:
+                    self.index.add(child, pathindex.DIRECTORY, entry.cluster, 0, 0, position)
+                    children.append(child)
+                    if entry.cluster not in self._listed:
+                        self._scan(child, self.fat.byte_extents(entry.cluster), entry.cluster)
+                else:
+                    self.index.add(child, pathindex.FILE, entry.cluster, 0, entry.size, position)
+                    children.append(child)
+
+    def _drop(self, path):
+        # forgets everything beneath directory path (but not path itself)
+        for sector in self._sectors.pop(path):
+            if self._owners.get(sector) == path:
+                del self._owners[sector]
+        for child in self._children.pop(path):
+            if child in self._children:
+                self._drop(child)
+            start = self.index[child].start
+            if self._listed.get(start) == child:
+                del self._listed[start]
+            self.index.remove(child)
+
+    def update(self, changed_sectors):
+        # Brings the index up to date after the given sectors of data were rewritten, by listing again just the
+        # directories stored in them (and everything beneath those).  If the FAT itself changed, everything is redone.
+        changed = set(changed_sectors)
+        fat = self.fat
+        if any(fat.table_offset <= sector * fat.sector_size < fat.root_offset for sector in changed):
+            self.__init__(FAT(fat.ebpb, self.data), self.data)
+            return
+        stale = {self._owners[sector] for sector in changed if sector in self._owners}
+        for path in sorted(stale):
+            if any(path.startswith(other + "/") or other == "" for other in stale if other != path):
+                continue  # already covered by rescanning an enclosing directory
+            self._drop(path)
+            if path:
+                self._scan(path, fat.byte_extents(self.index[path].start), self.index[path].start)
+            else:
+                self._scan("", [(fat.root_offset, fat.root_length)], 0)
+
+    def lookup(self, path):
+        return self.index[path]
+
+    def extents(self, path):
+        # [(byte offset, byte count)] of the file (or directory listing) at path
+        entry = self.index[path]
+        return self.fat.byte_extents(entry.start, entry.length if entry.kind == pathindex.FILE else None)
+
+
+if __name__ == "__main__":
+    with image.Image(sys.argv[1] if len(sys.argv) > 1 else "test") as img:
+        synthase.compile(lambda x: EBPB(x).bpb.total_size, concrete_types.binary, rettype=concrete_types.u32)
+        print(img.parse(EBPB))
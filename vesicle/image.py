@@ -0,0 +1,42 @@
+import mmap
+
+
+class Image:
+    # A whole disk image, mapped into memory.  Regions handed out are memoryviews over the one mapping, so nothing is
+    # copied until a caller converts a region (or a byte_array field) to bytes.
+    def __init__(self, path):
+        self.file = open(path, "rb")
+        try:
+            self.map = mmap.mmap(self.file.fileno(), 0, access=mmap.ACCESS_READ)
+        except BaseException:
+            self.file.close()
+            raise
+        self.view = memoryview(self.map)
+
+    def __len__(self):
+        return len(self.view)
+
+    def region(self, offset, length):
+        assert 0 <= offset and 0 <= length and offset + length <= len(self.view), \
+            "region %d+%d is outside of image of length %d" % (offset, length, len(self.view))
+        return self.view[offset:offset + length]
+
+    def parse(self, cls, offset=0, coverage=None):
+        region = self.region(offset, cls.expected_length)
+        if coverage is not None:
+            return coverage.parse(cls, region, offset)
+        return cls(region)
+
+    def close(self):
+        self.view.release()
+        try:
+            self.map.close()
+        except BufferError:
+            pass  # parsed records still hold views into the image; the mapping is released along with them
+        self.file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
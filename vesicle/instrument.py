@@ -0,0 +1,119 @@
+import json
+import mmap
+import struct
+import time
+import vesicle
+from synthase import assert_that
+
+
+# Decode profiling.  While a Profile is active (see vesicle.set_profile, or use the Profile as a context manager),
+# every compiled layout decodes through a wrapper that counts records and the time spent decoding them, per record
+# class.  Since a layout reads every one of its fields for every record, per-field read and byte counts follow from
+# the record counts.  With per_field=True, fields are instead unpacked one at a time and timed individually, which is
+# much slower, but shows which fields the time goes to.
+#
+# Hooks are called as hook(cls, data, values) after each record is decoded, with the field values in the order that
+# __init__ asks for them.
+
+class _Counters:
+    def __init__(self, layout):
+        self.layout = layout
+        self.decodes = 0
+        self.seconds = 0.0
+        self.field_seconds = [0.0] * len(layout.leaves)
+
+
+def _field_reader(field):
+    if field.kind == "byte_array":
+        start, end = field.offset, field.offset + field.length
+
+        def read(data):
+            return (memoryview(data) if isinstance(data, mmap.mmap) else data)[start:end]
+        return read
+    unpack, offset, convert = struct.Struct("<" + field.code).unpack_from, field.offset, field.convert
+    if convert is None:
+        return lambda data: unpack(data, offset)[0]
+    return lambda data: convert(unpack(data, offset)[0])
+
+
+def _field_name(field):
+    return field.name if field.name is not None else "%s@%d" % (field.kind, field.offset)
+
+
+def _class_name(cls):
+    return "%s.%s" % (cls.__module__, cls.__qualname__)
+
+
+class Profile:
+    def __init__(self, per_field=False, clock=time.perf_counter):
+        self.per_field, self.clock = per_field, clock
+        self.hooks = []
+        self.counters = {}  # record class -> _Counters
+        self._previous = None
+
+    def wrap(self, layout):
+        # returns the instrumented replacement for layout.decode
+        counters = self.counters.get(layout.cls)
+        if counters is None:
+            counters = self.counters[layout.cls] = _Counters(layout)
+        cls, clock, hooks = layout.cls, self.clock, self.hooks
+        if self.per_field:
+            readers = [_field_reader(field) for field in layout.leaves]
+            field_seconds, length = counters.field_seconds, layout.length
+
+            def plain(data):
+                assert_that(len(data) == length)
+                values = []
+                for i, read in enumerate(readers):
+                    started = clock()
+                    values.append(read(data))
+                    field_seconds[i] += clock() - started
+                return values
+        else:
+            plain = type(layout).decode.__get__(layout)
+
+        def decode(data):
+            started = clock()
+            values = plain(data)
+            counters.decodes += 1
+            counters.seconds += clock() - started
+            for hook in hooks:
+                hook(cls, data, values)
+            return values
+        return decode
+
+    def reset(self):
+        for counters in self.counters.values():
+            counters.decodes, counters.seconds = 0, 0.0
+            counters.field_seconds = [0.0] * len(counters.field_seconds)
+        if vesicle._profile is self:
+            vesicle.set_profile(self)  # the wrappers hold on to the old field_seconds lists
+
+    def snapshot(self):
+        # plain dicts and numbers, keyed by the module-qualified names of record classes and dotted field names
+        out = {}
+        for cls, counters in self.counters.items():
+            if not counters.decodes:
+                continue
+            fields = {}
+            for field, seconds in zip(counters.layout.leaves, counters.field_seconds):
+                fields[_field_name(field)] = {"reads": counters.decodes, "bytes": counters.decodes * field.length,
+                                              "seconds": seconds if self.per_field else None}
+            out[_class_name(cls)] = {"decodes": counters.decodes, "bytes": counters.decodes * counters.layout.length,
+                                     "seconds": counters.seconds, "fields": fields}
+        return out
+
+    def to_json(self, **kwargs):
+        return json.dumps(self.snapshot(), **kwargs)
+
+    def top(self, n=10, key="seconds"):
+        # the n record classes with the most decode time (or decodes, or bytes), as (name, counters) pairs
+        return sorted(self.snapshot().items(), key=lambda item: item[1][key], reverse=True)[:n]
+
+    def __enter__(self):
+        self._previous = vesicle.set_profile(self)
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        vesicle.set_profile(self._previous)
+        self._previous = None
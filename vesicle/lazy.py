@@ -0,0 +1,171 @@
+import struct
+import vesicle
+from synthase import assert_that, len
+
+
+# Lazy records: instead of running __init__, each field is a descriptor that decodes from the underlying buffer the
+# first time it is read, and caches the result in a slot.  Attributes that __init__ computes arithmetically from
+# fields (such as BPB.total_size) are computed from just those fields, as recorded by compile_layout.  Anything else
+# that __init__ computes is filled in (along with everything else) by a single eager decode the first time it is read.
+#
+# Lazy classes are not subclasses of the record class, whose instances would all carry a __dict__ alongside the
+# slots; instead, they copy its methods, and report it as their __class__, so that isinstance checks still pass.
+
+class _LazyField:
+    def __init__(self, slot, decode):
+        self.slot, self.decode = slot, decode
+
+    def __get__(self, instance, owner):
+        if instance is None:
+            return self
+        try:
+            return self.slot.__get__(instance, owner)
+        except AttributeError:
+            value = self.decode(instance._data)
+            self.slot.__set__(instance, value)
+            return value
+
+    def __set__(self, instance, value):
+        self.slot.__set__(instance, value)
+
+
+class _LazyDerived:
+    def __init__(self, name, slot, compute=None):
+        # compute(instance) gives the value, if it can be found without decoding the whole record
+        self.name, self.slot, self.compute = name, slot, compute
+
+    def __get__(self, instance, owner):
+        if instance is None:
+            return self
+        try:
+            return self.slot.__get__(instance, owner)
+        except AttributeError:
+            if self.compute is None:
+                instance._materialize()
+                return self.slot.__get__(instance, owner)
+            value = self.compute(instance)
+            self.slot.__set__(instance, value)
+            return value
+
+    def __set__(self, instance, value):
+        self.slot.__set__(instance, value)
+
+
+def _computation(probe, fields):
+    # a function of a lazy instance, giving the value that probe (from Layout.expressions) stands for
+    if probe.field is not None:
+        if probe.field.name in fields:  # read through the attribute, so that the decoded value is cached
+            name = probe.field.name
+            return lambda instance: getattr(instance, name)
+        decode = _decoder(probe.field)
+        return lambda instance: decode(instance._data)
+    op = probe.op
+    parts = [_computation(arg, fields) if isinstance(arg, vesicle._ProbeInt) else (lambda instance, value=arg: value)
+             for arg in probe.args]
+    if len(parts) == 1:
+        part, = parts
+        return lambda instance: op(part(instance))
+    left, right = parts
+    return lambda instance: op(left(instance), right(instance))
+
+
+def _decoder(field):
+    start, end = field.offset, field.offset + field.length
+    if field.kind == "subparse":
+        base = field.base
+        return lambda data: _construct(lazy_class(base), data[start:end])
+    elif field.kind == "byte_array":
+        return lambda data: data[start:end]
+    elif field.kind in ("ascii", "utf8"):
+        convert = field.convert
+        return lambda data: convert(bytes(data[start:end]))
+    else:
+        unpack_from = struct.Struct("<" + field.code).unpack_from
+        convert = field.convert
+        if convert is None:
+            return lambda data: unpack_from(data, start)[0]
+        return lambda data: convert(unpack_from(data, start)[0])
+
+
+def _construct(lazy, data):
+    # used for nested records, whose fixed fields were already checked by the enclosing record
+    instance = lazy.__new__(lazy)
+    instance._data = data
+    return instance
+
+
+def _fixed_check(layout):
+    # all of the fixed fields of a record (including nested ones), checked with a single unpack
+    fixed = sorted((field for field in layout.fields if field.kind == "fixed"), key=lambda field: field.offset)
+    code, position = ["<"], 0
+    for field in fixed:
+        assert field.offset >= position, "overlapping fixed fields: %s" % field
+        code.append("%dx%ds" % (field.offset - position, field.length))
+        position = field.offset + field.length
+    return struct.Struct("".join(code)).unpack_from, tuple(field.expected for field in fixed)
+
+
+def _init(self, data):
+    assert_that(len(data) == self._layout.length)
+    unpack_from, expected = self._fixed
+    assert_that(unpack_from(data) == expected)
+    self._data = data
+
+
+def _materialize(self):
+    eager = self._layout.cls(self._data)
+    for name in self._layout.attributes:
+        slot = type(self).__dict__["_lazy_" + name]
+        try:
+            slot.__get__(self, type(self))
+        except AttributeError:
+            slot.__set__(self, getattr(eager, name))
+
+
+def _items(self):
+    return [(name, getattr(self, name)) for name in self._layout.attributes]
+
+
+_classes = {}
+
+
+_UNCOPIED = {"__dict__", "__weakref__", "__slots__", "__init__", "__module__", "__qualname__"}
+
+
+def _methods(cls):
+    # everything that instances of cls would find on their class, other than what lazy classes replace
+    out = {}
+    for base in reversed(cls.__mro__[:-1]):
+        out.update((name, value) for name, value in vars(base).items() if name not in _UNCOPIED)
+    return out
+
+
+def lazy_class(cls):
+    if cls not in _classes:
+        layout = vesicle.compile_layout(cls)
+        assert layout is not None, "cannot decode %s lazily: its layout could not be compiled" % cls
+        fields = {field.name: field for field in layout.fields if field.name is not None and "." not in field.name}
+        namespace = _methods(cls)
+        namespace.update({
+            "__slots__": ("_data",) + tuple("_lazy_" + name for name in layout.attributes),
+            "__init__": _init, "__class__": property(lambda self: cls), "__module__": cls.__module__,
+            "__qualname__": cls.__qualname__, "_materialize": _materialize, "_items": _items,
+            "_layout": layout, "_fixed": _fixed_check(layout),
+        })
+        for name in layout.attributes:
+            namespace.pop(name, None)  # class attributes shadowed by the record's own
+        lazy = type(cls.__name__, (), namespace)
+        for name in layout.attributes:
+            slot = lazy.__dict__["_lazy_" + name]
+            if name in fields:
+                setattr(lazy, name, _LazyField(slot, _decoder(fields[name])))
+            elif name in layout.expressions:
+                setattr(lazy, name, _LazyDerived(name, slot, _computation(layout.expressions[name], fields)))
+            else:
+                setattr(lazy, name, _LazyDerived(name, slot))
+        _classes[cls] = lazy
+    return _classes[cls]
+
+
+def parse(cls, data):
+    return lazy_class(cls)(data)
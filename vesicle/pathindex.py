@@ -0,0 +1,70 @@
+import array
+import collections
+
+
+# Path lookup for whole volumes.  Entries are kept as rows of parallel arrays, with one dict from full path to row,
+# so an index over thousands of files costs a dict entry and a few array slots per file instead of a record object
+# each.  Rows of removed entries are left empty (kind 0) and reused by later additions.
+
+DIRECTORY, FILE = 1, 2
+
+Entry = collections.namedtuple("Entry", ["path", "kind", "start", "end", "length", "offset"])
+# start and end are the first cluster or block and (for SFS) the block after the last; offset is where the entry
+# itself is stored in the image
+
+
+class PathIndex:
+    def __init__(self, fold_case=False):
+        self.fold_case = fold_case
+        self.rows = {}
+        self.paths = []
+        self.kinds = array.array("B")
+        self.starts, self.ends, self.lengths, self.offsets = (array.array("Q") for _ in range(4))
+        self._free = []
+
+    def key(self, path):
+        path = path.strip("/")
+        return path.upper() if self.fold_case else path
+
+    def add(self, path, kind, start, end, length, offset):
+        path = self.key(path)
+        assert path not in self.rows, "duplicate path: %s" % path
+        if self._free:
+            row = self._free.pop()
+            self.paths[row], self.kinds[row] = path, kind
+            self.starts[row], self.ends[row], self.lengths[row], self.offsets[row] = start, end, length, offset
+        else:
+            row = len(self.paths)
+            self.paths.append(path)
+            self.kinds.append(kind)
+            self.starts.append(start)
+            self.ends.append(end)
+            self.lengths.append(length)
+            self.offsets.append(offset)
+        self.rows[path] = row
+        return row
+
+    def remove(self, path):
+        row = self.rows.pop(self.key(path))
+        self.paths[row], self.kinds[row] = None, 0
+        self._free.append(row)
+
+    def entry(self, row):
+        return Entry(self.paths[row], self.kinds[row], self.starts[row], self.ends[row], self.lengths[row],
+                     self.offsets[row])
+
+    def get(self, path, default=None):
+        row = self.rows.get(self.key(path))
+        return default if row is None else self.entry(row)
+
+    def __getitem__(self, path):
+        return self.entry(self.rows[self.key(path)])
+
+    def __contains__(self, path):
+        return self.key(path) in self.rows
+
+    def __len__(self):
+        return len(self.rows)
+
+    def __iter__(self):
+        return iter(self.rows)
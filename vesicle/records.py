@@ -0,0 +1,124 @@
+import vesicle
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+
+# Record arrays: a compiled layout mapped onto a NumPy structured dtype, so that N consecutive records are decoded
+# by a single frombuffer call, and filtered by comparing whole columns at once.  Nested fields keep their dotted
+# names (e.g. "bpb.sector_size"); text fields stay as raw bytes, and byte arrays as void columns.  Unions have just
+# a union_tag column, since their members lay out the rest of each record differently; records can be narrowed down
+# by tag (see filter_tags) before being decoded one at a time.
+
+_DTYPE_CODES = {"uint8": "u1", "uint16l": "<u2", "uint32l": "<u4", "uint64l": "<u8",
+                "uint16b": ">u2", "uint32b": ">u4", "uint64b": ">u8"}
+
+
+def _require_numpy():
+    if numpy is None:
+        raise ImportError("vesicle record arrays require numpy")
+
+
+def dtype(cls):
+    _require_numpy()
+    if issubclass(cls, vesicle.Union):
+        return numpy.dtype({"names": ["union_tag"], "formats": [_DTYPE_CODES[cls.union_tag_kind]],
+                            "offsets": [cls.union_tag_offset], "itemsize": cls.expected_length})
+    layout = vesicle.compile_layout(cls)
+    assert layout is not None, "cannot build a dtype for %s: its layout could not be compiled" % cls
+    names, formats, offsets = [], [], []
+    for field in layout.fields:
+        if field.name is None or field.kind == "subparse":
+            continue
+        names.append(field.name)
+        offsets.append(field.offset)
+        if field.kind in _DTYPE_CODES:
+            formats.append(_DTYPE_CODES[field.kind])
+        elif field.kind in ("ascii", "utf8"):
+            formats.append("S%d" % field.length)
+        else:
+            formats.append("V%d" % field.length)
+    return numpy.dtype({"names": names, "formats": formats, "offsets": offsets, "itemsize": layout.length})
+
+
+def _fixed_mask(raw, layout):
+    mask = numpy.ones(len(raw), dtype=bool)
+    for field in layout.fields:
+        if field.kind == "fixed":
+            expected = numpy.frombuffer(field.expected, dtype=numpy.uint8)
+            mask &= (raw[:, field.offset:field.offset + field.length] == expected).all(axis=1)
+    return mask
+
+
+class RecordArray:
+    def __init__(self, cls, buffer, count=None, offset=0):
+        _require_numpy()
+        self.cls, self.buffer, self.length = cls, buffer, cls.expected_length
+        self.layout = vesicle.compile_layout(cls)  # None for unions
+        self.array = numpy.frombuffer(buffer, dtype=dtype(cls), count=-1 if count is None else count, offset=offset)
+        self.offset = offset
+        self.indices = numpy.arange(len(self.array))
+
+    def __len__(self):
+        return len(self.indices)
+
+    def __getitem__(self, i):
+        # decodes one record as a regular Vesicle object
+        start = self.offset + int(self.indices[i]) * self.length
+        return self.cls(memoryview(self.buffer)[start:start + self.length])
+
+    def __iter__(self):
+        for i in range(len(self)):
+            yield self[i]
+
+    def column(self, name):
+        return self.array[name][self.indices]
+
+    def check_fixed(self):
+        # boolean mask of records whose fixed fields (for unions, those of the member each tag selects) all hold
+        # their expected bytes
+        raw = numpy.frombuffer(self.buffer, dtype=numpy.uint8, count=len(self.array) * self.length,
+                               offset=self.offset).reshape(len(self.array), self.length)[self.indices]
+        if self.layout is not None:
+            return _fixed_mask(raw, self.layout)
+        tags, mask = self.column("union_tag"), numpy.ones(len(self.indices), dtype=bool)
+        for member in set(self.cls.union_tags.values()):
+            layout = vesicle.compile_layout(member)
+            assert layout is not None, "cannot check %s: its layout could not be compiled" % member
+            chosen = numpy.zeros(len(self.indices), dtype=bool)
+            for low, high in self.cls.tags_for(member).elems:
+                chosen |= (tags >= low) & (tags < high)
+            mask[chosen] = _fixed_mask(raw[chosen], layout)
+        return mask
+
+    def _select(self, mask):
+        out = RecordArray.__new__(RecordArray)
+        out.cls, out.buffer, out.length, out.layout = self.cls, self.buffer, self.length, self.layout
+        out.array, out.offset = self.array, self.offset
+        out.indices = self.indices[mask]
+        return out
+
+    def where(self, mask):
+        return self._select(numpy.asarray(mask, dtype=bool))
+
+    def filter(self, **conditions):
+        # each condition is a value (equality), a set/list/range of values (membership), or a function on the column
+        mask = numpy.ones(len(self.indices), dtype=bool)
+        for name, condition in conditions.items():
+            column = self.column(name)
+            if callable(condition):
+                mask &= numpy.asarray(condition(column), dtype=bool)
+            elif isinstance(condition, (set, frozenset, list, tuple, range)):
+                mask &= numpy.isin(column, numpy.fromiter(condition, dtype=column.dtype))
+            else:
+                mask &= column == condition
+        return self._select(mask)
+
+    def filter_tags(self, *tags, field="union_tag"):
+        return self.filter(**{field: set(tags)})
+
+
+def parse_array(cls, buffer, count=None, offset=0):
+    return RecordArray(cls, buffer, count, offset)
@@ -0,0 +1,49 @@
+import concurrent.futures
+import contextlib
+import os
+import image
+
+
+# Multi-process scanning.  Only paths and offsets are sent to the workers, which map the image themselves; results
+# come back in submission order.  Functions passed in run in the workers, so they (and their results) must be
+# picklable -- in practice, functions defined at module level that return plain values rather than records that
+# still refer to the image.
+
+def _scan_image(job):
+    func, path = job
+    with image.Image(path) as img:
+        return func(img)
+
+
+def _scan_records(job):
+    func, cls, path, start, count, stride = job
+    with image.Image(path) as img:
+        return [func(img.parse(cls, start + i * stride)) for i in range(count)]
+
+
+def _in_order(func, jobs, workers):
+    # yields func(job) for each job, in order; pending jobs are cancelled if the generator is closed early
+    pool = concurrent.futures.ProcessPoolExecutor(workers)
+    try:
+        futures = [pool.submit(func, job) for job in jobs]
+        for future in futures:
+            yield future.result()
+    finally:
+        pool.shutdown(cancel_futures=True)
+
+
+def scan_images(paths, func, workers=None):
+    # applies func to each image, yielding the results in order
+    return _in_order(_scan_image, [(func, path) for path in paths], workers)
+
+
+def scan_records(path, cls, func, offset=0, count=None, stride=None, workers=None, batch=4096):
+    # applies func to each of count records (stride bytes apart) starting at offset, yielding the results in order
+    stride = cls.expected_length if stride is None else stride
+    if count is None:
+        count = max(0, (os.path.getsize(path) - offset - cls.expected_length) // stride + 1)
+    jobs = [(func, cls, path, offset + start * stride, min(batch, count - start), stride)
+            for start in range(0, count, batch)]
+    with contextlib.closing(_in_order(_scan_records, jobs, workers)) as batches:
+        for results in batches:
+            yield from results
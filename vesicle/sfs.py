@@ -0,0 +1,209 @@
+import bisect
+import struct
+import vesicle, pathindex
+from synthase import assert_that
+
+
+# SFS (Simple File System), following the description in vesicle.txt.
+
+class SFS_super(vesicle.Vesicle):
+    expected_length = 0x0200  # on volumes with larger blocks, the rest of the first block is unused
+
+    def __init__(self, b):
+        data = self.begin(b)
+        self.initial_data = data.byte_array(0x0000, length=0x0194)
+        self.last_alteration = data.uint64l(0x0194)
+        self.data_area_size = data.uint64l(0x019C)  # blocks
+        self.index_area_size = data.uint64l(0x01A4)  # bytes
+        self.magic = data.fixed(0x01AC, *b"SFS")
+        self.version = data.fixed(0x01AF, 0x10)
+        self.block_total = data.uint64l(0x01B0)
+        self.super_reserved_size = data.uint32l(0x01B8)  # only 4 bytes, as block_size_power follows it
+        self.block_size_power = data.uint8(0x01BC)
+        self.checksum = data.uint8(0x01BD)
+        self.ending_data = data.byte_array(0x01BE, length=0x0042)
+
+        self.block_size = 1 << (self.block_size_power + 7)
+        self.index_block_count = (self.index_area_size + self.block_size - 1) // self.block_size
+        self.reserved_ends_at = self.block_size * self.super_reserved_size
+        self.data_ends_at = self.block_size * (self.super_reserved_size + self.data_area_size)
+        self.index_blocks_start_at = self.block_size * (self.block_total - self.index_block_count)
+        self.index_starts_at = self.block_size * self.block_total - self.index_area_size
+        self.index_ends_at = self.block_size * self.block_total
+
+    def checksum_valid(self):
+        # the bytes from the magic number through the checksum itself sum to zero
+        covered = b"SFS\x10" + struct.pack("<QIBB", self.block_total, self.super_reserved_size, self.block_size_power,
+                                           self.checksum)
+        return sum(covered) & 0xFF == 0
+
+
+class SFS_entry(vesicle.Union):
+    expected_length = 64
+
+    class VolumeIdentifier(vesicle.Vesicle):
+        def __init__(self, b):
+            data = self.begin(b)
+            data.fixed(0x01, 0, 0, 0)
+            self.format_time = data.uint64l(0x04)  # TODO: include time stamp format
+            self.volume_name = data.utf8(0x0C, length=52, null_terminator=True)
+
+    class StartingMarkerEntry(vesicle.Vesicle):
+        def __init__(self, b):
+            data = self.begin(b)
+            self.unused = data.byte_array(0x01, length=63)
+
+    class UnusedEntry(vesicle.Vesicle):
+        def __init__(self, b):
+            data = self.begin(b)
+            self.unused = data.byte_array(0x01, length=63)
+
+    class DirectoryEntry(vesicle.Vesicle):
+        def __init__(self, b):
+            data = self.begin(b)
+            self.continuations = data.uint8(0x01)
+            self.update_time = data.uint64l(0x02)
+            self.directory_name = data.byte_array(0x0A, length=54)
+
+    class FileEntry(vesicle.Vesicle):
+        def __init__(self, b):
+            data = self.begin(b)
+            self.continuations = data.uint8(0x01)
+            self.update_time = data.uint64l(0x02)
+            self.block_from = data.uint64l(0x0A)
+            self.block_to = data.uint64l(0x12)  # exclusive
+            self.file_length = data.uint64l(0x1A)
+            self.file_name = data.byte_array(0x22, length=30)
+
+        def check(self, block_size):
+            # kept out of __init__, because it depends on the superblock
+            assert_that((self.block_to > self.block_from) or (self.block_to == self.block_from == 0))
+            assert_that(self.file_length <= (self.block_to - self.block_from) * block_size)
+
+    class UnusableEntry(vesicle.Vesicle):
+        def __init__(self, b):
+            data = self.begin(b)
+            self.reserved_1 = data.byte_array(0x01, length=9)
+            self.block_from = data.uint64l(0x0A)
+            self.block_to = data.uint64l(0x12)
+            self.reserved_2 = data.byte_array(0x1A, length=38)
+
+    class DeletedDirectoryEntry(vesicle.Vesicle):
+        def __init__(self, b):
+            data = self.begin(b)
+            self.continuations = data.uint8(0x01)
+            self.deleted_at = data.uint64l(0x02)
+            self.directory_name = data.byte_array(0x0A, length=54)
+
+    class DeletedFileEntry(vesicle.Vesicle):
+        def __init__(self, b):
+            data = self.begin(b)
+            self.continuations = data.uint8(0x01)
+            self.update_time = data.uint64l(0x02)
+            self.stored_data = data.byte_array(0x0A, length=54)
+
+    class ContinuationEntry(vesicle.Vesicle):
+        def __init__(self, b):
+            data = self.begin(b)
+            self.continuation_text = data.byte_array(0x00, length=64)
+
+    union_tag_offset = 0x0000
+    # TODO: handle invalid tags
+    union_tags = {0x01: VolumeIdentifier, 0x02: StartingMarkerEntry, 0x10: UnusedEntry, 0x11: DirectoryEntry,
+                  0x12: FileEntry, 0x18: UnusableEntry, 0x19: DeletedDirectoryEntry, 0x1A: DeletedFileEntry,
+                  vesicle.integer_union(0x00, vesicle.integer_range(0x20, 0xFF)): ContinuationEntry}
+
+
+ENTRY = SFS_entry.expected_length
+_NAMES = {SFS_entry.DirectoryEntry: "directory_name", SFS_entry.FileEntry: "file_name"}
+
+
+class VolumeIndex:
+    # Every file and directory on the volume by full path, from one pass over the index area in address order (from
+    # the starting marker up to the volume identifier), with names put back together from their continuation entries.
+    # The index remembers where every entry starts, so that update can reparse just the entries in rewritten blocks.
+    def __init__(self, data):
+        self.data = data
+        self.superblock = SFS_super(data[0:SFS_super.expected_length])
+        self.index = pathindex.PathIndex()
+        self._spans = {}  # offset of every entry, other than continuations -> number of entries it takes up
+        self._paths = {}  # offset of every directory or file entry -> its path
+        self._starts = []  # the keys of _spans, in order
+        first, end = self.superblock.index_starts_at, self.superblock.index_ends_at
+        assert isinstance(SFS_entry(data[first:first + ENTRY]), SFS_entry.StartingMarkerEntry), "no starting marker"
+        volume = SFS_entry(data[end - ENTRY:end])
+        assert isinstance(volume, SFS_entry.VolumeIdentifier), "no volume identifier"
+        self.volume_name = volume.volume_name
+        self._apply([(first, end)], self._parse(first, end)[0])
+
+    def _is_start(self, position):
+        i = bisect.bisect_left(self._starts, position)
+        return i < len(self._starts) and self._starts[i] == position
+
+    def _parse(self, position, stop):
+        # Parses entries from position until reaching one that starts at or after stop, where an entry also started
+        # before (so that everything from there on is unchanged).  Returns the entries, and where parsing stopped.
+        data, end, out = self.data, self.superblock.index_ends_at, []
+        while position < end and not (position >= stop and self._is_start(position)):
+            entry = SFS_entry(data[position:position + ENTRY])
+            span = 1 + getattr(entry, "continuations", 0)
+            assert position + span * ENTRY <= end, "entry at %d continues past the end of the index" % position
+            name = _NAMES.get(type(entry))
+            if name is not None:
+                raw = bytes(getattr(entry, name)) + bytes(data[position + ENTRY:position + span * ENTRY])
+                path = raw.split(b"\0", 1)[0].decode("UTF-8")
+                if type(entry) == SFS_entry.FileEntry:
+                    row = (path, pathindex.FILE, entry.block_from, entry.block_to, entry.file_length)
+                else:
+                    row = (path, pathindex.DIRECTORY, 0, 0, 0)
+            else:
+                row = None
+            out.append((position, span, row))
+            position += span * ENTRY
+        return out, position
+
+    def _apply(self, replaced, parsed):
+        # replaces the entries starting within each (start, stop) range of replaced with the entries from _parse
+        for start, stop in replaced:
+            low, high = bisect.bisect_left(self._starts, start), bisect.bisect_left(self._starts, stop)
+            for position in self._starts[low:high]:
+                del self._spans[position]
+                path = self._paths.pop(position, None)
+                if path is not None:
+                    self.index.remove(path)
+        for position, span, row in parsed:
+            self._spans[position] = span
+            if row is not None:
+                self.index.add(*row, position)
+                self._paths[position] = row[0]
+        self._starts = sorted(self._spans)
+
+    def update(self, changed_blocks):
+        # Brings the index up to date after the given blocks were rewritten.  Only the entries stored in those blocks
+        # (and any whose names continue into them) are parsed again.  A rewritten superblock means starting over,
+        # since the index area may have grown.
+        block_size = self.superblock.block_size
+        changed = sorted(set(changed_blocks))
+        if any(block * block_size < SFS_super.expected_length for block in changed):
+            self.__init__(self.data)
+            return
+        first, end = self.superblock.index_starts_at, self.superblock.index_ends_at
+        replaced, parsed, position = [], [], first
+        for block in changed:
+            start, stop = max(block * block_size, first), min((block + 1) * block_size, end)
+            if start >= stop or stop <= position:
+                continue
+            start = max(self._starts[bisect.bisect_right(self._starts, start) - 1], position)
+            entries, position = self._parse(start, stop)
+            replaced.append((start, position))
+            parsed += entries
+        self._apply(replaced, parsed)
+
+    def lookup(self, path):
+        return self.index[path]
+
+    def extents(self, path):
+        # [(byte offset, byte count)] of the file at path: SFS files are always contiguous
+        entry = self.index[path]
+        size = min(entry.length, (entry.end - entry.start) * self.superblock.block_size)
+        return [(entry.start * self.superblock.block_size, size)] if size else []
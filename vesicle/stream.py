@@ -0,0 +1,88 @@
+import io
+
+
+# Streaming parsers: records are read and yielded one at a time, so that regions much larger than memory can be
+# scanned.  At most one record's worth of input is held (besides whatever the caller keeps from yielded records), or
+# for reverse scans, one chunk of _REVERSE_CHUNK bytes.
+
+_REVERSE_CHUNK = 64 << 10
+
+
+def _read_exactly(f, length):
+    data = f.read(length)
+    while data is not None and 0 < len(data) < length:
+        more = f.read(length - len(data))
+        if not more:
+            break
+        data += more
+    return data
+
+
+def _from_file(cls, f, count, offset):
+    length = cls.expected_length
+    if offset:
+        f.seek(offset)
+    while count is None or count > 0:
+        data = _read_exactly(f, length)
+        if not data:
+            return
+        assert len(data) == length, "truncated record at end of input: %d of %d bytes" % (len(data), length)
+        yield cls(data)
+        if count is not None:
+            count -= 1
+
+
+def _from_file_reversed(cls, f, count, offset):
+    # Reverse-ordered arrays, such as SFS_index, whose first entry is stored last.  These are read a chunk of whole
+    # records at a time, from the last chunk back, with the chunks aligned to their size from offset.
+    length = cls.expected_length
+    if count is None:
+        end = f.seek(0, io.SEEK_END)
+        count = (end - offset) // length
+    per_chunk = max(1, _REVERSE_CHUNK // length)
+    end = count
+    while end > 0:
+        start = (end - 1) // per_chunk * per_chunk
+        f.seek(offset + start * length)
+        data = _read_exactly(f, (end - start) * length)
+        assert data is not None and len(data) == (end - start) * length, \
+            "truncated record at index %d" % (start + len(data or b"") // length)
+        view = memoryview(data)
+        for i in range(end - start - 1, -1, -1):
+            yield cls(view[i * length:(i + 1) * length].tobytes())
+        end = start
+
+
+def _from_chunks(cls, chunks, count):
+    length = cls.expected_length
+    pending = b""
+    for chunk in chunks:
+        view = memoryview(chunk)
+        while view:
+            if count is not None and count <= 0:
+                return
+            if pending or len(view) < length:
+                needed = length - len(pending)
+                pending += view[:needed].tobytes()
+                view = view[needed:]
+                if len(pending) < length:
+                    break
+                record, pending = pending, b""
+            else:
+                record, view = view[:length].tobytes(), view[length:]
+            yield cls(record)
+            if count is not None:
+                count -= 1
+    assert not pending, "truncated record at end of input: %d of %d bytes" % (len(pending), length)
+
+
+def records(cls, source, count=None, offset=0, reverse=False):
+    # source is either a binary file-like object or an iterable of bytes-like chunks (of any sizes)
+    assert cls.expected_length is not None, "expected_length not specified on Vesicle subclass: %s" % cls
+    if hasattr(source, "read"):
+        if reverse:
+            return _from_file_reversed(cls, source, count, offset)
+        return _from_file(cls, source, count, offset)
+    assert not reverse, "reverse-ordered streams need a seekable file, not an iterable of chunks"
+    assert not offset, "offsets are only supported for file-like sources"
+    return _from_chunks(cls, source, count)
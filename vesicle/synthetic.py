@@ -0,0 +1,158 @@
+import random
+import struct
+
+
+# Synthetic disk images, for benchmarks and experiments.  Everything is generated from a seed, so the same
+# parameters always produce the same bytes.
+
+SECTOR = 512
+FAT12_MAX_CLUSTERS = 4084
+
+
+def _dirent(name, ext, attributes, cluster, size):
+    entry = bytearray(32)
+    entry[0:8], entry[8:11] = name.encode().ljust(8), ext.encode().ljust(3)
+    entry[11] = attributes
+    struct.pack_into("<HH", entry, 22, 0x6000, 0x4A21)  # modified 12:00:00 on 2017-01-01
+    struct.pack_into("<HI", entry, 26, cluster, size)
+    return bytes(entry)
+
+
+def _pack_fat12(entries):
+    out = bytearray()
+    for i in range(0, len(entries), 2):
+        a, b = entries[i], entries[i + 1] if i + 1 < len(entries) else 0
+        out += bytes([a & 0xFF, (a >> 8) | ((b & 0xF) << 4), b >> 4])
+    return out
+
+
+def fat12(total_sectors=2880, files=64, directories=4, cluster_size=1, root_entries=224, max_file_clusters=8,
+          fragment=True, seed=0):
+    # A FAT12 volume: boot sector (see fat12.EBPB), two identical FATs, the root directory and the data area.  Files
+    # are spread across the root directory and `directories` subdirectories of it.  With fragment=True, clusters are
+    # handed out to all files a few at a time, round robin, so that most cluster chains are discontiguous.
+    rng = random.Random(seed)
+    cluster_bytes = cluster_size * SECTOR
+    root_sectors = -(-root_entries * 32 // SECTOR)
+    sectors_per_fat = 1
+    while True:
+        clusters = (total_sectors - 1 - root_sectors - 2 * sectors_per_fat) // cluster_size
+        if sectors_per_fat * SECTOR >= -(-(clusters + 2) * 3 // 2):
+            break
+        sectors_per_fat += 1
+    assert clusters <= FAT12_MAX_CLUSTERS, "too many clusters for FAT12: %d" % clusters
+
+    # owners are ("dir", index) or ("file", index); directory 0 is the root, which lives outside the data area
+    placement = [rng.randrange(directories + 1) for _ in range(files)]
+    sizes = [rng.randrange(max_file_clusters * cluster_bytes + 1) for _ in range(files)]
+    assert placement.count(0) + directories <= root_entries - 1, "root directory too small"
+    demands = {("file", i): -(-size // cluster_bytes) for i, size in enumerate(sizes)}
+    for d in range(1, directories + 1):
+        demands["dir", d] = max(1, -(-(2 + placement.count(d)) * 32 // cluster_bytes))
+    if sum(demands.values()) > clusters:
+        raise ValueError("image too small: %d clusters needed, %d available" % (sum(demands.values()), clusters))
+
+    chains = {owner: [] for owner in demands}
+    cursor = 2
+    pending = [owner for owner in demands if demands[owner]]
+    while pending:
+        for owner in pending:
+            need = demands[owner] - len(chains[owner])
+            take = min(need, rng.randint(1, 3)) if fragment else need
+            chains[owner] += range(cursor, cursor + take)
+            cursor += take
+        pending = [owner for owner in pending if len(chains[owner]) < demands[owner]]
+
+    table = [0] * (clusters + 2)
+    table[0], table[1] = 0xFF0, 0xFFF
+    for chain in chains.values():
+        for here, following in zip(chain, chain[1:] + [0xFFF]):
+            table[here] = following
+    fat = _pack_fat12(table).ljust(sectors_per_fat * SECTOR, b"\0")
+
+    image = bytearray(total_sectors * SECTOR)
+    image[0:3], image[3:11] = bytes([0xEB, 0x3C, 0x90]), b"SYNTHETC"
+    struct.pack_into("<HBHBHHBHHHII", image, 11, SECTOR, cluster_size, 1, 2, root_entries, total_sectors, 0xF0,
+                     sectors_per_fat, 18, 2, 0, 0)
+    struct.pack_into("<BBBI", image, 36, 0x80, 0, 0x29, rng.getrandbits(32))
+    image[43:54], image[54:62] = b"SYNTHETIC  ", b"FAT12   "
+    image[510:512] = b"\x55\xAA"
+    fat_start = SECTOR
+    image[fat_start:fat_start + len(fat)] = fat
+    image[fat_start + len(fat):fat_start + 2 * len(fat)] = fat
+    root_start = fat_start + 2 * len(fat)
+    data_start = root_start + root_sectors * SECTOR
+
+    def cluster_offset(cluster):
+        return data_start + (cluster - 2) * cluster_bytes
+
+    listings = {0: [_dirent("SYNTHETI", "C", 0x08, 0, 0)]}
+    for d in range(1, directories + 1):
+        first = chains["dir", d][0]
+        listings[0].append(_dirent("DIR%05d" % d, "", 0x10, first, 0))
+        listings[d] = [_dirent(".", "", 0x10, first, 0), _dirent("..", "", 0x10, 0, 0)]
+    for i, (d, size) in enumerate(zip(placement, sizes)):
+        chain = chains["file", i]
+        listings[d].append(_dirent("F%07d" % i, "DAT", 0x20, chain[0] if chain else 0, size))
+    image[root_start:root_start + 32 * len(listings[0])] = b"".join(listings[0])
+    for d in range(1, directories + 1):
+        listing = b"".join(listings[d])
+        for n, cluster in enumerate(chains["dir", d]):
+            piece = listing[n * cluster_bytes:(n + 1) * cluster_bytes]
+            image[cluster_offset(cluster):cluster_offset(cluster) + len(piece)] = piece
+    return bytes(image)
+
+
+SFS_DIRECTORY_NAME = 54
+SFS_FILE_NAME = 30
+SFS_ENTRY = 64
+
+
+def _sfs_entry(head, name, capacity):
+    # an index entry with its name, followed by however many continuation entries the rest of the name needs
+    name = name.encode() + b"\0"
+    inline, rest = name[:capacity], name[capacity:]
+    continuations = -(-len(rest) // SFS_ENTRY)
+    entry = bytearray(head(continuations)) + inline.ljust(capacity, b"\0")
+    return bytes(entry) + rest.ljust(continuations * SFS_ENTRY, b"\0")
+
+
+def sfs(data_blocks=4096, files=1024, directories=32, block_size_power=2, max_file_blocks=4, long_names=0.25,
+        seed=0):
+    # An SFS volume: superblock, data area, and an index area at the very end of the volume, which runs from the
+    # starting marker up to the volume identifier.  A fraction long_names of the files get names too long to fit in
+    # their entry, and so have continuation entries.
+    rng = random.Random(seed)
+    block_size = 2 ** (block_size_power + 7)
+    reserved = -(-SECTOR // block_size)
+    stamp = 1483272000 << 16  # SFS time stamps count 1/65536ths of a second
+
+    entries = [bytes([0x02]) + bytes(63)]
+    for d in range(directories):
+        entries.append(_sfs_entry(lambda c: struct.pack("<BBQ", 0x11, c, stamp), "dir%05d" % d, SFS_DIRECTORY_NAME))
+    cursor = reserved
+    for i in range(files):
+        blocks = rng.randint(0, max_file_blocks)
+        if cursor + blocks > reserved + data_blocks:
+            raise ValueError("data area too small for %d files" % files)
+        length = rng.randrange((blocks - 1) * block_size + 1, blocks * block_size + 1) if blocks else 0
+        block_from, block_to = (cursor, cursor + blocks) if blocks else (0, 0)
+        cursor += blocks
+        name = "dir%05d/%s%07d.dat" % (rng.randrange(directories) if directories else 0,
+                                      "a_file_with_a_rather_long_name_" if rng.random() < long_names else "f", i)
+        if not directories:
+            name = name.split("/", 1)[1]
+        entries.append(_sfs_entry(lambda c: struct.pack("<BBQQQQ", 0x12, c, stamp, block_from, block_to, length),
+                                  name, SFS_FILE_NAME))
+    entries.append(struct.pack("<B3xQ", 0x01, stamp) + b"SYNTHETIC".ljust(52, b"\0"))
+    index = b"".join(entries)
+
+    index_blocks = -(-len(index) // block_size)
+    block_total = reserved + data_blocks + index_blocks
+    image = bytearray(block_total * block_size)
+    struct.pack_into("<QQQ3sBQIB", image, 0x194, stamp, data_blocks, len(index), b"SFS", 0x10, block_total,
+                     reserved, block_size_power)
+    image[0x1BD] = -sum(image[0x1AC:0x1BD]) & 0xFF
+    image[0x1FE:0x200] = b"\x55\xAA"
+    image[len(image) - len(index):] = index
+    return bytes(image)
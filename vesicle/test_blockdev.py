@@ -0,0 +1,145 @@
+import io
+import random
+import pytest
+import vesicle, blockdev
+
+
+class Word(vesicle.Vesicle):
+    expected_length = 3
+
+    def __init__(self, b):
+        data = self.begin(b)
+        self.value = data.uint16l(0)
+
+
+class RecordingFile(io.BytesIO):
+    # remembers (position, length, buffer) for every read that the device makes
+    def __init__(self, data):
+        super().__init__(data)
+        self.calls = []
+
+    def readinto(self, b):
+        self.calls.append((self.tell(), len(b), memoryview(b).obj))
+        return super().readinto(b)
+
+
+def _check_cache(device, data):
+    assert len(device.cache) <= device.capacity
+    size = device.sector_size
+    for sector, cached in device.cache.items():
+        assert cached == data[sector * size:(sector + 1) * size]
+
+
+@pytest.mark.parametrize("sector_size, cache_sectors, readahead", [(1, 1, 0), (7, 3, 2), (16, 4, 8), (16, 64, 4)])
+def test_reads_match_slices(sector_size, cache_sectors, readahead):
+    rng = random.Random(sector_size * 1000 + cache_sectors)
+    data = bytes(rng.getrandbits(8) for _ in range(40 * sector_size + sector_size // 2))  # ends partway into a sector
+    device = blockdev.BlockDevice(io.BytesIO(data), sector_size, cache_sectors * sector_size, readahead)
+    assert len(device) == len(data) and device.sectors == -(-len(data) // sector_size)
+    for _ in range(500):
+        offset = rng.randrange(len(data) + 1)
+        length = rng.randrange(min(len(data) - offset, 6 * sector_size) + 1)
+        choice = rng.randrange(5)
+        if choice == 0:
+            assert device.read(offset, length) == data[offset:offset + length]
+        elif choice == 1:
+            buffer = bytearray(length)
+            assert device.readinto(buffer, offset) == length
+            assert buffer == data[offset:offset + length]
+        elif choice == 2:
+            assert device[offset:offset + length] == data[offset:offset + length]
+        elif choice == 3 and offset < len(data):
+            assert device[offset] == data[offset] and device[offset - len(data)] == data[offset]
+        else:
+            device.prefetch(offset, length)
+        _check_cache(device, data)
+    stats = device.stats()
+    assert stats["misses"] + stats["readahead_sectors"] - stats["evictions"] == stats["cached_sectors"]
+
+
+@pytest.mark.parametrize("reverse", [False, True])
+@pytest.mark.parametrize("sector_size, cache_sectors, readahead", [(4, 2, 1), (5, 3, 2), (16, 8, 4), (64, 1, 8)])
+def test_records_match_slices(reverse, sector_size, cache_sectors, readahead):
+    rng = random.Random(sector_size)
+    data = bytes(rng.getrandbits(8) for _ in range(301))
+    for offset, stride, count in [(0, None, None), (1, 3, None), (5, 7, 20), (2, 11, None), (300 - 3, 3, 1)]:
+        device = blockdev.BlockDevice(io.BytesIO(data), sector_size, cache_sectors * sector_size, readahead)
+        step = 3 if stride is None else stride
+        expected = [int.from_bytes(data[position:position + 2], "little")
+                    for position in range(offset, len(data) - 2, step)][:count]
+        if reverse:
+            expected.reverse()
+        records = device.records(Word, offset=offset, count=count, stride=stride, reverse=reverse)
+        assert [record.value for record in records] == expected
+        _check_cache(device, data)
+
+
+def test_least_recently_used_sector_is_evicted():
+    data = bytes(range(32))
+    device = blockdev.BlockDevice(io.BytesIO(data), sector_size=4, cache_bytes=12, readahead=0)
+    for sector in (0, 2, 4):
+        assert device.read(sector * 4 + 1, 2) == data[sector * 4 + 1:sector * 4 + 3]
+    assert device.read(1, 1) == data[1:2]  # sector 0 is now the most recently used
+    assert device.read(25, 1) == data[25:26]
+    assert list(device.cache) == [4, 0, 6]
+    stats = device.stats()
+    assert (stats["hits"], stats["misses"], stats["evictions"], stats["cached_sectors"]) == (1, 4, 1, 3)
+    assert (stats["reads"], stats["bytes_read"], stats["hit_rate"]) == (4, 16, 1 / 5)
+    device.reset_stats()
+    assert device.stats()["hits"] == device.stats()["misses"] == 0
+
+
+def test_sequential_misses_read_ahead_in_doubling_windows():
+    data = bytes(i % 251 for i in range(40 * 8))
+    f = RecordingFile(data)
+    device = blockdev.BlockDevice(f, sector_size=8, cache_bytes=1 << 10, readahead=8)
+    for sector in range(40):
+        assert device.read(sector * 8 + 3, 1) == data[sector * 8 + 3:sector * 8 + 4]
+    windows = [(position // 8, length // 8) for position, length, _ in f.calls]
+    assert windows == [(0, 1), (1, 2), (3, 3), (6, 5), (11, 9), (20, 9), (29, 9), (38, 2)]  # stops at the end
+    stats = device.stats()
+    assert (stats["misses"], stats["readahead_sectors"], stats["hits"]) == (8, 32, 32)
+
+    f.calls.clear()
+    device = blockdev.BlockDevice(f, sector_size=8, cache_bytes=1 << 10, readahead=8)
+    for sector in (0, 1, 5, 6, 7):  # skipping ahead starts the windows over
+        device.read(sector * 8, 1)
+    assert [(position // 8, length // 8) for position, length, _ in f.calls] == [(0, 1), (1, 2), (5, 1), (6, 2)]
+
+    f.calls.clear()
+    device = blockdev.BlockDevice(f, sector_size=8, cache_bytes=1 << 10, readahead=8)
+    for sector in (5, 0, 1, 3):  # the last window would reach sector 5, which is already cached
+        device.read(sector * 8, 1)
+    assert [(position // 8, length // 8) for position, length, _ in f.calls] == [(5, 1), (0, 1), (1, 2), (3, 2)]
+
+
+def test_readinto_fills_the_callers_buffer():
+    data = bytes(i % 251 for i in range(100))
+    f = RecordingFile(data)
+    device = blockdev.BlockDevice(f, sector_size=8, cache_bytes=1 << 10, readahead=8)
+    buffer = bytearray(40)
+    assert device.readinto(buffer, 16) == 40 and buffer == data[16:56]
+    assert [(position, length) for position, length, _ in f.calls] == [(16, 40)]  # no readahead, either
+    assert f.calls[0][2] is buffer
+    assert all(sector in device.cache for sector in range(2, 7))
+
+    f.calls.clear()
+    buffer = bytearray(6)
+    assert device.readinto(memoryview(buffer)[2:], 96) == 4 and buffer[2:] == data[96:]  # the partial last sector
+    assert [(position, length) for position, length, _ in f.calls] == [(96, 4)] and f.calls[0][2] is buffer
+    assert device.cache[12] == data[96:]
+
+
+def test_partial_last_sector():
+    data = bytes(range(45))
+    device = blockdev.BlockDevice(io.BytesIO(data), sector_size=8, cache_bytes=64, readahead=2)
+    assert device.sectors == 6
+    assert device.read(38, 7) == data[38:] and device.read(44, 1) == data[44:]
+    assert device[-1] == 44 and device[40:100] == data[40:]
+    assert device.cache[5] == data[40:]
+    with pytest.raises(AssertionError):
+        device.read(40, 6)
+    with pytest.raises(AssertionError):
+        device.region(44, 2)
+    with pytest.raises(IndexError):
+        device[45]
@@ -0,0 +1,139 @@
+import random
+import pytest
+import fat12, synthetic
+
+
+@pytest.fixture(params=["numpy", "no numpy"])
+def numpy(request, monkeypatch):
+    # runs a test both with numpy and with the pure Python fallbacks
+    if request.param == "no numpy":
+        monkeypatch.setattr(fat12, "numpy", None)
+    elif fat12.numpy is None:
+        pytest.skip("numpy is not installed")
+    return fat12.numpy
+
+
+def _volume(image):
+    ebpb = fat12.EBPB(image[0:fat12.EBPB.expected_length])
+    return fat12.FAT(ebpb, image)
+
+
+def test_directory_loops_are_listed_once():
+    image = bytearray(synthetic.fat12(files=8, directories=2))
+    fat = _volume(bytes(image))
+    first = fat12.DirectoryIndex(fat, bytes(image)).lookup("DIR00001").start
+    offset, length = fat.byte_extents(first)[0]
+    free = next(position for position in range(offset, offset + length, 32) if image[position] == 0)
+    image[free:free + 32] = synthetic._dirent("SELF", "", 0x10, first, 0)  # back to DIR00001 itself
+    image[free + 32:free + 64] = synthetic._dirent("ROOT", "", 0x10, 0, 0)  # and to the root directory
+    data = bytes(image)
+    index = fat12.DirectoryIndex(_volume(data), data)
+    assert index.lookup("DIR00001/SELF").start == first
+    assert index.lookup("DIR00001/ROOT").start == 0
+    assert not any(path.upper().startswith("DIR00001/SELF/") for path in index.index)
+    index.update(range(offset // synthetic.SECTOR, (offset + length) // synthetic.SECTOR))  # lists DIR00001 again
+    assert index.lookup("DIR00001/SELF").start == first
+
+
+def _reference_table(raw, count):
+    # one entry at a time: entry n is in the 16 bits at byte n * 3 // 2, low twelve bits if n is even, high if odd
+    raw = bytes(raw) + bytes(2 * count + 2)
+    out = []
+    for n in range(count):
+        pair = raw[n * 3 // 2] | raw[n * 3 // 2 + 1] << 8
+        out.append(pair >> 4 if n % 2 else pair & 0xFFF)
+    return out
+
+
+def _walk(fat, start):
+    # one hop per cluster, joining clusters into an extent whenever the next one follows directly
+    out, cluster, seen = [], start, set()
+    while cluster != fat12.FREE:
+        if not 2 <= cluster < len(fat) or cluster in seen:
+            raise ValueError("invalid cluster %d" % cluster)
+        seen.add(cluster)
+        if out and sum(out[-1]) == cluster:
+            out[-1] = (out[-1][0], out[-1][1] + 1)
+        else:
+            out.append((cluster, 1))
+        following = fat[cluster]
+        if following >= fat12.END:
+            break
+        if following in (fat12.FREE, fat12.BAD):
+            raise ValueError("chain runs into cluster %d" % following)
+        cluster = following
+    return out
+
+
+def _outcome(extents, start):
+    try:
+        return extents(start)
+    except ValueError:
+        return ValueError
+
+
+def test_decode_table(numpy):
+    rng = random.Random(0)
+    for _ in range(200):
+        raw = bytes(rng.getrandbits(8) for _ in range(rng.randrange(40)))
+        for count in (0, 1, 2, len(raw) * 2 // 3, len(raw) * 2 // 3 + 1, rng.randrange(40)):
+            entries = fat12.decode_table(raw, count)
+            assert len(entries) == count
+            assert [int(entry) for entry in entries] == _reference_table(raw, count)
+    assert list(fat12.decode_table(b"\xFF" * 3, 2)) == [0xFFF, 0xFFF]
+
+
+@pytest.mark.parametrize("seed, fragment, cluster_size", [(0, True, 1), (1, False, 1), (2, True, 2)])
+def test_extents_match_a_chain_walk(numpy, seed, fragment, cluster_size):
+    fat = _volume(synthetic.fat12(files=96, fragment=fragment, cluster_size=cluster_size, seed=seed))
+    breaks = [cluster for cluster in range(2, len(fat) - 1) if fat[cluster] != cluster + 1]
+    assert list(fat.breaks) == breaks + [len(fat) - 1]
+    chains = 0
+    for start in range(len(fat)):
+        expected = _outcome(lambda cluster: _walk(fat, cluster), start)
+        assert _outcome(fat.extents, start) == expected
+        chains += expected is not ValueError and len(expected) > 1
+    if fragment:
+        assert chains, "no discontiguous chains to check"
+
+
+def _corrupted(image, changes):
+    # image with the first FAT rewritten after setting the given {cluster: entry} changes
+    fat = _volume(image)
+    table = [int(entry) for entry in fat.entries]
+    for cluster, entry in changes.items():
+        table[cluster] = entry
+    image = bytearray(image)
+    image[fat.table_offset:fat.table_offset + fat.table_length] = \
+        synthetic._pack_fat12(table).ljust(fat.table_length, b"\0")
+    return _volume(bytes(image))
+
+
+def test_broken_chains(numpy):
+    image = synthetic.fat12(files=32, seed=3)
+    fat = _volume(image)
+    following = {int(entry) for entry in fat.entries}
+    starts = [cluster for cluster in range(2, len(fat)) if fat[cluster] != fat12.FREE and cluster not in following]
+    start = next(start for start in starts if len(_walk(fat, start)) > 1 and _walk(fat, start)[-1][1] > 1)
+    extents = _walk(fat, start)
+    last = extents[-1][0] + extents[-1][1] - 1
+    free = next(cluster for cluster in range(len(fat) - 1, 1, -1) if fat[cluster] == fat12.FREE)
+    cases = {
+        "loop to the start": {last: start},
+        "loop within an extent": {last: last - 1},
+        "loop to itself": {last: last},
+        "free entry": {last: fat12.FREE},
+        "bad entry": {last: fat12.BAD},
+        "free cluster": {last: free},
+        "bad cluster": {last: free, free: fat12.BAD},
+        "reserved cluster": {last: 0xFF0},
+        "cluster past the end": {last: len(fat)},
+    }
+    for name, changes in cases.items():
+        broken = _corrupted(image, changes)
+        assert broken[last] == changes[last], name
+        assert _outcome(lambda cluster: _walk(broken, cluster), start) is ValueError, name
+        with pytest.raises(ValueError):
+            broken.extents(start)
+    assert fat.extents(start) == extents
+    assert fat.extents(fat12.FREE) == []
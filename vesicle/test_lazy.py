@@ -0,0 +1,37 @@
+import lazy, vesicle
+
+
+class Geometry(vesicle.Vesicle):
+    expected_length = 8
+
+    def __init__(self, b):
+        data = self.begin(b)
+        self.sector_size = data.uint16l(0)
+        self.sectors = data.uint32l(2)
+        self.label = data.ascii(6, length=2, padding=0x20)
+        self.total_size = self.sector_size * self.sectors
+        self.lower_label = self.label.lower()
+
+    def kilobytes(self):
+        return self.total_size // 1024
+
+
+RECORD = bytes([0x00, 0x02, 0x40, 0x0B, 0x00, 0x00]) + b"A "
+
+
+def test_derived_attributes_read_only_their_fields(monkeypatch):
+    record = lazy.parse(Geometry, RECORD)
+    monkeypatch.setattr(lazy, "_materialize", None)  # an eager decode would fail
+    assert record.total_size == 512 * 2880
+    assert record.kilobytes() == 1440
+
+
+def test_other_attributes_decode_the_record():
+    record = lazy.parse(Geometry, RECORD)
+    assert (record.lower_label, record.label) == ("a", "A")
+
+
+def test_slots_only():
+    record = lazy.parse(Geometry, RECORD)
+    assert isinstance(record, Geometry)
+    assert not hasattr(record, "__dict__")
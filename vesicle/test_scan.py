@@ -0,0 +1,31 @@
+import time
+import scan
+from test_stream import Word
+
+
+def value(record):
+    return record.value
+
+
+def slow_size(img):
+    time.sleep(0.5)
+    return len(img)
+
+
+def test_scan_records(tmp_path):
+    path = tmp_path / "words"
+    path.write_bytes(b"\xEE" + b"".join(bytes([i % 256, i // 256, 0]) for i in range(1000)))
+    results = scan.scan_records(str(path), Word, value, offset=1, workers=2, batch=64)
+    assert list(results) == list(range(1000))
+
+
+def test_closing_early_cancels(tmp_path):
+    paths = []
+    for i in range(20):
+        paths.append(str(tmp_path / ("image%d" % i)))
+        (tmp_path / ("image%d" % i)).write_bytes(bytes(i + 1))
+    started = time.perf_counter()
+    results = scan.scan_images(paths, slow_size, workers=2)
+    assert next(results) == 1
+    results.close()
+    assert time.perf_counter() - started < 3  # rather than the 5 seconds that the rest would take
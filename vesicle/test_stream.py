@@ -0,0 +1,34 @@
+import io
+import pytest
+import vesicle, stream
+
+
+class Word(vesicle.Vesicle):
+    expected_length = 3
+
+    def __init__(self, b):
+        data = self.begin(b)
+        self.value = data.uint16l(0)
+
+
+class CountingFile(io.BytesIO):
+    reads = 0
+
+    def read(self, size=-1):
+        self.reads += 1
+        return super().read(size)
+
+
+@pytest.mark.parametrize("count", [1, 7, 8, 9, 20])
+def test_reverse_reads_chunks(count, monkeypatch):
+    monkeypatch.setattr(stream, "_REVERSE_CHUNK", 24)  # 8 records
+    f = CountingFile(b"\xEE\xEE" + b"".join(bytes([i, 1, 0]) for i in range(count)))
+    values = [record.value for record in stream.records(Word, f, offset=2, reverse=True)]
+    assert values == [0x100 + i for i in reversed(range(count))]
+    assert f.reads == -(-count // 8)
+
+
+def test_reverse_truncated():
+    f = io.BytesIO(bytes(10))
+    with pytest.raises(AssertionError):
+        list(stream.records(Word, f, count=4, reverse=True))
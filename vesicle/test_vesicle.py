@@ -0,0 +1,170 @@
+import random
+import pytest
+import vesicle, coverage, records, synthase
+
+
+class Tagged(vesicle.Vesicle):
+    # the field read depends on a decoded value, so no single layout fits every record
+    expected_length = 4
+
+    def __init__(self, b):
+        data = self.begin(b)
+        self.kind = data.uint8(0)
+        if self.kind == 1:
+            self.a = data.uint8(1)
+        else:
+            self.b = data.uint16l(2)
+
+
+class TextTagged(vesicle.Vesicle):
+    # the branch is on a method of a decoded string, rather than on a comparison
+    expected_length = 6
+
+    def __init__(self, b):
+        data = self.begin(b)
+        self.tag = data.ascii(0, 2)
+        if not self.tag.isdigit():
+            self.a = data.uint8(2)
+        self.b = data.uint16l(4)
+
+
+class Derived(vesicle.Vesicle):
+    expected_length = 4
+
+    def __init__(self, b):
+        data = self.begin(b)
+        self.low = data.uint16l(0)
+        self.high = data.uint16l(2)
+        self.total = self.low + (self.high << 16)
+
+
+def test_branching_class_is_not_compiled():
+    assert vesicle.compile_layout(Tagged) is None
+    assert Tagged(bytes([2, 9, 0x34, 0x12])).b == 0x1234
+    assert Tagged(bytes([1, 9, 0x34, 0x12])).a == 9
+
+
+def test_branching_on_string_methods_is_not_compiled():
+    assert vesicle.compile_layout(TextTagged) is None
+    assert TextTagged(b"12\x07\x00\x34\x12").b == 0x1234
+    record = TextTagged(b"ab\x07\x00\x34\x12")
+    assert (record.a, record.b) == (7, 0x1234)
+
+
+class Broken(vesicle.Vesicle):
+    expected_length = 4
+
+    def __init__(self, b):
+        data = self.begin(b)
+        self.value = data.unit8(0)  # a typo, rather than anything the layout cannot record
+
+
+def test_bugs_are_not_hidden_by_layout_compilation():
+    with pytest.raises(AttributeError):
+        vesicle.compile_layout(Broken)
+
+
+def test_replay_must_use_every_recorded_value(monkeypatch):
+    layout = vesicle.compile_layout(Derived)
+    decode = layout.decode
+    for wrong in (lambda data: list(decode(data)) + [0], lambda data: list(decode(data))[:-1]):
+        monkeypatch.setattr(layout, "decode", wrong)
+        with pytest.raises(AssertionError):
+            Derived(bytes(4))
+
+
+def test_arithmetic_on_fields_is_compiled():
+    assert vesicle.compile_layout(Derived) is not None
+    record = Derived(bytes([1, 2, 3, 4]))
+    assert (record.low, record.high, record.total) == (0x0201, 0x0403, 0x04030201)
+
+
+class Entry(vesicle.Union):
+    expected_length = 8
+
+    class Small(vesicle.Vesicle):
+        def __init__(self, b):
+            data = self.begin(b)
+            self.value = data.uint8(1)
+
+    class Large(vesicle.Vesicle):
+        def __init__(self, b):
+            data = self.begin(b)
+            data.fixed(1, 0xAA)
+            self.value = data.uint32l(4)
+
+    union_tags = {1: Small, vesicle.integer_range(2, 3): Large}
+
+
+ENTRIES = bytes([1, 7, 0, 0, 0, 0, 0, 0]) + bytes([3, 0xAA, 0, 0, 1, 2, 0, 0]) + bytes([2, 0xAB, 0, 0, 0, 0, 0, 0])
+
+
+def test_unions_are_not_compiled():
+    assert vesicle.compile_layout(Entry) is None
+    assert [Entry(ENTRIES[i:i + 8]).value for i in (0, 8)] == [7, 0x0201]
+
+
+def test_traced_union():
+    decode = synthase.load_struct(Entry)  # Entry itself, without a C compiler
+    small, large = decode(ENTRIES[0:8]), decode(ENTRIES[8:16])
+    assert (small.union_tag, small.value, large.union_tag, large.value) == (1, 7, 3, 0x0201)
+    for invalid in (ENTRIES[16:24], bytes(8)):  # a Large entry without its fixed byte, and an unknown tag
+        with pytest.raises(AssertionError):
+            decode(invalid)
+
+
+def test_union_coverage():
+    tracked = coverage.Coverage(len(ENTRIES))
+    tracked.parse(Entry, ENTRIES[0:8], 0)
+    tracked.parse(Entry, ENTRIES[8:16], 8)
+    assert tracked.covered().elems == [(0, 2), (8, 10), (12, 16)]
+
+
+def test_union_record_array():
+    pytest.importorskip("numpy")
+    array = records.parse_array(Entry, ENTRIES)
+    assert list(array.column("union_tag")) == [1, 3, 2]
+    assert list(array.check_fixed()) == [True, True, False]
+    assert [entry.value for entry in array.filter_tags(1, 3)] == [7, 0x0201]
+
+
+def test_pack_array_rejects_unions():
+    for cls in (Entry, Entry.Small):
+        with pytest.raises(AssertionError):
+            vesicle.pack_array(cls, [], bytearray(8))
+
+
+def test_coverage_claims_stay_merged():
+    tracked = coverage.Coverage(1 << 20)
+    for offset in range(0, 1 << 19, 4):
+        tracked.parse(Derived, bytes(4), offset)
+    assert tracked._claims == [(0, 1 << 19)]
+    for offset in reversed(range((1 << 19) + 4, 1 << 20, 4)):
+        tracked.claim(offset, offset + 4)
+    assert len(tracked._claims) == 2
+    rng = random.Random(0)
+    for offset in rng.sample(range(0, 1 << 19, 4), 1 << 17):  # out of order: merged in batches
+        tracked.claim(offset, offset + 4)
+        assert len(tracked._claims) <= 2 * coverage.Coverage._MERGE_AT + 1
+    first = tracked.covered()
+    tracked.claim(1 << 19, (1 << 19) + 4)
+    assert first.elems == [(0, 1 << 19), ((1 << 19) + 4, 1 << 20)]
+    assert tracked.covered().elems == [(0, 1 << 20)]
+
+
+class Padded(vesicle.Vesicle):
+    expected_length = 12
+
+    def __init__(self, b):
+        data = self.begin(b)
+        self.value = data.uint16l(0)
+        self.name = data.byte_array(2, 4)
+        data.byte_array(8, 4)  # read, but not kept
+
+
+def test_packing_zeroes_unnamed_bytes():
+    record = Padded.new(value=0x1234, name=b"abcd")
+    buffer = bytearray(b"\xFF" * 12)
+    record.pack_into(buffer)
+    assert bytes(buffer) == b"\x34\x12abcd" + bytes(6)
+    assert Padded(bytes(buffer)).name == b"abcd"
@@ -1,6 +1,11 @@
 # TODO: signed integers
 
-from synthase import assert_that, len
+import bisect
+import mmap
+import operator
+import struct
+import intset
+from synthase import assert_that, dispatch, is_traced, len
 
 
 # def assert_that(x):  # temporary
@@ -8,25 +13,50 @@ from synthase import assert_that, len
 
 
 class Parsable:
-    # TODO: should I compute coverage of the input array?
-    def __init__(self, array, expected_length):
-        print("comparing", len(array), "to", expected_length, "=>", len(array).__eq__(expected_length))
+    def __init__(self, array, expected_length, coverage=None, base=0):
         assert_that(len(array) == expected_length)
         self.array = array
+        # optional coverage.Coverage, which is told about every byte range read (offset by base)
+        self.coverage, self.base = coverage, base
+
+    def _claim(self, offset, length):
+        if self.coverage is not None:
+            self.coverage.claim(self.base + offset, self.base + offset + length)
 
     def fixed(self, offset, *array):
+        self._claim(offset, len(array))
         assert_that(self.array[offset:offset + len(array)] == bytes(array))
 
     def ascii(self, offset, length, padding=0x00):
-        return self.array[offset:offset + length].rstrip(bytes([padding])).decode("LATIN-1")
+        self._claim(offset, length)
+        raw = self.array[offset:offset + length]
+        if isinstance(raw, memoryview):
+            raw = raw.tobytes()
+        if not isinstance(raw, (bytes, bytearray)):  # traced by synthase, which has no strings: keep the bytes
+            return raw
+        return raw.rstrip(bytes([padding])).decode("LATIN-1")
+
+    def utf8(self, offset, length, null_terminator=False):
+        self._claim(offset, length)
+        raw = self.array[offset:offset + length]
+        if isinstance(raw, memoryview):
+            raw = raw.tobytes()
+        if not isinstance(raw, (bytes, bytearray)):
+            return raw
+        return _decode_utf8(raw, null_terminator)
 
     def byte_array(self, offset, length):
+        self._claim(offset, length)
         return self.array[offset:offset + length]
 
     def subparse(self, offset, base):
-        return base(self.array[offset:base.expected_length])
+        if self.coverage is not None:
+            return base(Parsable(self.array[offset:offset + base.expected_length], base.expected_length,
+                                 self.coverage, self.base + offset))
+        return base(self.array[offset:offset + base.expected_length])
 
     def uint8(self, offset):
+        self._claim(offset, 1)  # wider integers are claimed a byte at a time; compiled layouts avoid this entirely
         return self.array[offset]
 
     def uint16l(self, offset):
@@ -47,13 +77,544 @@ class Parsable:
     def uint64b(self, offset):
         return self.uint32b(offset + 4) | (self.uint32b(offset) << 32)
 
+    def enter(self, expected_length):
+        assert_that(len(self.array) == expected_length)
+        return self
+
+
+# Layout compilation: each Vesicle class has its __init__ run once against a _Recorder, which notes the offset and
+# width of every field.  Afterwards, records are decoded by a single struct unpack, and __init__ is run against a
+# _Replay that hands back the already-decoded values in the order they were originally requested (and checks, once
+# __init__ returns, that all of them were).
+# Byte arrays are not unpacked; they are sliced out of the input, so memoryview inputs (see image.py) are never copied.
+
+_INTEGER_CODES = {"uint8": ("B", None), "uint16l": ("H", None), "uint32l": ("I", None), "uint64l": ("Q", None),
+                  "uint16b": ("2s", "big"), "uint32b": ("4s", "big"), "uint64b": ("8s", "big")}
+_BUFFER_TYPES = (bytes, bytearray, memoryview, mmap.mmap)
+
+
+def _decode_utf8(raw, null_terminator):
+    if null_terminator and 0 in raw:
+        raw = raw[:raw.index(0)]
+    return raw.decode("UTF-8")
+
+
+def _encode_text(raw, length, padding):
+    assert len(raw) <= length, "text does not fit in %d bytes: %r" % (length, raw)
+    return raw.ljust(length, bytes([padding]))
+
+
+class _Unrecordable(Exception):
+    pass
+
+
+def _refuse(self, *args):
+    raise _Unrecordable("__init__ makes a decision based on a decoded value, so its layout cannot be recorded")
+
+
+def _probe_methods(empty):
+    # __getattribute__ for probes standing in for values like empty (such as ""): their methods give probes of
+    # whatever type the method gives for empty, so that nothing computed from a decoded value is ever a constant.
+    # Methods that give anything else (such as lists), or that fail for empty, abort the recording.
+    def __getattribute__(self, name):
+        if name.startswith("__") or name in _PROBE_ATTRIBUTES:
+            return object.__getattribute__(self, name)
+        method = getattr(empty, name, None)
+        if not callable(method):
+            _refuse(self)
+
+        def probe_method(*args, **kwargs):
+            try:
+                result = method(*args, **kwargs)
+            except Exception:
+                _refuse(self)
+            for kind, probe in ((str, _ProbeStr), (bytes, _ProbeBytes), (int, _ProbeInt)):
+                if isinstance(result, kind):
+                    return probe()
+            _refuse(self)
+
+        return probe_method
+
+    return __getattribute__
+
+
+_PROBE_ATTRIBUTES = {"field", "op", "args", "computable"}
+
+
+class _ProbeInt:
+    # Stands in for a decoded integer while __init__ is recorded.  Arithmetic on a probe gives another probe (noting
+    # the operation and its operands), but anything that could make __init__ behave differently for different records
+    # (comparisons, truth tests, hashing, or use as an int, such as for an offset or an index) aborts the recording.
+    # Probes from methods (such as str.find) have neither a field nor an operation to compute them from.
+    __slots__ = ("field", "op", "args")
+
+    def __init__(self, field=None, op=None, args=()):
+        self.field, self.op, self.args = field, op, args
+
+    def computable(self):
+        # whether the value can be found from the fields alone (see lazy.py)
+        if self.field is not None:
+            return True
+        return self.op is not None and all(arg.computable() for arg in self.args if isinstance(arg, _ProbeInt))
+
+    __eq__ = __ne__ = __lt__ = __le__ = __gt__ = __ge__ = __bool__ = __hash__ = __index__ = __int__ = _refuse
+    __float__ = __str__ = __format__ = __divmod__ = __rdivmod__ = __round__ = __trunc__ = __floor__ = __ceil__ = _refuse
+    __getattribute__ = _probe_methods(0)
+
+
+def _define_probe_op(op, reverse):
+    if reverse:
+        return lambda self, other: _ProbeInt(None, op, (other, self))
+    return lambda self, other: _ProbeInt(None, op, (self, other))
+
+
+_PROBE_OPS = {"add": operator.add, "sub": operator.sub, "mul": operator.mul, "floordiv": operator.floordiv,
+              "truediv": operator.truediv, "mod": operator.mod, "pow": operator.pow, "lshift": operator.lshift,
+              "rshift": operator.rshift, "and": operator.and_, "or": operator.or_, "xor": operator.xor}
+for _name, _op in _PROBE_OPS.items():
+    setattr(_ProbeInt, "__%s__" % _name, _define_probe_op(_op, False))
+    setattr(_ProbeInt, "__r%s__" % _name, _define_probe_op(_op, True))
+for _name in ("neg", "pos", "invert", "abs"):
+    setattr(_ProbeInt, "__%s__" % _name, (lambda op: lambda self: _ProbeInt(None, op, (self,)))(getattr(operator, _name)))
+
+
+class _ProbeStr(str):
+    __eq__ = __ne__ = __lt__ = __le__ = __gt__ = __ge__ = __bool__ = __hash__ = __len__ = __contains__ = _refuse
+    __iter__ = __reversed__ = __getitem__ = __add__ = __radd__ = __mul__ = __rmul__ = __mod__ = __rmod__ = _refuse
+    __str__ = __format__ = _refuse
+    __getattribute__ = _probe_methods("")
+
+
+class _ProbeBytes(bytes):
+    __eq__ = __ne__ = __lt__ = __le__ = __gt__ = __ge__ = __bool__ = __hash__ = __len__ = __contains__ = _refuse
+    __iter__ = __reversed__ = __getitem__ = __add__ = __radd__ = __mul__ = __rmul__ = __mod__ = __rmod__ = _refuse
+    __str__ = __bytes__ = __format__ = _refuse
+    __getattribute__ = _probe_methods(b"")
+
+
+class Field:
+    def __init__(self, kind, offset, length, code, convert=None):
+        self.kind, self.offset, self.length, self.code, self.convert = kind, offset, length, code, convert
+        self.name = None  # dotted attribute path, filled in when __init__ stores the value somewhere
+        self.base = self.instance = None  # for subparse fields
+        self.expected = None  # for fixed fields
+        self.encode = None  # inverse of convert, for text and big-endian fields
+
+    def __repr__(self):
+        return "Field(%s, %s, %d+%d)" % (self.name, self.kind, self.offset, self.length)
+
+
+class _Recorder(Parsable):
+    def __init__(self, fields, base):
+        self.fields, self.base = fields, base
+
+    def enter(self, expected_length):
+        return self
+
+    def _record(self, probe, kind, offset, length, code, convert=None):
+        if type(offset) != int or type(length) != int:  # such as an offset computed from a decoded value
+            _refuse(self)
+        field = Field(kind, self.base + offset, length, code, convert)
+        self.fields.append(field)
+        if probe is not None:
+            probe.field = field
+        return probe
+
+    def fixed(self, offset, *array):
+        expected = bytes(array)
+
+        def check(value):
+            assert_that(value == expected)
+
+        self._record(None, "fixed", offset, len(array), "%ds" % len(array), check)
+        self.fields[-1].expected = expected
+
+    def ascii(self, offset, length, padding=0x00):
+        strip = bytes([padding])
+        probe = self._record(_ProbeStr(), "ascii", offset, length, "%ds" % length,
+                             lambda value: value.rstrip(strip).decode("LATIN-1"))
+        probe.field.encode = lambda value: _encode_text(value.encode("LATIN-1"), length, padding)
+        return probe
+
+    def utf8(self, offset, length, null_terminator=False):
+        probe = self._record(_ProbeStr(), "utf8", offset, length, "%ds" % length,
+                             lambda value: _decode_utf8(value, null_terminator))
+        probe.field.encode = lambda value: _encode_text(value.encode("UTF-8"), length, 0x00)
+        return probe
+
+    def byte_array(self, offset, length):
+        return self._record(_ProbeBytes(), "byte_array", offset, length, "0s")
+
+    def subparse(self, offset, base):
+        if type(offset) != int:
+            _refuse(self)
+        field = Field("subparse", self.base + offset, base.expected_length, None)
+        field.base = base
+        self.fields.append(field)
+        field.instance = base(_Recorder(self.fields, self.base + offset))
+        return field.instance
+
+    def _integer(self, kind, offset):
+        code, byteorder = _INTEGER_CODES[kind]
+        length = struct.calcsize("<" + code)
+        convert = (lambda value: int.from_bytes(value, byteorder)) if byteorder else None
+        probe = self._record(_ProbeInt(), kind, offset, length, code, convert)
+        if byteorder:
+            probe.field.encode = lambda value: value.to_bytes(length, byteorder)
+        return probe
+
+    def uint8(self, offset):
+        return self._integer("uint8", offset)
+
+    def uint16l(self, offset):
+        return self._integer("uint16l", offset)
+
+    def uint16b(self, offset):
+        return self._integer("uint16b", offset)
+
+    def uint32l(self, offset):
+        return self._integer("uint32l", offset)
+
+    def uint32b(self, offset):
+        return self._integer("uint32b", offset)
+
+    def uint64l(self, offset):
+        return self._integer("uint64l", offset)
+
+    def uint64b(self, offset):
+        return self._integer("uint64b", offset)
+
+
+class _Replay(Parsable):
+    def __init__(self, values):
+        self._values = iter(values)
+        self._next = self._values.__next__
+
+    def enter(self, expected_length):
+        return self
+
+    def _pop(self, *args, **kwargs):
+        try:
+            return self._next()
+        except StopIteration:
+            raise AssertionError("__init__ read more fields than were recorded for its layout") from None
+
+    def finish(self):
+        assert next(self._values, None) is None, "__init__ read fewer fields than were recorded for its layout"
+
+    fixed = ascii = utf8 = byte_array = _pop
+    uint8 = uint16l = uint16b = uint32l = uint32b = uint64l = uint64b = _pop
+
+    def subparse(self, offset, base):
+        return base(self)
+
+
+def _name_fields(instance, prefix, subparses):
+    for name, value in vars(instance).items():
+        field = subparses.get(id(value)) if isinstance(value, Vesicle) else getattr(value, "field", None)
+        if isinstance(field, Field) and field.name is None:
+            field.name = prefix + name
+            if field.kind == "subparse":
+                _name_fields(value, field.name + ".", subparses)
+
+
+class Layout:
+    def __init__(self, cls):
+        self.cls, self.length = cls, cls.expected_length
+        self.fields = []
+        instance = cls(_Recorder(self.fields, 0))
+        self.attributes = list(vars(instance))
+        _name_fields(instance, "", {id(field.instance): field for field in self.fields if field.kind == "subparse"})
+        # integer attributes as recorded: each a probe for one field, or for arithmetic on fields (see lazy.py)
+        self.expressions = {name: value for name, value in vars(instance).items()
+                            if isinstance(value, _ProbeInt) and value.computable()}
+        for field in self.fields:
+            field.instance = None  # only needed while naming
+        self.leaves = [field for field in self.fields if field.code is not None]
+        by_offset = sorted(range(len(self.leaves)), key=lambda i: self.leaves[i].offset)
+        code, position = ["<"], 0
+        for i in by_offset:
+            field = self.leaves[i]
+            if field.offset + field.length > self.length:
+                raise _Unrecordable("field extends past end of record: %s" % field)
+            if field.kind == "byte_array":  # placeholder only; filled in by slicing
+                code.append(field.code)
+                continue
+            if field.offset < position:
+                raise _Unrecordable("overlapping fields cannot be compiled: %s" % field)
+            if field.offset > position:
+                code.append("%dx" % (field.offset - position))
+            code.append(field.code)
+            position = field.offset + field.length
+        if self.length > position:  # so that packing zeroes whatever follows the last field, byte arrays included
+            code.append("%dx" % (self.length - position))
+        self.struct = struct.Struct("".join(code))
+        # maps call order back to struct order; None when they already agree, which is the usual case
+        self.order = None if by_offset == sorted(by_offset) else [by_offset.index(i) for i in range(len(by_offset))]
+        self.order_struct = None if self.order is None else by_offset
+        self.converters = [(i, field.convert) for i, field in enumerate(self.leaves) if field.convert is not None]
+        self.slices = [(i, field.offset, field.offset + field.length)
+                       for i, field in enumerate(self.leaves) if field.kind == "byte_array"]
+        # every record of this layout reads the same bytes, so coverage can be claimed per record instead of per field
+        self.coverage = intset.IntegerSet([(field.offset, field.offset + field.length)
+                                           for field in self.leaves if field.length])
+        self._packer = None
+
+    def instrument(self, profile):
+        # selects this layout's decode function: an instrumented one from profile, or (for None) the plain one
+        if profile is None:
+            self.__dict__.pop("decode", None)
+        else:
+            self.decode = profile.wrap(self)
+
+    def decode(self, data):
+        assert_that(len(data) == self.length)
+        values = self.struct.unpack_from(data)
+        if self.order is not None:
+            values = [values[i] for i in self.order]
+        if self.converters or self.slices:
+            values = list(values)
+            for i, convert in self.converters:
+                values[i] = convert(values[i])
+            if self.slices and isinstance(data, mmap.mmap):
+                data = memoryview(data)
+            for i, start, end in self.slices:
+                values[i] = data[start:end]
+        return values
+
+    def packer(self):
+        # Generates (once) a function that writes a record back with a single struct pack_into, plus one slice
+        # assignment per byte array.  The struct spans the whole record, so bytes not covered by any field are zeroed,
+        # as are fields (byte arrays included) that __init__ reads without storing anywhere, since there is no value
+        # to take them from.
+        if self._packer is None:
+            namespace = {"pack_into": self.struct.pack_into}
+            arguments, slices = [], []
+            for i in (self.order_struct or range(len(self.leaves))):
+                field = self.leaves[i]
+                value = "obj.%s" % field.name
+                if field.kind == "fixed":
+                    namespace["_fixed_%d" % i] = field.expected
+                    arguments.append("_fixed_%d" % i)
+                elif field.kind == "byte_array":
+                    arguments.append("b''")
+                    if field.name is not None:
+                        slices.append("    view[offset + %d:offset + %d] = %s\n"
+                                      % (field.offset, field.offset + field.length, value))
+                elif field.name is None:
+                    arguments.append("%s" % (b"\0" * field.length if field.convert is not None else 0))
+                elif field.encode is not None:
+                    namespace["_encode_%d" % i] = field.encode
+                    arguments.append("_encode_%d(%s)" % (i, value))
+                else:
+                    arguments.append(value)
+            source = "def pack(obj, buffer, offset):\n    pack_into(buffer, offset, %s)\n" % ", ".join(arguments)
+            if slices:
+                source += "    view = memoryview(buffer)\n" + "".join(slices)
+            exec(source, namespace)
+            self._packer = namespace["pack"]
+        return self._packer
+
+    def pack_into(self, obj, buffer, offset=0):
+        self.packer()(obj, buffer, offset)
+
+    def pack_array(self, objs, buffer, offset=0):
+        # fills consecutive records, starting at offset
+        pack, length = self.packer(), self.length
+        for obj in objs:
+            pack(obj, buffer, offset)
+            offset += length
+
+    def __repr__(self):
+        return "Layout(%s, %s)" % (self.cls.__name__, self.fields)
+
+
+_layouts = {}
+_profile = None  # the active instrument.Profile, if any
+
+
+def compile_layout(cls):
+    # Returns None for classes whose __init__ cannot be recorded, such as those that branch on decoded values (which
+    # _ProbeInt and friends refuse to be compared or tested): these are always parsed through Parsable instead.
+    # Unions get None too, since their fields depend on the tag; their members each have layouts of their own.
+    if cls not in _layouts:
+        if issubclass(cls, Union):
+            _layouts[cls] = None
+            return None
+        try:
+            _layouts[cls] = Layout(cls)
+        except _Unrecordable:  # anything else is a bug, in __init__ or here, and is left to propagate
+            _layouts[cls] = None
+        else:
+            if _profile is not None:
+                _layouts[cls].instrument(_profile)
+    return _layouts[cls]
+
+
+def set_profile(profile):
+    # Instrumentation is chosen per layout, rather than checked per record, so that decoding costs nothing extra
+    # while no profile is active.  Returns the previously active profile.
+    global _profile
+    previous, _profile = _profile, profile
+    for layout in _layouts.values():
+        if layout is not None:
+            layout.instrument(profile)
+    return previous
+
+
+def pack_array(cls, objs, buffer, offset=0):
+    assert issubclass(cls, Vesicle) and cls._union is None, \
+        "pack unions and union members one record at a time, so that their tags are written: %s" % cls
+    layout = compile_layout(cls)
+    assert layout is not None, "cannot pack %s: its layout could not be compiled" % cls
+    layout.pack_array(objs, buffer, offset)
+
+
+def _checked_init(init):
+    # Wraps the __init__ of a Vesicle subclass, so that once the outermost __init__ returns, a replayed decode is
+    # checked to have used up exactly the values recorded for the layout.
+    def __init__(self, *args, **kwargs):
+        init(self, *args, **kwargs)
+        if type(self).__init__ is __init__:
+            replay = self.__dict__.pop("_replay", None)
+            if replay is not None:
+                replay.finish()
+
+    __init__.__name__, __init__.__qualname__, __init__.__doc__ = init.__name__, init.__qualname__, init.__doc__
+    return __init__
+
 
 class Vesicle:
     expected_length = None
+    _union = None
+
+    def __init_subclass__(cls, **kwargs):
+        super().__init_subclass__(**kwargs)
+        if "__init__" in cls.__dict__:
+            cls.__init__ = _checked_init(cls.__dict__["__init__"])
 
     def begin(self, data):
         assert self.expected_length is not None, "expected_length not specified on Vesicle subclass: %s" % self.__class__
+        if isinstance(data, Parsable):  # nested subparse of a record that is already being decoded
+            return data.enter(self.expected_length)
+        layout = compile_layout(self.__class__)
+        if layout is not None and isinstance(data, _BUFFER_TYPES):
+            self._replay = _Replay(layout.decode(data))
+            return self._replay
         return Parsable(data, self.expected_length)
 
+    @classmethod
+    def new(cls, **attributes):
+        # builds a record from scratch (for example, to be written with pack_into) without parsing anything
+        instance = cls.__new__(cls)
+        instance.__dict__.update(attributes)
+        return instance
+
+    def pack_into(self, buffer, offset=0):
+        layout = getattr(self, "_layout", None) or compile_layout(type(self))
+        assert layout is not None, "cannot pack %s: its layout could not be compiled" % type(self)
+        layout.pack_into(self, buffer, offset)
+        union = self._union
+        if union is not None:
+            tag = self.__dict__.get("union_tag")
+            if tag is None:
+                tags = union.tags_for(type(self))
+                if tags.is_contiguous() and tags.high() - tags.low() == 1:
+                    tag = tags.low()
+            # otherwise, the tag is part of the member's own fields (as for SFS continuation entries)
+            if tag is not None:
+                union._tag_struct.pack_into(buffer, offset + union.union_tag_offset, tag)
+
+    def _items(self):
+        return self.__dict__.items()
+
     def __repr__(self):
-        return "{%s}" % ", ".join("%s = %s" % (k, v) for k, v in sorted(self.__dict__.items()) if k[0] != '_')
+        return "{%s}" % ", ".join("%s = %s" % (k, v.tobytes() if isinstance(v, memoryview) else v)
+                                  for k, v in sorted(self._items()) if k[0] != '_')
+
+
+# Tagged unions: the tag is read from a fixed offset of the record, and selects which member class parses the rest.
+# Tags are dispatched through a flat table built when the Union subclass is created (or, for tags too wide for a
+# table, a sorted index of tag intervals), so each record costs a single lookup.  When traced by synthase, the tag
+# is not known, so every member is traced and the tag selects between their attributes (see synthase.dispatch).
+
+def integer_range(low, high):  # inclusive on both ends, so that 0xFF can be written
+    return intset.range(low, high - low + 1)
+
+
+def integer_union(*parts):
+    out = intset.empty
+    for part in parts:
+        out |= part if isinstance(part, intset.IntegerSet) else intset.range(part, 1)
+    return out
+
+
+_TABLE_LIMIT_BITS = 16
+
+
+class Union:
+    expected_length = None
+    union_tag_offset = 0
+    union_tag_kind = "uint8"
+    union_tags = {}
+
+    def __init_subclass__(cls, **kwargs):
+        super().__init_subclass__(**kwargs)
+        assert cls.expected_length is not None, "expected_length not specified on Union subclass: %s" % cls
+        code, byteorder = _INTEGER_CODES[cls.union_tag_kind]
+        assert byteorder is None, "big-endian union tags are not yet supported"
+        cls._tag_struct = struct.Struct("<" + code)
+        bits = cls._tag_struct.size * 8
+        intervals = []
+        for key, member in cls.union_tags.items():
+            assert issubclass(member, Vesicle), "union member is not a Vesicle: %s" % member
+            if member.expected_length is None:
+                member.expected_length = cls.expected_length
+            member._union = cls
+            assert member.expected_length == cls.expected_length, "union member has wrong length: %s" % member
+            tags = key if isinstance(key, intset.IntegerSet) else intset.range(key, 1)
+            assert tags.high() <= 2 ** bits, "union tag does not fit in %s: %s" % (cls.union_tag_kind, tags)
+            intervals += [(low, high, member) for low, high in tags.elems]
+        intervals.sort(key=lambda interval: interval[0])
+        for (_, high, _), (low, _, _) in zip(intervals, intervals[1:]):
+            assert high <= low, "overlapping union tags in %s" % cls
+        if bits <= _TABLE_LIMIT_BITS:
+            cls._table = [None] * 2 ** bits
+            for low, high, member in intervals:
+                cls._table[low:high] = [member] * (high - low)
+        else:
+            cls._table = None
+            cls._starts = [low for low, _, _ in intervals]
+            cls._intervals = intervals
+
+    @classmethod
+    def member_for(cls, tag):
+        if is_traced(tag):  # traced by synthase: every member is traced, and their attributes selected by the tag
+            members = {cls.tags_for(member): member for member in dict.fromkeys(cls.union_tags.values())}
+            return lambda data: dispatch(cls.__name__, tag, members, data)
+        if cls._table is not None:
+            member = cls._table[tag]
+        else:
+            i = bisect.bisect_right(cls._starts, tag) - 1
+            member = cls._intervals[i][2] if i >= 0 and tag < cls._intervals[i][1] else None
+        assert member is not None, "invalid union tag %#x for %s" % (tag, cls.__name__)
+        return member
+
+    @classmethod
+    def tags_for(cls, member):
+        return integer_union(*(key for key, value in cls.union_tags.items() if value is member))
+
+    @classmethod
+    def read_tag(cls, data):
+        if isinstance(data, Parsable):
+            return getattr(data.enter(cls.expected_length), cls.union_tag_kind)(cls.union_tag_offset)
+        if isinstance(data, _BUFFER_TYPES):
+            assert_that(len(data) == cls.expected_length)
+            return cls._tag_struct.unpack_from(data, cls.union_tag_offset)[0]
+        return getattr(Parsable(data, cls.expected_length), cls.union_tag_kind)(cls.union_tag_offset)
+
+    def __new__(cls, data):
+        tag = cls.read_tag(data)
+        instance = cls.member_for(tag)(data)
+        instance.union_tag = tag
+        return instance